@@ -4,23 +4,1308 @@ Canary Rollout Controller for Network Devices
 Performs HTTP API calls to network devices in a canary fashion
 """
 
+import asyncio
+import bisect
+import codecs
+import difflib
+import fcntl
+import heapq
+import ipaddress
+import itertools
 import json
 import time
 import random
 import requests
 import threading
 import logging
+import hashlib
+import os
+import sys
+import uuid
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from datetime import datetime
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs, quote, unquote
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Device push concurrency limits (global across rollouts / default per rollout)
+MAX_INFLIGHT_GLOBAL = int(os.environ.get('CANARY_MAX_INFLIGHT', '64'))
+MAX_INFLIGHT_PER_ROLLOUT = int(os.environ.get('CANARY_MAX_INFLIGHT_PER_ROLLOUT', '16'))
+# Threads for blocking rollout bookkeeping (finishing, serialization, deltas, pre-flight, git)
+# shared by all rollouts; device HTTP calls have a pool of their own (DEVICE_IO_WORKERS)
+IO_WORKERS = int(os.environ.get('CANARY_IO_WORKERS', '32'))
+
+# HTTP serving: "threaded" (bounded worker pool) or "single" (one request at a time)
+SERVER_MODE = os.environ.get('CANARY_SERVER_MODE', 'threaded')
+HTTP_WORKERS = int(os.environ.get('CANARY_HTTP_WORKERS', '16'))
+# Connections allowed to wait for a worker before we answer 503
+HTTP_MAX_PENDING = int(os.environ.get('CANARY_HTTP_MAX_PENDING', '64'))
+HTTP_RETRY_AFTER = int(os.environ.get('CANARY_HTTP_RETRY_AFTER', '1'))
+# /start-rollout bodies are streamed in chunks of this size and rejected (413) above the limit
+MAX_BODY_BYTES = int(os.environ.get('CANARY_MAX_BODY_BYTES', str(256 * 1024 * 1024)))
+BODY_CHUNK_SIZE = 64 * 1024
+
+# Device transport: "simulated" (demo delays) or "http" (real calls over a pooled session)
+DEVICE_TRANSPORT = os.environ.get('CANARY_DEVICE_TRANSPORT', 'simulated')
+# Distinct hosts kept warm, and keep-alive connections per host
+DEVICE_POOL_HOSTS = int(os.environ.get('CANARY_DEVICE_POOL_HOSTS', '256'))
+DEVICE_POOL_SIZE = int(os.environ.get('CANARY_DEVICE_POOL_SIZE', str(MAX_INFLIGHT_GLOBAL)))
+# Default (connect, read) timeouts when the rollout spec doesn't set them
+DEVICE_TIMEOUT = ('5s', '30s')
+# Default parallelism for batch device validation
+VALIDATION_CONCURRENCY = int(os.environ.get('CANARY_VALIDATION_CONCURRENCY', '32'))
+# Device call threads: one per global push slot plus one per validation slot, so a call
+# holding a slot never waits for a thread and stuck devices can't starve bookkeeping
+DEVICE_IO_WORKERS = MAX_INFLIGHT_GLOBAL + VALIDATION_CONCURRENCY
+# Check configs for address conflicts and shadowed firewall rules before any device is touched ("off" to skip)
+PREFLIGHT = os.environ.get('CANARY_PREFLIGHT', 'on') == 'on'
+# Pre-flight findings kept on the rollout record
+PREFLIGHT_REPORT_MAX = 20
+
+# Finished rollouts are compacted to summaries; keep at most this many, idle for at most TTL seconds
+FINISHED_ROLLOUTS_MAX = int(os.environ.get('CANARY_FINISHED_ROLLOUTS_MAX', '500'))
+FINISHED_ROLLOUTS_TTL = int(os.environ.get('CANARY_FINISHED_ROLLOUTS_TTL', '3600'))
+# Optional directory where summaries are written for history queries after eviction
+HISTORY_DIR = os.environ.get('CANARY_HISTORY_DIR', '')
+
+# Delta pushes: config versions remembered for diffing, and the largest delta (as a fraction
+# of the full body) still worth sending instead of the full config
+CONFIG_VERSIONS_MAX = int(os.environ.get('CANARY_CONFIG_VERSIONS_MAX', '8'))
+DELTA_MAX_RATIO = float(os.environ.get('CANARY_DELTA_MAX_RATIO', '0.5'))
+
+# Adaptive per-host push concurrency (AIMD): starting/min/max limit, and the push latency
+# above which a host counts as overloaded (seconds)
+HOST_CONCURRENCY_INITIAL = int(os.environ.get('CANARY_HOST_CONCURRENCY_INITIAL', '8'))
+HOST_CONCURRENCY_MIN = int(os.environ.get('CANARY_HOST_CONCURRENCY_MIN', '1'))
+HOST_CONCURRENCY_MAX = int(os.environ.get('CANARY_HOST_CONCURRENCY_MAX', '64'))
+HOST_LATENCY_TARGET = float(os.environ.get('CANARY_HOST_LATENCY_TARGET', '5'))
+
+# Device push retries (defaults for a rollout's retry spec): attempts and full-jitter backoff bounds
+RETRY_MAX_ATTEMPTS = int(os.environ.get('CANARY_RETRY_MAX_ATTEMPTS', '3'))
+RETRY_BACKOFF = os.environ.get('CANARY_RETRY_BACKOFF', '1s')
+RETRY_MAX_BACKOFF = os.environ.get('CANARY_RETRY_MAX_BACKOFF', '10s')
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+# Per-host circuit breaker: consecutive unanswered pushes that open it, and seconds before a probe
+BREAKER_FAILURES = int(os.environ.get('CANARY_BREAKER_FAILURES', '5'))
+BREAKER_COOLDOWN = float(os.environ.get('CANARY_BREAKER_COOLDOWN', '30'))
+
+# Kubernetes reconciler for NetworkRollout/ConfigRollout resources ("on" to enable)
+KUBE_WATCH = os.environ.get('CANARY_KUBE_WATCH', 'off') == 'on'
+# API server base URL; the pod's service account token and CA are used when present
+KUBE_API = os.environ.get('CANARY_KUBE_API', 'https://kubernetes.default.svc')
+KUBE_TOKEN_PATH = '/var/run/secrets/kubernetes.io/serviceaccount/token'
+KUBE_CA_PATH = '/var/run/secrets/kubernetes.io/serviceaccount/ca.crt'
+# Namespace to watch (empty watches all namespaces)
+WATCH_NAMESPACE = os.environ.get('CANARY_WATCH_NAMESPACE', '')
+RECONCILE_WORKERS = int(os.environ.get('CANARY_RECONCILE_WORKERS', '2'))
+# Per-key requeue backoff after a failed reconcile, list page size and watch duration (seconds)
+RECONCILE_BACKOFF = 1
+RECONCILE_MAX_BACKOFF = 300
+KUBE_LIST_PAGE = 500
+KUBE_WATCH_TIMEOUT = 300
+ROLLOUT_API = 'rollout.io/v1alpha1'
+# ConfigRollout targets are bare device ids; their API endpoint is this template with {id}
+DEVICE_ENDPOINT_TEMPLATE = os.environ.get('CANARY_DEVICE_ENDPOINT_TEMPLATE', '')
+# Resource status writes: at most STATUS_WRITE_BATCH resources per interval (phase changes go out at once)
+STATUS_WRITE_INTERVAL = float(os.environ.get('CANARY_STATUS_WRITE_INTERVAL', '2'))
+STATUS_WRITE_BATCH = int(os.environ.get('CANARY_STATUS_WRITE_BATCH', '50'))
+STATUS_CONFLICT_RETRIES = 3
+# Longer device lists are left out of resource status in favour of deviceCounts
+STATUS_DEVICE_LIST_MAX = int(os.environ.get('CANARY_STATUS_DEVICE_LIST_MAX', '100'))
+
+# Sharding rollouts across replicas: 'kube' (coordination.k8s.io Leases), 'file' (CANARY_LEASE_DIR) or '' (off).
+# Resources are reconciled by their owner; HTTP API requests are forwarded to the owner of the rollout id
+# when CANARY_PEER_URL_TEMPLATE is set
+LEASE_BACKEND = os.environ.get('CANARY_LEASE_BACKEND', '')
+LEASE_DIR = os.environ.get('CANARY_LEASE_DIR', '/var/run/canary-controller/leases')
+LEASE_NAMESPACE = os.environ.get('CANARY_LEASE_NAMESPACE', os.environ.get('NAMESPACE', 'default'))
+# Seconds a lease stays valid without renewal; replicas renew every third of it
+LEASE_DURATION = float(os.environ.get('CANARY_LEASE_DURATION', '15'))
+# This replica's name in leases and resource status (the pod name)
+IDENTITY = os.environ.get('CANARY_IDENTITY', os.environ.get('HOSTNAME', f'canary-{os.getpid()}'))
+LEADER_LEASE = 'canary-controller-leader'
+MEMBER_LEASE_PREFIX = 'canary-controller-member-'
+# Ring points per replica; more points even out the share of resources each one owns
+SHARD_VNODES = 64
+# A replica's HTTP API base URL, with {identity} (e.g. http://{identity}.canary-controller-pods:8080)
+PEER_URL_TEMPLATE = os.environ.get('CANARY_PEER_URL_TEMPLATE', '')
+PEER_CONNECT_TIMEOUT = 5
+
+# Progress events kept per rollout for SSE/long-poll subscribers, and concurrent subscribers
+# allowed (each holds an HTTP worker while it waits)
+EVENT_BUFFER = int(os.environ.get('CANARY_EVENT_BUFFER', '1000'))
+EVENT_STREAMS_MAX = int(os.environ.get('CANARY_EVENT_STREAMS_MAX', str(max(1, HTTP_WORKERS // 2))))
+# SSE keep-alive interval and the longest long-poll wait (seconds)
+EVENT_HEARTBEAT = 15
+LONG_POLL_MAX = 60
+
+# Histogram buckets (seconds)
+PUSH_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STEP_DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+VALIDATION_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Write-ahead journal of rollout progress for crash-resume (empty disables it). Only storage that
+# outlives the pod (a StatefulSet volume) survives rescheduling; on an emptyDir it covers container restarts
+JOURNAL_PATH = os.environ.get('CANARY_JOURNAL_PATH', '')
+# Appends are buffered and fsynced together at most this often (seconds)
+JOURNAL_FSYNC_INTERVAL = float(os.environ.get('CANARY_JOURNAL_FSYNC_INTERVAL', '0.2'))
+# Compact the journal in the background after this many rollouts finish (0 = only at startup)
+JOURNAL_COMPACT_EVERY = int(os.environ.get('CANARY_JOURNAL_COMPACT_EVERY', '100'))
+
+TERMINAL_PHASES = ('Completed', 'Failed')
+# Stopped because another replica took over the rollout's resource: done here, not terminal
+HANDED_OFF = 'HandedOff'
+FINISHED_PHASES = TERMINAL_PHASES + (HANDED_OFF,)
+# Fields kept when a finished rollout is compacted (config, targets and index are dropped)
+SUMMARY_FIELDS = ('phase', 'message', 'current_step', 'start_time', 'completed_devices', 'failed_devices',
+                  'carried_counts', 'step_validation', 'preflight')
+# /rollout-status: device list fields that are paginated, and scalar fields in summary views
+DEVICE_LIST_FIELDS = ('completed_devices', 'failed_devices', 'target_devices')
+STATUS_SUMMARY_FIELDS = ('phase', 'message', 'current_step', 'start_time', 'end_time', 'paused_until',
+                         'step_validation', 'preflight', 'total_devices')
+# Record fields a full /rollout-status view may show; the rest (limits, retry policy, handoff counts) are internal
+STATUS_FIELDS = STATUS_SUMMARY_FIELDS + ('config', 'canary_steps') + DEVICE_LIST_FIELDS
+
+class DeviceState(Enum):
+    PENDING = 'Pending'
+    IN_PROGRESS = 'InProgress'
+    COMPLETED = 'Completed'
+    FAILED = 'Failed'
+
+class PushOutcome(Enum):
+    OK = 'ok'
+    # 408/429/5xx answers: worth another attempt
+    RETRYABLE = 'retryable'
+    # Connection errors and timeouts: worth another attempt, and count against the host's circuit
+    UNREACHABLE = 'unreachable'
+    FAILED = 'failed'
+
+class PackedStrings:
+    """Append-only string column stored as one UTF-8 blob plus end offsets"""
+    
+    __slots__ = ('blob', 'ends')
+    
+    def __init__(self):
+        self.blob = bytearray()
+        self.ends = array('Q')
+    
+    def append(self, value):
+        """Add a string as the next row"""
+        self.blob += value.encode('utf-8')
+        self.ends.append(len(self.blob))
+    
+    def __getitem__(self, row):
+        start = self.ends[row - 1] if row else 0
+        return self.blob[start:self.ends[row]].decode('utf-8')
+    
+    def __len__(self):
+        return len(self.ends)
+
+class DeviceTable:
+    """Columnar per-rollout device table addressed by row (target order).
+    
+    Ids are interned and mapped to rows, endpoints are packed into one blob, tokens
+    are interned and each device's state is one byte, instead of a dict per device.
+    """
+    
+    STATES = tuple(DeviceState)
+    CODES = {state: code for code, state in enumerate(STATES)}
+    
+    def __init__(self, devices):
+        self.ids = []
+        self.endpoints = PackedStrings()
+        self.tokens = []
+        # Per-device validation endpoints are rare, so only rows that set one are stored
+        self.validation_endpoints = {}
+        self.rows = {}
+        for device in devices:
+            if not isinstance(device, dict) or 'id' not in device:
+                raise ValueError("Invalid targetDevices entry: expected an object with an id")
+            device_id = sys.intern(str(device['id']))
+            if device_id in self.rows:
+                continue
+            row = len(self.ids)
+            self.rows[device_id] = row
+            self.ids.append(device_id)
+            self.endpoints.append(device.get('apiEndpoint') or '')
+            token = device.get('authToken')
+            # Fleets usually share a handful of tokens
+            self.tokens.append(sys.intern(token) if token else None)
+            if device.get('validationEndpoint'):
+                self.validation_endpoints[row] = device['validationEndpoint']
+        # State code per row; PENDING is code 0
+        self.states = bytearray(len(self.ids))
+        self.counts = {state: 0 for state in DeviceState}
+        self.counts[DeviceState.PENDING] = len(self.ids)
+        # Every row before the cursor has already been handed to a step
+        self.cursor = 0
+        # Each mark bumps the revision and logs its row, so changes[r] is the row changed at revision r + 1
+        self.revision = 0
+        self.changes = array('L')
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def next_pending(self, count):
+        """Take up to count pending rows in target order, advancing the cursor"""
+        batch = []
+        while len(batch) < count and self.cursor < len(self.ids):
+            if self.states[self.cursor] == 0:
+                batch.append(self.cursor)
+            self.cursor += 1
+        return batch
+    
+    def pending_in(self, start, end):
+        """Pending rows in a target-order window (resuming a step), moving the cursor past it"""
+        self.cursor = max(self.cursor, end)
+        return [row for row in range(start, min(end, len(self.ids))) if self.states[row] == 0]
+    
+    def mark(self, row, state):
+        """Move a row to a new state, keeping per-state counts current"""
+        self.counts[self.STATES[self.states[row]]] -= 1
+        self.counts[state] += 1
+        self.states[row] = self.CODES[state]
+        self.revision += 1
+        self.changes.append(row)
+    
+    def changes_since(self, revision, limit=None):
+        """Current state of devices changed after revision, and the revision to continue from"""
+        start = max(0, min(revision, self.revision))
+        end = self.revision if limit is None else min(self.revision, start + limit)
+        # A device changed several times in the window is reported once, in its current state
+        rows = dict.fromkeys(self.changes[start:end])
+        return [{'id': self.ids[row], 'state': self.STATES[self.states[row]].value} for row in rows], end
+    
+    def row(self, device_id):
+        """Row of a device id, or None if it isn't in this rollout"""
+        return self.rows.get(device_id)
+    
+    def state(self, device_id):
+        """Current state of a device, or None if it isn't in this rollout"""
+        row = self.rows.get(device_id)
+        return None if row is None else self.STATES[self.states[row]]
+    
+    def device(self, row):
+        """A row as the targetDevices entry it was built from"""
+        device = {'id': self.ids[row]}
+        if self.endpoints[row]:
+            device['apiEndpoint'] = self.endpoints[row]
+        if self.tokens[row] is not None:
+            device['authToken'] = self.tokens[row]
+        if row in self.validation_endpoints:
+            device['validationEndpoint'] = self.validation_endpoints[row]
+        return device
+    
+    def to_list(self):
+        """Materialize targetDevices (status output and journaling only)"""
+        return [self.device(row) for row in range(len(self.ids))]
+
+def rollout_shard_key(rollout_id):
+    """Ring key of a rollout id: resource rollouts (namespace/name@generation) shard by their resource"""
+    return rollout_id.rpartition('@')[0] or rollout_id
+
+def step_windows(total, canary_steps):
+    """Target-order [start, end) window each canary step selects from a fresh table of total devices"""
+    windows = []
+    start = 0
+    for step in canary_steps:
+        end = min(total, start + int((step['percentage'] / 100) * total))
+        windows.append([start, end])
+        start = end
+    return windows
+
+class RolloutJournal:
+    """Append-only JSON-lines log of rollout progress, fsynced in batches"""
+    
+    def __init__(self, path, fsync_interval, compact_every=0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.lock = threading.Lock()
+        self.file = None
+        self.dirty = False
+        # Rollouts finished since the last compaction, and whether one is running
+        self.finished = 0
+        self.compacting = False
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    
+    def open(self):
+        """Start appending (after replay) along with the background fsync thread"""
+        if not self.path:
+            return
+        self.file = open(self.path, 'a')
+        threading.Thread(target=self.sync_loop, name='journal-fsync', daemon=True).start()
+    
+    def append(self, event):
+        """Buffer one event; a crash loses at most the last fsync interval"""
+        if self.file is None:
+            return
+        line = json.dumps(event, separators=(',', ':'), default=self.encode) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.dirty = True
+    
+    def encode(self, value):
+        """JSON fallback for device tables in journaled specs"""
+        if isinstance(value, DeviceTable):
+            return value.to_list()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+    
+    def sync_loop(self):
+        """Background fsync batching"""
+        while True:
+            time.sleep(self.fsync_interval)
+            self.sync()
+    
+    def sync(self):
+        """Flush buffered events and fsync them as one batch"""
+        with self.lock:
+            if not self.dirty:
+                return
+            self.file.flush()
+            self.dirty = False
+            # Our own descriptor: compaction may swap and close self.file meanwhile
+            fd = os.dup(self.file.fileno())
+        # fsync outside the lock so appends from the event loop never wait on the disk
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    
+    def record_start(self, rollout_id, spec, start_time, carried=None, resource=None):
+        """Journal a new rollout with the spec needed to resume it, counts carried over from a handoff
+        and the [plural, namespace, name] of the resource it runs for"""
+        self.append({'type': 'start', 'rolloutId': rollout_id, 'spec': spec, 'startTime': start_time,
+                     'carried': carried, 'resource': resource})
+    
+    def record_step(self, rollout_id, step_index, window):
+        """Journal a step start and the target-order window of devices it selected"""
+        self.append({'type': 'step', 'rolloutId': rollout_id, 'step': step_index, 'window': window})
+    
+    def record_device(self, rollout_id, device_id, success):
+        """Journal one device outcome"""
+        self.append({'type': 'device', 'rolloutId': rollout_id, 'deviceId': device_id, 'ok': success})
+    
+    def record_phase(self, rollout_id, phase, message=None):
+        """Journal a terminal phase, compacting in the background every compact_every of them"""
+        self.append({'type': 'phase', 'rolloutId': rollout_id, 'phase': phase, 'message': message})
+        with self.lock:
+            self.finished += 1
+            if self.file is None or not self.compact_every or self.finished < self.compact_every or self.compacting:
+                return
+            self.finished = 0
+            self.compacting = True
+        threading.Thread(target=self.compact_live, name='journal-compact', daemon=True).start()
+    
+    def replay(self, limit=None):
+        """Fold the journal (or its first limit bytes) into per-rollout state: spec, current step window,
+        device outcomes, phase"""
+        states = {}
+        if not self.path or not os.path.exists(self.path):
+            return states
+        
+        with open(self.path, 'rb') as f:
+            consumed = 0
+            for line in f:
+                consumed += len(line)
+                if limit is not None and consumed > limit:
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # Torn write from the crash we are recovering from
+                    continue
+                
+                rollout_id = event['rolloutId']
+                if event['type'] == 'start':
+                    states[rollout_id] = {
+                        'spec': event['spec'],
+                        'start_time': event['startTime'],
+                        'carried': event.get('carried'),
+                        'resource': event.get('resource'),
+                        'step': 0,
+                        'window': None,
+                        'devices': {},
+                        'phase': 'Progressing',
+                        'message': None
+                    }
+                    continue
+                
+                state = states.get(rollout_id)
+                if state is None:
+                    continue
+                if event['type'] == 'step':
+                    state['step'] = event['step']
+                    state['window'] = event['window']
+                elif event['type'] == 'device':
+                    state['devices'][event['deviceId']] = event['ok']
+                elif event['type'] == 'phase':
+                    state['phase'] = event['phase']
+                    state['message'] = event.get('message')
+        
+        return states
+    
+    def compact(self, states):
+        """Atomically rewrite the journal with only the rollouts that are still running (before open())"""
+        if not self.path:
+            return
+        
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            self.write_states(f, states)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+    
+    def compact_live(self):
+        """Compact while rollouts keep appending: fold the journal up to a mark, then carry over
+        everything appended after it and swap files"""
+        try:
+            with self.lock:
+                self.file.flush()
+                mark = self.file.tell()
+            states = self.replay(mark)
+            
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'wb') as f, open(self.path, 'rb') as journal:
+                self.write_states(f, states)
+                # Most of the tail is copied and fsynced without holding up appends
+                journal.seek(mark)
+                f.write(journal.read())
+                f.flush()
+                os.fsync(f.fileno())
+                with self.lock:
+                    self.file.flush()
+                    f.write(journal.read())
+                    f.flush()
+                    os.replace(temp_path, self.path)
+                    self.file.close()
+                    self.file = open(self.path, 'a')
+                    # The last few events reach the disk with the next batched fsync
+                    self.dirty = True
+            logger.info(f"🗜️ Compacted rollout journal to {len([s for s in states.values() if s['phase'] not in FINISHED_PHASES])} running rollouts")
+        except OSError as e:
+            logger.error(f"Failed to compact rollout journal: {str(e)}")
+        finally:
+            self.compacting = False
+    
+    def write_states(self, f, states):
+        """Write the events that rebuild every unfinished rollout in states"""
+        for rollout_id, state in states.items():
+            if state['phase'] in FINISHED_PHASES:
+                continue
+            events = [{'type': 'start', 'rolloutId': rollout_id, 'spec': state['spec'], 'startTime': state['start_time'],
+                       'carried': state.get('carried'), 'resource': state.get('resource')}]
+            if state['window'] is not None:
+                events.append({'type': 'step', 'rolloutId': rollout_id, 'step': state['step'], 'window': state['window']})
+            events.extend({'type': 'device', 'rolloutId': rollout_id, 'deviceId': device_id, 'ok': ok}
+                          for device_id, ok in state['devices'].items())
+            for event in events:
+                f.write(json.dumps(event, separators=(',', ':')).encode() + b'\n')
+
+class RolloutRegistry:
+    """Live rollout records plus a bounded, evicting set of finished-rollout summaries"""
+    
+    def __init__(self, max_finished, finished_ttl, history_dir=''):
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self.history_dir = history_dir
+        # Re-entrant so handlers can hold it across several registry calls
+        self.lock = threading.RLock()
+        self.live = {}
+        # rollout id -> (last access time, summary), least recently used first
+        self.finished = OrderedDict()
+    
+    def add(self, rollout_id, record):
+        """Register a new (or restarted) rollout"""
+        with self.lock:
+            self.finished.pop(rollout_id, None)
+            self.live[rollout_id] = record
+            self.evict()
+    
+    def get(self, rollout_id):
+        """Live record, in-memory summary, or spilled summary; None if unknown"""
+        with self.lock:
+            if rollout_id in self.live:
+                return self.live[rollout_id]
+            
+            # Summaries idle past the TTL go before they can be served (and their access time refreshed)
+            self.evict()
+            if rollout_id in self.finished:
+                _, summary = self.finished.pop(rollout_id)
+                self.finished[rollout_id] = (time.time(), summary)
+                return summary
+        
+        return self.load_history(rollout_id)
+    
+    def __contains__(self, rollout_id):
+        return rollout_id in self.live
+    
+    def ids(self):
+        """Live rollout ids"""
+        with self.lock:
+            return list(self.live)
+    
+    def __len__(self):
+        return len(self.live)
+    
+    def values(self):
+        """Live rollout records"""
+        return self.live.values()
+    
+    def finish(self, rollout_id):
+        """Compact a terminal rollout to its summary; returns the full record it replaced"""
+        with self.lock:
+            record = self.live.get(rollout_id)
+            if record is None or record.get('phase') not in FINISHED_PHASES:
+                return None
+            
+            del self.live[rollout_id]
+            summary = {k: record[k] for k in SUMMARY_FIELDS if k in record}
+            summary['end_time'] = datetime.now().isoformat()
+            summary['total_devices'] = len(record['device_table']) if 'device_table' in record else 0
+            summary['revision'] = record['device_table'].revision if 'device_table' in record else 0
+            self.finished[rollout_id] = (time.time(), summary)
+            self.evict()
+        
+        self.spill(rollout_id, summary)
+        return record
+    
+    def evict(self):
+        """Drop summaries over the size cap or idle past the TTL (oldest first)"""
+        now = time.time()
+        while self.finished:
+            rollout_id, (accessed_at, _) = next(iter(self.finished.items()))
+            if len(self.finished) <= self.max_finished and now - accessed_at <= self.finished_ttl:
+                break
+            self.finished.popitem(last=False)
+    
+    def history_path(self, rollout_id):
+        """History file for a rollout id (quoted so ids can't escape the directory)"""
+        return os.path.join(self.history_dir, f"{quote(rollout_id, safe='')}.json")
+    
+    def spill(self, rollout_id, summary):
+        """Write a finished rollout's summary to the history store"""
+        if not self.history_dir:
+            return
+        try:
+            os.makedirs(self.history_dir, exist_ok=True)
+            with open(self.history_path(rollout_id), 'w') as f:
+                json.dump(summary, f)
+        except OSError as e:
+            logger.error(f"Failed to write rollout history for {rollout_id}: {str(e)}")
+    
+    def load_history(self, rollout_id):
+        """Read an evicted rollout's summary back from the history store"""
+        if not self.history_dir:
+            return None
+        try:
+            with open(self.history_path(rollout_id), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read rollout history for {rollout_id}: {str(e)}")
+            return None
+
+def rollout_status_view(rollout, fields=None, offset=0, limit=None):
+    """JSON-serializable view of a rollout record's public fields, optionally only some of them and one page
+    of each device list"""
+    keys = [k for k in STATUS_FIELDS if k in rollout or (k == 'target_devices' and 'device_table' in rollout)]
+    if fields:
+        keys = [k for k in keys if k in fields]
+    end = None if limit is None else offset + limit
+    
+    view = {}
+    for key in keys:
+        if key == 'target_devices':
+            # Rendered from the device table, only for the requested page
+            table = rollout['device_table']
+            view[key] = [table.device(row) for row in range(len(table))[offset:end]]
+        elif key in DEVICE_LIST_FIELDS:
+            view[key] = rollout[key][offset:end]
+        else:
+            view[key] = rollout[key]
+    return view
+
+def rollout_status_summary(rollout):
+    """Poll-sized view: scalar fields, revision and per-state device counts (no config or device lists)"""
+    summary = {k: rollout[k] for k in STATUS_SUMMARY_FIELDS if k in rollout}
+    table = rollout.get('device_table')
+    if table is not None:
+        summary['revision'] = table.revision
+        summary['total_devices'] = len(table)
+        summary['device_counts'] = {state.value: count for state, count in table.counts.items()}
+    else:
+        summary['revision'] = rollout.get('revision', 0)
+        summary['device_counts'] = {
+            DeviceState.COMPLETED.value: len(rollout.get('completed_devices', [])),
+            DeviceState.FAILED.value: len(rollout.get('failed_devices', []))
+        }
+    return summary
+
+def rollout_status_delta(rollout, since, limit=None):
+    """Summary plus devices whose state changed after revision since (sinceVersion polling)"""
+    delta = rollout_status_summary(rollout)
+    table = rollout.get('device_table')
+    if table is not None:
+        devices, next_version = table.changes_since(since, limit)
+    elif since < delta['revision']:
+        # Finished rollouts keep only outcome lists, so report every outcome once
+        devices = [{'id': d, 'state': DeviceState.COMPLETED.value} for d in rollout.get('completed_devices', [])]
+        devices += [{'id': d, 'state': DeviceState.FAILED.value} for d in rollout.get('failed_devices', [])]
+        next_version = delta['revision']
+    else:
+        devices, next_version = [], delta['revision']
+    
+    delta['sinceVersion'] = since
+    delta['nextVersion'] = next_version
+    delta['devices'] = devices
+    # False when limit cut the delta short; poll again from nextVersion
+    delta['complete'] = next_version >= delta['revision']
+    return delta
+
+class DeviceTransport:
+    """Keep-alive HTTP session shared by every device push and validation call"""
+    
+    def __init__(self, pool_hosts, pool_size):
+        self.session = requests.Session()
+        # One connection pool per host; connections (and their TLS sessions) are reused across pushes
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def post(self, url, payload, headers, timeout):
+        """POST JSON on a pooled connection; timeout is a (connect, read) pair in seconds"""
+        return self.session.post(url, json=payload, headers=headers, timeout=tuple(timeout))
+    
+    def post_body(self, url, body, headers, timeout):
+        """POST an already-serialized body (bytes or a PayloadBody) on a pooled connection"""
+        return self.session.post(url, data=body, headers=headers, timeout=tuple(timeout))
+
+class PayloadBody:
+    """Read-only file-like body over byte segments.
+    
+    requests sends it with a Content-Length and http.client streams it block by
+    block, so the shared serialized config is never copied per device.
+    """
+    
+    def __init__(self, segments):
+        self.segments = [memoryview(s) for s in segments]
+        self.length = sum(len(s) for s in self.segments)
+        self.seek(0)
+    
+    def __len__(self):
+        return self.length
+    
+    def seek(self, offset, whence=0):
+        """Rewind (requests does this before resending a body); only offset 0 is supported"""
+        if offset != 0 or whence != 0:
+            raise ValueError("PayloadBody can only be rewound to the start")
+        self.index = 0
+        self.offset = 0
+        self.position = 0
+        return 0
+    
+    def tell(self):
+        return self.position
+    
+    def read(self, size=-1):
+        """Next slice of the current segment (a memoryview, not a copy)"""
+        while self.index < len(self.segments):
+            segment = self.segments[self.index]
+            if self.offset < len(segment):
+                end = len(segment) if size is None or size < 0 else min(len(segment), self.offset + size)
+                chunk = segment[self.offset:end]
+                self.offset = end
+                self.position += len(chunk)
+                return chunk
+            self.index += 1
+            self.offset = 0
+        return b''
+
+class PayloadTemplate:
+    """Device request body with the shared fields serialized once; deviceId and timestamp are spliced in per send"""
+    
+    def __init__(self, fields):
+        # Same shape as {**fields, 'timestamp': ..., 'deviceId': ...}
+        self.prefix = json.dumps(fields, separators=(',', ':')).encode()[:-1] + b',"timestamp":"'
+        self.headers_by_token = {}
+    
+    def body(self, device_id, timestamp):
+        """Request body for one device, sharing the serialized config"""
+        suffix = f'{timestamp}","deviceId":{json.dumps(device_id)}}}'.encode()
+        return PayloadBody([self.prefix, suffix])
+    
+    def size(self):
+        """Approximate body size in bytes (the per-device suffix is a few dozen bytes)"""
+        return len(self.prefix)
+    
+    def headers(self, token):
+        """Request headers for an auth token, built once per distinct token"""
+        headers = self.headers_by_token.get(token)
+        if headers is None:
+            headers = {
+                'Content-Type': 'application/json',
+                'Authorization': f"Bearer {token or 'dummy-token'}"
+            }
+            self.headers_by_token[token] = headers
+        return headers
+
+def config_version(config):
+    """Content hash identifying a config version"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, separators=(',', ':')).encode()).hexdigest()[:16]
+
+def json_pointer(path, key):
+    """Extend a JSON Pointer (RFC 6901) with one reference token"""
+    return path + '/' + str(key).replace('~', '~0').replace('/', '~1')
+
+def config_diff(old, new, path=''):
+    """JSON Patch (RFC 6902) operations turning old into new.
+    
+    Objects are diffed key by key; lists are aligned with difflib so an inserted or
+    removed entry (e.g. one firewall rule) doesn't turn the rest of the list into
+    replacements.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{'op': 'remove', 'path': json_pointer(path, key)} for key in old if key not in new]
+        for key, value in new.items():
+            if key not in old:
+                ops.append({'op': 'add', 'path': json_pointer(path, key), 'value': value})
+            else:
+                ops.extend(config_diff(old[key], value, json_pointer(path, key)))
+        return ops
+    
+    if isinstance(old, list) and isinstance(new, list):
+        ops = []
+        old_keys = [json.dumps(item, sort_keys=True) for item in old]
+        new_keys = [json.dumps(item, sort_keys=True) for item in new]
+        matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                continue
+            # Ops apply in order, so the list already holds new[:j1] followed by old[i1:]
+            paired = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+            for k in range(paired):
+                ops.extend(config_diff(old[i1 + k], new[j1 + k], json_pointer(path, j1 + k)))
+            ops.extend({'op': 'remove', 'path': json_pointer(path, j1 + paired)} for _ in range(i2 - i1 - paired))
+            ops.extend({'op': 'add', 'path': json_pointer(path, j1 + k), 'value': new[j1 + k]}
+                       for k in range(paired, j2 - j1))
+        return ops
+    
+    if type(old) is type(new) and old == new:
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+class AppliedConfigs:
+    """Last config version each device applied successfully, plus recent versions to diff against.
+    
+    Only touched from the executor's event loop. A device whose base version is
+    unknown or has been evicted simply gets a full push.
+    """
+    
+    def __init__(self, max_versions):
+        self.max_versions = max_versions
+        self.devices = {}
+        self.versions = OrderedDict()
+    
+    def remember(self, version, config):
+        """Keep a config version available as a diff base"""
+        self.versions[version] = config
+        self.versions.move_to_end(version)
+        while len(self.versions) > self.max_versions:
+            self.versions.popitem(last=False)
+    
+    def base(self, device_id):
+        """(version, config) the device last applied, or None if it can't be diffed against"""
+        version = self.devices.get(device_id)
+        if version is None or version not in self.versions:
+            return None
+        return version, self.versions[version]
+    
+    def applied(self, device_id, version):
+        """Record a successful push"""
+        self.devices[device_id] = version
+    
+    def forget(self, device_id):
+        """Device state is unknown after a failed push; its next push is a full one"""
+        self.devices.pop(device_id, None)
+
+class PrefixTrie:
+    """Binary trie over IPv4 prefixes; every lookup walks at most 32 levels however many prefixes it holds"""
+    
+    def __init__(self):
+        # Node: [zero child, one child, {key: value} stored at exactly this prefix]
+        self.root = [None, None, None]
+    
+    def insert(self, network, key, value):
+        """Store value under key at network unless the key is already there; returns the stored value"""
+        node = self.root
+        bits = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (bits >> (31 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            node[2] = {}
+        return node[2].setdefault(key, value)
+    
+    def path(self, network):
+        """Nodes from the root towards network's node, stopping where the trie ends"""
+        node = self.root
+        bits = int(network.network_address)
+        yield node
+        for i in range(network.prefixlen):
+            node = node[(bits >> (31 - i)) & 1]
+            if node is None:
+                return
+            yield node
+    
+    def covering(self, network):
+        """Entry dicts of network and every broader prefix containing it, broadest first"""
+        for node in self.path(network):
+            if node[2]:
+                yield node[2]
+    
+    def longest_match(self, address):
+        """Entries of the most specific prefix containing address, or None"""
+        match = None
+        for entries in self.covering(ipaddress.IPv4Network(address)):
+            match = entries
+        return match
+    
+    def first_within(self, network):
+        """Some (key, value) stored at network or a more specific prefix inside it, or None"""
+        node = None
+        for depth, node in enumerate(self.path(network)):
+            pass
+        if node is None or depth != network.prefixlen:
+            return None
+        # Every node was created on the way to a stored prefix, so this descent ends at one
+        while not node[2]:
+            node = node[0] or node[1]
+        return next(iter(node[2].items()))
+
+def config_conflicts(config):
+    """Overlapping subnets, ambiguous routes, unreachable gateways and shadowed firewall rules in a device config.
+    
+    Interfaces, routes and rule sources go into prefix tries, so each entry is checked
+    against the others in at most 32 steps instead of by pairwise comparison. Entries
+    that don't parse are skipped; returns (errors, warnings) as lists of {path, message}.
+    """
+    errors = []
+    warnings = []
+    
+    connected = PrefixTrie()
+    names = set()
+    for i, interface in enumerate(config.get('interfaces') or []):
+        names.add(interface.get('name') if isinstance(interface, dict) else None)
+        try:
+            network = ipaddress.IPv4Interface(interface['ip']).network
+        except (KeyError, TypeError, ValueError):
+            continue
+        overlap = next(iter(next(connected.covering(network), {}).items()), None) or connected.first_within(network)
+        if overlap is not None:
+            errors.append({'path': f"$.interfaces[{i}].ip",
+                           'message': f"subnet {network} overlaps interface {overlap[0]} ({overlap[1]})"})
+        connected.insert(network, interface.get('name'), network)
+    
+    routes = PrefixTrie()
+    for i, route in enumerate(config.get('routing') or []):
+        path = f"$.routing[{i}]"
+        try:
+            destination = ipaddress.IPv4Network(route['destination'])
+            gateway = ipaddress.IPv4Address(route['gateway'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        
+        metric = route.get('metric', 0)
+        first = routes.insert(destination, metric, i)
+        if first != i:
+            errors.append({'path': f"{path}.destination",
+                           'message': f"{destination} with metric {metric} is also routed by routing[{first}]"})
+        
+        match = connected.longest_match(gateway)
+        if 'interface' in route and route['interface'] not in names:
+            errors.append({'path': f"{path}.interface", 'message': f"unknown interface {route['interface']}"})
+        elif match is None:
+            errors.append({'path': f"{path}.gateway", 'message': f"gateway {gateway} is not on any connected subnet"})
+        elif 'interface' in route and route['interface'] not in match:
+            name, network = next(iter(match.items()))
+            errors.append({'path': f"{path}.gateway",
+                           'message': f"gateway {gateway} is on {name} ({network}), not {route['interface']}"})
+        
+        for entries in connected.covering(destination):
+            for name, network in entries.items():
+                if name != route.get('interface') and network.prefixlen < destination.prefixlen:
+                    warnings.append({'path': f"{path}.destination",
+                                     'message': f"{destination} overrides part of {name}'s connected subnet {network}"})
+    
+    rules = PrefixTrie()
+    for i, rule in enumerate((config.get('firewall') or {}).get('rules') or []):
+        try:
+            source = ipaddress.IPv4Network(rule['source'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        protocol = rule.get('protocol', 'any')
+        port = rule.get('port')
+        # Earlier rules matching everything this one does: same protocol and port, the whole protocol, or anything
+        keys = {(protocol, port), (protocol, None), ('any', None)}
+        # The first of those in rule order decides the traffic, whichever prefix it sits on
+        shadow = min((entries[key] for entries in rules.covering(source) for key in keys if key in entries), default=None)
+        if shadow is not None:
+            j, name, action = shadow
+            if action != rule.get('action'):
+                errors.append({'path': f"$.firewall.rules[{i}]",
+                               'message': f"never matches: rule {name} (rules[{j}], {action}) matches all its traffic first"})
+            else:
+                warnings.append({'path': f"$.firewall.rules[{i}]",
+                                 'message': f"redundant: rule {name} (rules[{j}]) already {action}s all its traffic"})
+        rules.insert(source, (protocol, port), (i, rule.get('name'), rule.get('action')))
+    
+    return errors, warnings
+
+class Histogram:
+    """Cumulative-bucket latency histogram in the Prometheus style"""
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value):
+        """Record one observation"""
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class ControllerMetrics:
+    """Counters and histograms updated as rollouts progress, so a scrape never walks the rollouts"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices_configured = 0
+        self.devices_failed = 0
+        self.devices_pending = 0
+        self.rollouts = {'Started': 0, 'Completed': 0, 'Failed': 0, HANDED_OFF: 0}
+        self.pushes = {'full': 0, 'delta': 0}
+        self.push_bytes = {'full': 0, 'delta': 0}
+        self.push_retries = 0
+        self.circuit_rejections = 0
+        self.push_latency = Histogram(PUSH_LATENCY_BUCKETS)
+        self.step_duration = Histogram(STEP_DURATION_BUCKETS)
+        self.validation_latency = Histogram(VALIDATION_LATENCY_BUCKETS)
+    
+    def rollout_started(self, device_count):
+        """Count a new rollout and its devices as pending"""
+        with self.lock:
+            self.rollouts['Started'] += 1
+            self.devices_pending += device_count
+    
+    def rollout_finished(self, phase, devices_left):
+        """Count a terminal rollout; devices it never reached stop counting as pending"""
+        with self.lock:
+            self.rollouts[phase] += 1
+            self.devices_pending -= devices_left
+    
+    def device_started(self):
+        """A device left the pending set"""
+        with self.lock:
+            self.devices_pending -= 1
+    
+    def device_finished(self, success, seconds):
+        """Count a device outcome and its push latency"""
+        with self.lock:
+            if success:
+                self.devices_configured += 1
+            else:
+                self.devices_failed += 1
+            self.push_latency.observe(seconds)
+    
+    def device_pushed(self, kind, size):
+        """Count one push attempt ('full' or 'delta') and its body size"""
+        with self.lock:
+            self.pushes[kind] += 1
+            self.push_bytes[kind] += size
+    
+    def push_retried(self):
+        """Count a push retried after a transient failure"""
+        with self.lock:
+            self.push_retries += 1
+    
+    def circuit_rejected(self):
+        """Count a push failed fast by an open circuit breaker"""
+        with self.lock:
+            self.circuit_rejections += 1
+    
+    def observe_step(self, seconds):
+        """Record one step duration"""
+        with self.lock:
+            self.step_duration.observe(seconds)
+    
+    def observe_validation(self, seconds):
+        """Record one step validation latency"""
+        with self.lock:
+            self.validation_latency.observe(seconds)
+    
+    def snapshot(self, active_rollouts, uptime):
+        """Legacy JSON form of /metrics"""
+        with self.lock:
+            return {
+                "active_rollouts": active_rollouts,
+                "total_devices_configured": self.devices_configured,
+                "total_devices_failed": self.devices_failed,
+                "total_devices_pending": self.devices_pending,
+                "uptime_seconds": int(uptime)
+            }
+    
+    def render_prometheus(self, active_rollouts, uptime):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        
+        def histogram(name, help_text, hist):
+            samples = [f'{name}_bucket{{le="{bound}"}} {count}' for bound, count in zip(hist.buckets, hist.counts)]
+            samples.append(f'{name}_bucket{{le="+Inf"}} {hist.count}')
+            samples.append(f"{name}_sum {hist.sum:.6f}")
+            samples.append(f"{name}_count {hist.count}")
+            metric(name, 'histogram', help_text, samples)
+        
+        with self.lock:
+            metric('canary_active_rollouts', 'gauge', 'Rollouts currently executing',
+                   [f"canary_active_rollouts {active_rollouts}"])
+            metric('canary_rollouts_total', 'counter', 'Rollouts by lifecycle event',
+                   [f'canary_rollouts_total{{phase="{phase}"}} {count}' for phase, count in self.rollouts.items()])
+            metric('canary_devices_configured_total', 'counter', 'Devices configured successfully',
+                   [f"canary_devices_configured_total {self.devices_configured}"])
+            metric('canary_devices_failed_total', 'counter', 'Devices that failed configuration',
+                   [f"canary_devices_failed_total {self.devices_failed}"])
+            metric('canary_devices_pending', 'gauge', 'Devices waiting in executing rollouts',
+                   [f"canary_devices_pending {self.devices_pending}"])
+            metric('canary_device_pushes_total', 'counter', 'Device push attempts by body kind',
+                   [f'canary_device_pushes_total{{kind="{kind}"}} {count}' for kind, count in self.pushes.items()])
+            metric('canary_device_push_bytes_total', 'counter', 'Device push body bytes by body kind',
+                   [f'canary_device_push_bytes_total{{kind="{kind}"}} {size}' for kind, size in self.push_bytes.items()])
+            metric('canary_device_push_retries_total', 'counter', 'Device pushes retried after a transient failure',
+                   [f"canary_device_push_retries_total {self.push_retries}"])
+            metric('canary_circuit_rejections_total', 'counter', 'Device pushes failed fast by an open host circuit',
+                   [f"canary_circuit_rejections_total {self.circuit_rejections}"])
+            histogram('canary_device_push_seconds', 'Per-device config push latency', self.push_latency)
+            histogram('canary_step_duration_seconds', 'Canary step duration including validation', self.step_duration)
+            histogram('canary_validation_seconds', 'Step validation latency', self.validation_latency)
+            metric('canary_uptime_seconds', 'gauge', 'Controller uptime',
+                   [f"canary_uptime_seconds {int(uptime)}"])
+        
+        return '\n'.join(lines) + '\n'
+
+class RolloutEvents:
+    """Per-rollout progress events for SSE and long-poll subscribers.
+    
+    Each rollout keeps its last buffer_size events numbered from 1; publishing never
+    blocks on subscribers, and waiters are woken as soon as an event is recorded.
+    Logs of finished rollouts are kept for the most recent finished_max rollouts.
+    """
+    
+    def __init__(self, buffer_size, finished_max):
+        self.buffer_size = buffer_size
+        self.finished_max = finished_max
+        self.lock = threading.Lock()
+        self.logs = {}
+        self.closed = OrderedDict()
+        self.listeners = []
+    
+    def subscribe(self, callback):
+        """Call callback(rollout_id, event) for every event; it runs on the publishing thread and must not block"""
+        self.listeners.append(callback)
+    
+    def publish(self, rollout_id, event_type, **data):
+        """Record an event and wake the rollout's subscribers"""
+        with self.lock:
+            log = self.logs.get(rollout_id)
+            if log is None or log['closed']:
+                # A new (or resumed) rollout under this id starts a fresh log
+                self.closed.pop(rollout_id, None)
+                log = {'events': deque(maxlen=self.buffer_size), 'seq': 0, 'closed': False,
+                       'changed': threading.Condition(self.lock)}
+                self.logs[rollout_id] = log
+            log['seq'] += 1
+            event = {'id': log['seq'], 'type': event_type, 'rolloutId': rollout_id,
+                     'timestamp': datetime.now().isoformat()}
+            event.update(data)
+            log['events'].append(event)
+            log['changed'].notify_all()
+        
+        for callback in self.listeners:
+            callback(rollout_id, event)
+    
+    def close(self, rollout_id):
+        """Mark a rollout's log finished so streams end once they've caught up"""
+        with self.lock:
+            log = self.logs.get(rollout_id)
+            if log is None:
+                return
+            log['closed'] = True
+            log['changed'].notify_all()
+            self.closed[rollout_id] = True
+            while len(self.closed) > self.finished_max:
+                oldest, _ = self.closed.popitem(last=False)
+                del self.logs[oldest]
+    
+    def wait(self, rollout_id, since, timeout):
+        """Events after since, blocking up to timeout for the first one.
+        
+        Returns (events, missed, closed), where missed means events after since were
+        already dropped from the buffer, or None if the rollout has no log.
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            log = self.logs.get(rollout_id)
+            if log is None:
+                return None
+            while log['seq'] <= since and not log['closed']:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                log['changed'].wait(remaining)
+            events = [e for e in log['events'] if e['id'] > since]
+            missed = bool(events) and events[0]['id'] > since + 1
+            return events, missed, log['closed']
+
+class RequestTooLarge(Exception):
+    """Request body exceeds MAX_BODY_BYTES"""
+
+class RolloutConflict(Exception):
+    """A rollout with the requested id is still running"""
+
+class StreamingRolloutParser:
+    """Incrementally parse a /start-rollout body from byte chunks.
+    
+    The top-level object is walked token by token so targetDevices is decoded one
+    device at a time straight into a DeviceTable and the raw body is never held in
+    memory as a whole; other members (config, canarySteps, ...) are decoded as
+    complete values.
+    """
+    
+    WHITESPACE = ' \t\n\r'
+    # Characters that can continue a number: 1 may be the start of 1.5e-07
+    NUMBER_CHARS = '0123456789.eE+-'
+    
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+    
+    def fill(self):
+        """Append the next chunk to the buffer, dropping consumed text; False at end of body"""
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            self.buffer = self.buffer[self.pos:] + self.text.decode(b'', final=True)
+            self.pos = 0
+            return False
+        self.buffer = self.buffer[self.pos:] + self.text.decode(chunk)
+        self.pos = 0
+        return True
+    
+    def peek(self):
+        """Skip whitespace and return the next character ('' at end of body)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+    
+    def expect(self, char):
+        """Consume the next non-whitespace character, which must be char"""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid rollout body: expected '{char}', found '{found or 'end of body'}'")
+        self.pos += 1
+    
+    def value(self):
+        """Decode one complete JSON value, reading more of the body until it parses"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number is only complete once something other than a number character
+                # follows it; raw_decode happily stops at 1 in a chunk ending with 1.5e
+                truncated = end == len(self.buffer) or (
+                    isinstance(value, (int, float)) and self.buffer[end] in self.NUMBER_CHARS)
+                if not truncated or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow the window geometrically so large values aren't re-decoded once per chunk
+            target = 2 * (len(self.buffer) - self.pos)
+            while len(self.buffer) - self.pos < target and self.fill():
+                pass
+    
+    def devices(self):
+        """Yield targetDevices entries one at a time"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == ']':
+                self.pos += 1
+                return
+            self.expect(',')
+    
+    def parse(self):
+        """Parse the whole body into the rollout spec dict"""
+        spec = {}
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+        else:
+            while True:
+                key = self.value()
+                if not isinstance(key, str):
+                    raise ValueError("Invalid rollout body: object keys must be strings")
+                self.expect(':')
+                if key == 'targetDevices':
+                    spec[key] = DeviceTable(self.devices())
+                else:
+                    spec[key] = self.value()
+                if self.peek() == '}':
+                    self.pos += 1
+                    break
+                self.expect(',')
+        if self.peek():
+            raise ValueError("Invalid rollout body: unexpected data after the top-level object")
+        return spec
+
 class CanaryController(BaseHTTPRequestHandler):
     def do_GET(self):
         """Handle GET requests"""
-        if self.path == '/health':
+        path = urlparse(self.path).path
+        if path.startswith('/rollouts/') and path.endswith('/events'):
+            self.handle_rollout_events(unquote(path[len('/rollouts/'):-len('/events')]))
+            
+        elif self.path == '/health':
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
@@ -28,16 +1313,20 @@ class CanaryController(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps(response).encode())
             
         elif self.path == '/metrics':
+            active_rollouts = len(self.server.active_rollouts)
+            uptime = time.time() - self.server.start_time
+            accept = self.headers.get('Accept', '')
+            
             self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            metrics = {
-                "active_rollouts": len(self.server.active_rollouts),
-                "total_devices_configured": sum(len(r.get('completed_devices', [])) for r in self.server.active_rollouts.values()),
-                "total_devices_failed": sum(len(r.get('failed_devices', [])) for r in self.server.active_rollouts.values()),
-                "uptime_seconds": int(time.time() - self.server.start_time)
-            }
-            self.wfile.write(json.dumps(metrics).encode())
+            # Prometheus scrapers ask for text/plain (or OpenMetrics); everything else keeps the JSON form
+            if 'text/plain' in accept or 'openmetrics' in accept:
+                self.send_header('Content-type', 'text/plain; version=0.0.4')
+                self.end_headers()
+                self.wfile.write(self.server.metrics.render_prometheus(active_rollouts, uptime).encode())
+            else:
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps(self.server.metrics.snapshot(active_rollouts, uptime)).encode())
             
         else:
             self.send_response(404)
@@ -47,47 +1336,138 @@ class CanaryController(BaseHTTPRequestHandler):
         """Handle POST requests"""
         if self.path == '/start-rollout':
             self.handle_start_rollout()
-        elif self.path == '/rollout-status':
+        elif urlparse(self.path).path == '/rollout-status':
             self.handle_rollout_status()
         elif self.path == '/validate-device':
             self.handle_validate_device()
+        elif self.path == '/validate-devices':
+            self.handle_validate_devices()
+        elif self.path in ('/promote-rollout', '/abort-rollout', '/extend-pause'):
+            self.handle_pause_action()
         else:
             self.send_response(404)
             self.end_headers()
     
+    def handle_rollout_events(self, rollout_id):
+        """Stream rollout progress as server-sent events, or long-poll for the next batch of events"""
+        try:
+            query = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+            # EventSource reconnects send Last-Event-ID; long-pollers pass since
+            since = int(self.headers.get('Last-Event-ID') or query.get('since', 0))
+            stream = 'text/event-stream' in self.headers.get('Accept', '') or query.get('stream') == '1'
+            events = self.server.events
+            
+            # Without a worker pool a subscriber would hold the only thread serving requests:
+            # streams are refused and long-polls answer straight away
+            single = self.server.request_pool is None
+            if single and stream:
+                self.send_response(503)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                response = {"status": "error", "message": "Event streaming needs CANARY_SERVER_MODE=threaded; poll without stream=1 instead"}
+                self.wfile.write(json.dumps(response).encode())
+                return
+            
+            # Subscribers hold a worker for their whole wait (relayed ones too), so cap them to keep the pool serving
+            if not self.server.event_streams.acquire(blocking=False):
+                self.send_response(503)
+                self.send_header('Retry-After', str(HTTP_RETRY_AFTER))
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                response = {"status": "error", "message": "Too many event subscribers"}
+                self.wfile.write(json.dumps(response).encode())
+                return
+            
+            try:
+                if self.server.active_rollouts.get(rollout_id) is None and events.wait(rollout_id, since, 0) is None:
+                    if self.forward_rollout_request(rollout_id):
+                        return
+                    self.send_response(404)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    response = {"status": "error", "message": f"Rollout {rollout_id} not found"}
+                    self.wfile.write(json.dumps(response).encode())
+                    return
+                
+                if stream:
+                    self.stream_rollout_events(rollout_id, since)
+                else:
+                    wait = 0 if single else min(float(query.get('wait', 30)), LONG_POLL_MAX)
+                    result = events.wait(rollout_id, since, wait) or ([], False, True)
+                    batch, missed, closed = result
+                    response = {
+                        "rolloutId": rollout_id,
+                        "events": batch,
+                        "nextSince": batch[-1]['id'] if batch else since,
+                        "missed": missed,
+                        "closed": closed
+                    }
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps(response).encode())
+            finally:
+                self.server.event_streams.release()
+            
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info(f"📴 Event subscriber for {rollout_id} disconnected")
+        except Exception as e:
+            logger.error(f"Failed to serve rollout events: {str(e)}")
+            self.send_response(500)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            response = {"status": "error", "message": str(e)}
+            self.wfile.write(json.dumps(response).encode())
+    
+    def stream_rollout_events(self, rollout_id, since):
+        """Write events as SSE until the rollout finishes and the client has caught up"""
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.close_connection = True
+        
+        while True:
+            result = self.server.events.wait(rollout_id, since, EVENT_HEARTBEAT)
+            if result is None:
+                return
+            batch, missed, closed = result
+            
+            chunks = []
+            if missed:
+                chunks.append(f"event: missed\ndata: {json.dumps({'since': since})}\n\n")
+            for event in batch:
+                chunks.append(f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n")
+                since = event['id']
+            if not chunks:
+                chunks.append(": keep-alive\n\n")
+            self.wfile.write(''.join(chunks).encode())
+            self.wfile.flush()
+            
+            if closed:
+                return
+    
     def handle_start_rollout(self):
         """Start a canary rollout"""
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            # Stream the body (Content-Length or chunked) straight into the parser
+            data = StreamingRolloutParser(self.read_body_chunks()).parse()
             
-            rollout_id = data.get('rolloutId', f"rollout-{int(time.time())}")
-            config = data.get('config', {})
+            # Ids must be unique among live rollouts; two starts in the same second mustn't collide
+            rollout_id = data.get('rolloutId') or f"rollout-{uuid.uuid4().hex[:12]}"
             target_devices = data.get('targetDevices', [])
-            canary_steps = data.get('canarySteps', [])
+            
+            # A live rollout with this id here is a conflict; otherwise the id's owner runs it
+            if rollout_id not in self.server.active_rollouts:
+                body = json.dumps(dict(data, rolloutId=rollout_id), separators=(',', ':'),
+                                  default=self.server.journal.encode).encode()
+                if self.forward_rollout_request(rollout_id, body, lookup=False):
+                    return
             
             logger.info(f"🚀 Starting canary rollout {rollout_id} with {len(target_devices)} devices")
             
-            # Start rollout in background thread
-            rollout_thread = threading.Thread(
-                target=self.execute_canary_rollout,
-                args=(rollout_id, config, target_devices, canary_steps)
-            )
-            rollout_thread.daemon = True
-            rollout_thread.start()
-            
-            # Initialize rollout status
-            self.server.active_rollouts[rollout_id] = {
-                'phase': 'Progressing',
-                'current_step': 0,
-                'completed_devices': [],
-                'failed_devices': [],
-                'start_time': datetime.now().isoformat(),
-                'config': config,
-                'target_devices': target_devices,
-                'canary_steps': canary_steps
-            }
+            # Register the rollout and start it as a coroutine on the shared event loop
+            self.server.executor.start_rollout(rollout_id, data)
             
             self.send_response(200)
             self.send_header('Content-type', 'application/json')
@@ -100,6 +1480,24 @@ class CanaryController(BaseHTTPRequestHandler):
             }
             self.wfile.write(json.dumps(response).encode())
             
+        except RolloutConflict as e:
+            logger.warning(f"⚠️ Rejected rollout request: {str(e)}")
+            self.send_response(409)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            response = {"status": "error", "message": str(e)}
+            self.wfile.write(json.dumps(response).encode())
+            
+        except RequestTooLarge as e:
+            logger.warning(f"⚠️ Rejected rollout request: {str(e)}")
+            self.send_response(413)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            response = {"status": "error", "message": str(e)}
+            self.wfile.write(json.dumps(response).encode())
+            self.close_connection = True
+            
         except Exception as e:
             logger.error(f"Failed to start rollout: {str(e)}")
             self.send_response(500)
@@ -108,16 +1506,60 @@ class CanaryController(BaseHTTPRequestHandler):
             response = {"status": "error", "message": str(e)}
             self.wfile.write(json.dumps(response).encode())
     
+    def read_body_chunks(self):
+        """Yield the request body in chunks, decoding chunked transfer encoding and enforcing MAX_BODY_BYTES"""
+        limit = MAX_BODY_BYTES
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            received = 0
+            while True:
+                size_line = self.rfile.readline(1024)
+                size = int(size_line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # Skip optional trailers up to the terminating blank line
+                    while self.rfile.readline(1024) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return
+                received += size
+                if received > limit:
+                    raise RequestTooLarge(f"Request body exceeds {limit} bytes")
+                while size:
+                    data = self.rfile.read(min(size, BODY_CHUNK_SIZE))
+                    if not data:
+                        raise ValueError("Request body truncated")
+                    size -= len(data)
+                    yield data
+                self.rfile.readline(1024)  # CRLF closing the chunk
+        
+        remaining = int(self.headers.get('Content-Length', 0))
+        if remaining > limit:
+            # Reject before reading anything
+            raise RequestTooLarge(f"Request body of {remaining} bytes exceeds {limit} bytes")
+        while remaining:
+            data = self.rfile.read(min(remaining, BODY_CHUNK_SIZE))
+            if not data:
+                raise ValueError("Request body truncated")
+            remaining -= len(data)
+            yield data
+    
     def handle_rollout_status(self):
-        """Get rollout status"""
+        """Get rollout status (full, field-selected, paginated or sinceVersion delta) with ETag support"""
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
+            content_length = int(self.headers.get('Content-Length', 0))
+            post_data = self.rfile.read(content_length) if content_length else b'{}'
             data = json.loads(post_data.decode('utf-8'))
             
-            rollout_id = data.get('rolloutId', '')
+            # Options may come from the query string or the body (body wins)
+            options = {k: v[-1] for k, v in parse_qs(urlparse(self.path).query).items()}
+            options.update(data)
             
-            if rollout_id not in self.server.active_rollouts:
+            rollout_id = options.get('rolloutId', '')
+            device_id = options.get('deviceId')
+            
+            rollout = self.server.active_rollouts.get(rollout_id)
+            
+            if rollout is None:
+                if self.forward_rollout_request(rollout_id, post_data):
+                    return
                 self.send_response(404)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
@@ -125,21 +1567,218 @@ class CanaryController(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps(response).encode())
                 return
             
-            rollout = self.server.active_rollouts[rollout_id]
+            fields = options.get('fields')
+            if isinstance(fields, str):
+                fields = [f for f in fields.split(',') if f]
+            try:
+                offset = self.count_option(options, 'offset') or 0
+                limit = self.count_option(options, 'limit')
+                since = self.count_option(options, 'sinceVersion')
+            except ValueError as e:
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                response = {"status": "error", "message": str(e)}
+                self.wfile.write(json.dumps(response).encode())
+                return
+            
+            # Only copy under the lock: the device workers on the event loop take it for every
+            # device, so rendering and serializing big views happen after it is released
+            snapshot = None
+            with self.server.rollouts_lock:
+                # The ETag covers the rollout's revision and scalar state plus the request options,
+                # so an unchanged poll is answered without serializing anything else
+                etag = self.status_etag(rollout_id, rollout, [device_id, fields, offset, limit, since])
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+                
+                if device_id:
+                    response = {"rolloutId": rollout_id, "deviceId": device_id, "state": self.device_state(rollout, device_id)}
+                elif since is not None:
+                    response = rollout_status_delta(rollout, since, limit)
+                elif fields == ['summary']:
+                    response = rollout_status_summary(rollout)
+                else:
+                    # Device lists grow while we render; the device table's targets never change
+                    snapshot = {k: list(v) if k in DEVICE_LIST_FIELDS else v for k, v in rollout.items()}
+            
+            if snapshot is not None:
+                response = rollout_status_view(snapshot, fields, offset, limit)
+                if offset or limit is not None:
+                    response['page'] = {
+                        'offset': offset,
+                        'limit': limit,
+                        'totals': {k: self.device_list_length(snapshot, k) for k in DEVICE_LIST_FIELDS
+                                   if k in response}
+                    }
+            body = json.dumps(response).encode()
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+            
+        except Exception as e:
+            logger.error(f"Failed to get rollout status: {str(e)}")
+            self.send_response(500)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            response = {"status": "error", "message": str(e)}
+            self.wfile.write(json.dumps(response).encode())
+    
+    def count_option(self, options, name):
+        """Non-negative integer status option (JSON number or query string digits), None when absent"""
+        value = options.get(name)
+        if value is None:
+            return None
+        if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+            return value
+        if isinstance(value, str) and value.isascii() and value.isdigit():
+            return int(value)
+        raise ValueError(f"{name} must be a non-negative integer")
+    
+    def status_etag(self, rollout_id, rollout, options):
+        """Strong ETag for a status response, derived from the rollout summary and request options"""
+        key = json.dumps([rollout_id, rollout_status_summary(rollout), options], sort_keys=True, default=str)
+        return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+    
+    def device_list_length(self, rollout, field):
+        """Unpaginated length of a device list field"""
+        if field == 'target_devices':
+            return len(rollout['device_table'])
+        return len(rollout[field])
+    
+    def device_state(self, rollout, device_id):
+        """State of one device: from the device table while live, from the summary lists once finished"""
+        if 'device_table' in rollout:
+            state = rollout['device_table'].state(device_id)
+            return state.value if state else None
+        if device_id in rollout.get('completed_devices', []):
+            return DeviceState.COMPLETED.value
+        if device_id in rollout.get('failed_devices', []):
+            return DeviceState.FAILED.value
+        return None
+    
+    def handle_pause_action(self):
+        """Promote, abort or extend a paused rollout"""
+        try:
+            content_length = int(self.headers['Content-Length'])
+            post_data = self.rfile.read(content_length)
+            data = json.loads(post_data.decode('utf-8'))
+            
+            rollout_id = data.get('rolloutId', '')
+            executor = self.server.executor
+            
+            if self.server.active_rollouts.get(rollout_id) is None:
+                if self.forward_rollout_request(rollout_id, post_data):
+                    return
+                if self.headers.get(PeerRouter.FORWARDED_HEADER):
+                    # Unknown here: the forwarding replica goes on to ask the next member
+                    self.send_response(404)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    response = {"status": "error", "message": f"Rollout {rollout_id} not found"}
+                    self.wfile.write(json.dumps(response).encode())
+                    return
+            
+            if self.path == '/promote-rollout':
+                done = executor.call_on_loop(executor.pauses.promote, rollout_id)
+                response = {"status": "success", "message": f"Rollout {rollout_id} promoted", "rolloutId": rollout_id}
+            elif self.path == '/abort-rollout':
+                done = executor.call_on_loop(executor.pauses.abort, rollout_id)
+                response = {"status": "success", "message": f"Rollout {rollout_id} aborted", "rolloutId": rollout_id}
+            else:
+                duration = data.get('duration', '30s')
+                remaining = executor.call_on_loop(executor.pauses.extend, rollout_id, executor.parse_duration(duration))
+                done = remaining is not None
+                if done:
+                    with self.server.rollouts_lock:
+                        # The pause may have ended (and the rollout finished or been evicted) since extend()
+                        rollout = self.server.active_rollouts.get(rollout_id) if rollout_id in self.server.active_rollouts else None
+                        done = rollout is not None and rollout.get('phase') == 'Paused'
+                        if done:
+                            rollout['paused_until'] = datetime.fromtimestamp(time.time() + remaining).isoformat()
+                response = {"status": "success", "message": f"Rollout {rollout_id} pause extended by {duration}",
+                            "rolloutId": rollout_id, "remainingSeconds": int(remaining or 0)}
+            
+            if done:
+                self.send_response(200)
+            else:
+                self.send_response(409)
+                response = {"status": "error", "message": f"Rollout {rollout_id} is not paused", "rolloutId": rollout_id}
             
-            self.send_response(200)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
-            self.wfile.write(json.dumps(rollout).encode())
+            self.wfile.write(json.dumps(response).encode())
             
         except Exception as e:
-            logger.error(f"Failed to get rollout status: {str(e)}")
+            logger.error(f"Pause action error: {str(e)}")
             self.send_response(500)
             self.send_header('Content-type', 'application/json')
             self.end_headers()
             response = {"status": "error", "message": str(e)}
             self.wfile.write(json.dumps(response).encode())
     
+    def forward_rollout_request(self, rollout_id, body=None, lookup=True):
+        """Relay this request to the replica owning rollout_id; False when this replica should answer it.
+        
+        Lookups go on to the other members while the owner answers 404 (a rollout keeps running
+        where it started when the shard map changes), and fall back to this replica if none knows it.
+        """
+        router = self.server.router
+        # A forwarded request is always answered where it lands, even if shard maps briefly disagree
+        if router is None or self.headers.get(PeerRouter.FORWARDED_HEADER):
+            return False
+        if lookup:
+            peers = router.peers(rollout_id)
+        else:
+            owner = router.owner(rollout_id)
+            peers = [] if owner in (None, router.membership.identity) else [owner]
+        unreachable = None
+        for identity in peers:
+            try:
+                response = router.forward(identity, self.command, self.path, self.headers, body)
+            except requests.RequestException as e:
+                logger.warning(f"🔀 Could not forward {self.path} for {rollout_id} to {identity}: {str(e)}")
+                unreachable = identity
+                continue
+            if lookup and response.status_code == 404:
+                response.close()
+                continue
+            self.relay_response(response)
+            return True
+        
+        if unreachable is None:
+            return False
+        self.send_response(503)
+        self.send_header('Retry-After', str(HTTP_RETRY_AFTER))
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        response = {"status": "error", "message": f"Replica {unreachable} is unreachable for rollout {rollout_id}"}
+        self.wfile.write(json.dumps(response).encode())
+        return True
+    
+    def relay_response(self, response):
+        """Copy a peer's response to the client as it arrives (event streams included)"""
+        with response:
+            self.send_response(response.status_code)
+            for name in PeerRouter.RESPONSE_HEADERS:
+                if name in response.headers:
+                    self.send_header(name, response.headers[name])
+            self.end_headers()
+            if response.headers.get('Content-type', '').startswith('text/event-stream'):
+                self.close_connection = True
+            try:
+                for chunk in response.iter_content(chunk_size=None):
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                logger.info(f"📴 Client of a forwarded {self.path} disconnected")
+    
     def handle_validate_device(self):
         """Validate device configuration"""
         try:
@@ -153,8 +1792,9 @@ class CanaryController(BaseHTTPRequestHandler):
             
             logger.info(f"🔍 Validating device {device_id} at {validation_endpoint}")
             
-            # Simulate device validation
-            success = self.validate_device_config(device_id, api_endpoint, validation_endpoint)
+            executor = self.server.executor
+            timeout = [executor.parse_duration(t) for t in DEVICE_TIMEOUT]
+            success = executor.run(executor.validate_device_config(device_id, api_endpoint, validation_endpoint, timeout))
             
             if success:
                 self.send_response(200)
@@ -183,106 +1823,730 @@ class CanaryController(BaseHTTPRequestHandler):
             response = {"status": "error", "message": str(e)}
             self.wfile.write(json.dumps(response).encode())
     
-    def execute_canary_rollout(self, rollout_id, config, target_devices, canary_steps):
-        """Execute canary rollout steps"""
+    def handle_validate_devices(self):
+        """Validate a batch of devices concurrently and report aggregated results"""
+        try:
+            content_length = int(self.headers['Content-Length'])
+            post_data = self.rfile.read(content_length)
+            data = json.loads(post_data.decode('utf-8'))
+            
+            devices = data.get('devices', [])
+            max_concurrency = int(data.get('maxConcurrency', VALIDATION_CONCURRENCY))
+            timeouts = data.get('timeouts', {})
+            
+            logger.info(f"🔍 Validating {len(devices)} devices (max {max_concurrency} in parallel)")
+            
+            executor = self.server.executor
+            timeout = [
+                executor.parse_duration(timeouts.get('connect', DEVICE_TIMEOUT[0])),
+                executor.parse_duration(timeouts.get('read', DEVICE_TIMEOUT[1]))
+            ]
+            results = executor.run(executor.validate_devices(devices, max_concurrency, timeout))
+            passed = sum(1 for r in results if r['status'] == 'success')
+            
+            response = {
+                "status": "success" if passed == len(results) else "failure",
+                "total": len(results),
+                "passed": passed,
+                "failed": len(results) - passed,
+                "results": results
+            }
+            
+            self.send_response(200 if passed == len(results) else 400)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(response).encode())
+            
+        except Exception as e:
+            logger.error(f"Batch validation error: {str(e)}")
+            self.send_response(500)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            response = {"status": "error", "message": str(e)}
+            self.wfile.write(json.dumps(response).encode())
+    
+    def log_message(self, format, *args):
+        """Suppress default logging"""
+        pass
+
+class CircuitBreaker:
+    """Per-host circuit breaker: opens after consecutive pushes that got no answer, fails pushes
+    fast while open and lets a single probe through once the cooldown has passed"""
+    
+    def __init__(self, host):
+        self.host = host
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+    
+    def allow(self):
+        """Whether a push may go to this host now"""
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < BREAKER_COOLDOWN:
+            return False
+        self.probing = True
+        return True
+    
+    def record(self, outcome):
+        """Update from a push outcome; any HTTP answer (even an error) shows the host is alive"""
+        if outcome is not PushOutcome.UNREACHABLE:
+            if self.opened_at is not None:
+                logger.info(f"🔌 Circuit for {self.host} closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+            return
+        self.failures += 1
+        if self.probing or (self.opened_at is None and self.failures >= BREAKER_FAILURES):
+            logger.warning(f"🔌 Circuit for {self.host} opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+            self.probing = False
+    
+    def abandon(self):
+        """A push allow() let through was cancelled before it was sent; the next one may probe"""
+        self.probing = False
+    
+    def clean(self):
+        """Closed with no failures to remember"""
+        return self.failures == 0 and self.opened_at is None
+
+class HostLimiter:
+    """Adaptive concurrency limit for one device API host (gateway), on the executor's loop.
+    
+    Additive increase, multiplicative decrease: the limit grows by one after a full
+    window of fast successful pushes and halves when a push times out, can't connect,
+    gets a 408/429/5xx or is slower than the latency target. A device rejecting its
+    config (other 4xx) says nothing about the host's load and leaves the limit alone.
+    Only pushes started after the last decrease can lower it again, so one burst of
+    timeouts halves the limit once, not once per push.
+    """
+    
+    def __init__(self, host):
+        self.host = host
+        self.limit = float(HOST_CONCURRENCY_INITIAL)
+        self.in_flight = 0
+        self.waiting = 0
+        self.successes = 0
+        self.last_decrease = 0.0
+        # Earliest start time of the next push when a rollout rate-limits this host
+        self.next_start = 0.0
+        self.changed = asyncio.Condition()
+        self.breaker = CircuitBreaker(host)
+    
+    def idle(self):
+        """Nothing in flight and no congestion to remember"""
+        return (self.in_flight == 0 and self.waiting == 0 and self.limit >= HOST_CONCURRENCY_INITIAL
+                and self.breaker.clean())
+    
+    async def acquire(self, max_in_flight=None, rate=None):
+        """Wait for a slot under the adaptive limit and the rollout's static cap/rate; returns the start time"""
+        async with self.changed:
+            self.waiting += 1
+            try:
+                await self.changed.wait_for(
+                    lambda: self.in_flight < min(int(self.limit), max_in_flight or HOST_CONCURRENCY_MAX))
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+        
+        if rate:
+            # Space starts 1/rate apart; the slot is held while waiting for our turn
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + 1 / rate
+            if start > now:
+                try:
+                    await asyncio.sleep(start - now)
+                except asyncio.CancelledError:
+                    # Stopped while waiting for our turn: the caller never gets the slot to release
+                    async with self.changed:
+                        self.in_flight -= 1
+                        self.changed.notify_all()
+                    raise
+        return time.monotonic()
+    
+    async def release(self, started, outcome):
+        """Free a slot and adapt the limit to the push outcome and latency"""
+        seconds = time.monotonic() - started
+        congested = outcome in (PushOutcome.RETRYABLE, PushOutcome.UNREACHABLE)
+        async with self.changed:
+            self.in_flight -= 1
+            if not congested and seconds <= HOST_LATENCY_TARGET:
+                if outcome is PushOutcome.OK:
+                    self.successes += 1
+                    if self.successes >= self.limit:
+                        self.limit = min(HOST_CONCURRENCY_MAX, self.limit + 1)
+                        self.successes = 0
+            elif started >= self.last_decrease:
+                self.limit = max(HOST_CONCURRENCY_MIN, self.limit / 2)
+                self.successes = 0
+                self.last_decrease = time.monotonic()
+                logger.warning(f"🐢 Host {self.host} {'failing' if congested else 'slow'}, "
+                               f"concurrency limit lowered to {int(self.limit)}")
+            self.changed.notify_all()
+
+class PauseScheduler:
+    """Heap of paused rollouts driven by a single event-loop timer; must be used on the loop thread"""
+    
+    def __init__(self, loop):
+        self.loop = loop
+        # (deadline, seq, rollout id); superseded entries are skipped lazily
+        self.heap = []
+        # rollout id -> [deadline, future resolved with 'expired' / 'promoted' / 'aborted']
+        self.pauses = {}
+        self.seq = itertools.count()
+        self.timer = None
+    
+    def pause(self, rollout_id, seconds):
+        """Park a rollout; returns a future that resolves when the pause ends"""
+        future = self.loop.create_future()
+        deadline = self.loop.time() + seconds
+        self.pauses[rollout_id] = [deadline, future]
+        heapq.heappush(self.heap, (deadline, next(self.seq), rollout_id))
+        self.arm()
+        return future
+    
+    def arm(self):
+        """Point the single timer at the earliest live deadline"""
+        while self.heap:
+            deadline, _, rollout_id = self.heap[0]
+            entry = self.pauses.get(rollout_id)
+            if entry is not None and entry[0] == deadline:
+                break
+            heapq.heappop(self.heap)
+        
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.heap:
+            self.timer = self.loop.call_at(self.heap[0][0], self.expire)
+    
+    def expire(self):
+        """Resume every rollout whose deadline has passed"""
+        self.timer = None
+        now = self.loop.time()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, rollout_id = heapq.heappop(self.heap)
+            entry = self.pauses.get(rollout_id)
+            if entry is not None and entry[0] == deadline:
+                self.resolve(rollout_id, 'expired')
+        self.arm()
+    
+    def resolve(self, rollout_id, outcome):
+        """End a pause early or on expiry; False if the rollout isn't paused"""
+        entry = self.pauses.pop(rollout_id, None)
+        if entry is None:
+            return False
+        if not entry[1].done():
+            entry[1].set_result(outcome)
+        return True
+    
+    def promote(self, rollout_id):
+        """Skip the rest of the pause and continue with the next step"""
+        return self.resolve(rollout_id, 'promoted')
+    
+    def abort(self, rollout_id):
+        """End the pause and fail the rollout"""
+        return self.resolve(rollout_id, 'aborted')
+    
+    def extend(self, rollout_id, seconds):
+        """Push a pause deadline out; returns the new remaining seconds, or None if not paused"""
+        entry = self.pauses.get(rollout_id)
+        if entry is None:
+            return None
+        entry[0] += seconds
+        heapq.heappush(self.heap, (entry[0], next(self.seq), rollout_id))
+        self.arm()
+        return max(0, entry[0] - self.loop.time())
+
+class RolloutExecutor:
+    """Runs every rollout as a coroutine on one background asyncio event loop"""
+    
+    def __init__(self, server):
+        self.server = server
+        self.loop = asyncio.new_event_loop()
+        # Blocking bookkeeping / Git work is offloaded here instead of a thread per rollout
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='rollout-io'))
+        # Device calls run on their own pool, sized to the slots below
+        self.device_pool = ThreadPoolExecutor(max_workers=DEVICE_IO_WORKERS, thread_name_prefix='device-io')
+        self.device_slots = asyncio.Semaphore(MAX_INFLIGHT_GLOBAL)
+        self.validation_slots = asyncio.Semaphore(VALIDATION_CONCURRENCY)
+        self.transport = DeviceTransport(DEVICE_POOL_HOSTS, DEVICE_POOL_SIZE)
+        self.pauses = PauseScheduler(self.loop)
+        self.applied_configs = AppliedConfigs(CONFIG_VERSIONS_MAX)
+        self.host_limiters = {}
+        # Rollout id -> its running task (loop thread only), and why stop_rollout() cancelled it
+        self.tasks = {}
+        self.stop_reasons = {}
+        # Journal state of resource rollouts held for the reconciler (see recover_rollouts)
+        self.recovered = {}
+        self.thread = threading.Thread(target=self.loop.run_forever, name='rollout-executor', daemon=True)
+        self.thread.start()
+    
+    def submit(self, rollout_id, config, devices, canary_steps, resume=None):
+        """Schedule a rollout coroutine from any thread"""
+        return asyncio.run_coroutine_threadsafe(
+            self.execute_canary_rollout(rollout_id, config, devices, canary_steps, resume),
+            self.loop
+        )
+    
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the event loop and block the calling (non-loop) thread for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout=timeout)
+    
+    def call_on_loop(self, fn, *args, timeout=5):
+        """Run a plain function on the event loop thread from any thread and return its result"""
+        future = Future()
+        
+        def call():
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        
+        self.loop.call_soon_threadsafe(call)
+        return future.result(timeout=timeout)
+    
+    def start_rollout(self, rollout_id, spec, resume=None, resource=None):
+        """Register a rollout record from its spec and schedule it; resume is journal state after a restart
+        and resource the key of the Kubernetes resource the rollout runs for"""
+        config = spec.get('config', {})
+        devices = spec.get('targetDevices', [])
+        if not isinstance(devices, DeviceTable):
+            devices = DeviceTable(devices)
+        canary_steps = spec.get('canarySteps', [])
+        timeouts = spec.get('timeouts', {})
+        
+        record = {
+            'phase': 'Progressing',
+            'current_step': 0,
+            'completed_devices': [],
+            'failed_devices': [],
+            # Devices a previous owner finished that this replica only has counts for
+            'carried_counts': dict((resume or {}).get('carried') or {'completed': 0, 'failed': 0}),
+            'start_time': resume['start_time'] if resume else datetime.now().isoformat(),
+            'config': config,
+            'canary_steps': canary_steps,
+            'max_concurrency': int(spec.get('maxConcurrency', MAX_INFLIGHT_PER_ROLLOUT)),
+            'delta_push': bool(spec.get('deltaPush', False)),
+            'host_limits': spec.get('hostLimits', {}),
+            'retry': {
+                'max_attempts': max(1, int(spec.get('retry', {}).get('maxAttempts', RETRY_MAX_ATTEMPTS))),
+                'backoff': self.parse_duration(spec.get('retry', {}).get('backoff', RETRY_BACKOFF)),
+                'max_backoff': self.parse_duration(spec.get('retry', {}).get('maxBackoff', RETRY_MAX_BACKOFF))
+            },
+            'device_timeout': [
+                self.parse_duration(timeouts.get('connect', DEVICE_TIMEOUT[0])),
+                self.parse_duration(timeouts.get('read', DEVICE_TIMEOUT[1]))
+            ],
+            'device_table': devices
+        }
+        
+        if resume:
+            # Devices with a journaled (or handed-over) outcome are never pushed again
+            for device_id, success in resume['devices'].items():
+                row = devices.row(device_id)
+                if row is None or devices.states[row] != 0:
+                    continue
+                if success:
+                    devices.mark(row, DeviceState.COMPLETED)
+                    record['completed_devices'].append(devices.ids[row])
+                else:
+                    devices.mark(row, DeviceState.FAILED)
+                    record['failed_devices'].append(devices.ids[row])
+        
+        # Claim the id before journaling: a second rollout under a live id would share its task,
+        # events and pause entry (a stopped rollout stays live until its coroutine has finished)
+        with self.server.rollouts_lock:
+            if rollout_id in self.server.active_rollouts:
+                raise RolloutConflict(f"Rollout {rollout_id} is already running")
+            self.server.active_rollouts.add(rollout_id, record)
+        
+        if not resume or resume.get('handoff'):
+            # A rollout taken over from another replica starts this replica's journal for it
+            self.server.journal.record_start(rollout_id, spec, record['start_time'], record['carried_counts'],
+                                             list(resource) if resource else None)
+            for device_id, success in (resume or {}).get('devices', {}).items():
+                self.server.journal.record_device(rollout_id, device_id, success)
+        
+        self.server.metrics.rollout_started(devices.counts[DeviceState.PENDING])
+        self.server.events.publish(rollout_id, 'phase', phase=record['phase'], totalDevices=len(devices),
+                                   resumed=bool(resume))
+        
+        self.stop_reasons.pop(rollout_id, None)
+        self.submit(rollout_id, config, devices, canary_steps, resume)
+        return record
+    
+    def discard_recovered(self, rollout_id, phase, message=None):
+        """Close out held journal state the reconciler won't resume here"""
+        if self.recovered.pop(rollout_id, None) is None:
+            return False
+        self.server.journal.record_phase(rollout_id, phase, message)
+        return True
+    
+    def stop_rollout(self, rollout_id, phase=HANDED_OFF, message='Handed off to another replica'):
+        """Stop a live rollout from any thread; it finishes with phase and message instead of running on"""
+        if rollout_id not in self.server.active_rollouts:
+            return False
+        self.stop_reasons[rollout_id] = (phase, message)
+        self.loop.call_soon_threadsafe(self.cancel_task, rollout_id)
+        return True
+    
+    def cancel_task(self, rollout_id):
+        """Cancel a rollout's task (a rollout that hasn't started yet checks stop_reasons itself)"""
+        task = self.tasks.get(rollout_id)
+        if task is not None:
+            task.cancel()
+    
+    def recover_rollouts(self, defer_resources=False):
+        """Rebuild unfinished rollouts from the journal and resume them, then start journaling.
+        
+        With defer_resources, rollouts of Kubernetes resources are held in self.recovered
+        instead: another replica may own them by now, so the reconciler resumes only the
+        ones the shard map gives this replica.
+        """
+        states = self.server.journal.replay()
+        self.server.journal.compact(states)
+        self.server.journal.open()
+        
+        for rollout_id, state in states.items():
+            if state['phase'] in FINISHED_PHASES:
+                continue
+            if defer_resources and state.get('resource'):
+                logger.info(f"♻️ Holding rollout {rollout_id} until its resource is reconciled")
+                self.recovered[rollout_id] = state
+                continue
+            logger.info(f"♻️ Resuming rollout {rollout_id} at step {state['step'] + 1} ({len(state['devices'])} devices already processed)")
+            self.start_rollout(rollout_id, state['spec'], resume=state)
+    
+    async def execute_canary_rollout(self, rollout_id, config, devices, canary_steps, resume=None):
+        """Execute canary rollout steps, optionally resuming from a journaled step"""
         try:
-            rollout = self.server.active_rollouts[rollout_id]
+            rollout = self.server.active_rollouts.get(rollout_id)
+            self.tasks[rollout_id] = asyncio.current_task()
+            if rollout_id in self.stop_reasons:
+                raise asyncio.CancelledError()
+            start_step = resume['step'] if resume else 0
+            
+            # Pre-flight: a config that conflicts with itself fails before any device sees it
+            if PREFLIGHT and not await self.preflight(rollout_id, rollout, config.get('payload', config)):
+                return
             
             for step_index, step in enumerate(canary_steps):
+                if step_index < start_step:
+                    continue
+                
                 logger.info(f"📊 Executing step {step_index + 1}: {step['percentage']}% of devices")
                 
                 # Calculate number of devices for this step
-                total_devices = len(target_devices)
+                total_devices = len(devices)
                 devices_for_step = int((step['percentage'] / 100) * total_devices)
                 
-                # Get devices that haven't been processed yet
-                remaining_devices = [d for d in target_devices if d['id'] not in rollout['completed_devices'] and d['id'] not in rollout['failed_devices']]
-                devices_to_process = remaining_devices[:devices_for_step]
+                # Get rows of devices that haven't been processed yet
+                with self.server.rollouts_lock:
+                    if resume and resume['window'] and step_index == start_step:
+                        # Finish the interrupted step with exactly the devices it had selected
+                        window = resume['window']
+                        devices_to_process = devices.pending_in(*window)
+                    else:
+                        window_start = devices.cursor
+                        devices_to_process = devices.next_pending(devices_for_step)
+                        window = [window_start, devices.cursor]
+                self.server.journal.record_step(rollout_id, step_index, window)
                 
                 rollout['current_step'] = step_index + 1
+                # Outcomes of every earlier step, so a new owner can resume this step from the resource status
+                carried = rollout['carried_counts']
+                rollout['step_start_counts'] = {
+                    'completed': devices.states.count(DeviceTable.CODES[DeviceState.COMPLETED], 0, window[0]) + carried['completed'],
+                    'failed': devices.states.count(DeviceTable.CODES[DeviceState.FAILED], 0, window[0]) + carried['failed']
+                }
+                self.server.events.publish(rollout_id, 'step', step=step_index + 1, percentage=step['percentage'],
+                                           devices=len(devices_to_process))
                 
-                # Process devices in this step
-                for device in devices_to_process:
-                    success = self.deploy_config_to_device(device, config)
-                    
-                    if success:
-                        rollout['completed_devices'].append(device['id'])
-                        logger.info(f"✅ Config deployed to device {device['id']}")
-                    else:
-                        rollout['failed_devices'].append(device['id'])
-                        logger.error(f"❌ Failed to deploy config to device {device['id']}")
+                # Process devices in this step; returns once every device has finished
+                step_started = time.monotonic()
+                max_in_flight = min(int(step.get('maxInFlight', rollout['max_concurrency'])), rollout['max_concurrency'])
+                await self.deploy_step(rollout_id, rollout, devices_to_process, config, max_in_flight)
                 
-                # Validate step if validation endpoint provided
-                if step.get('validationEndpoint'):
-                    validation_success = self.validate_step(rollout_id, step['validationEndpoint'])
-                    if not validation_success:
-                        logger.warning(f"⚠️ Step {step_index + 1} validation failed")
-                        rollout['phase'] = 'Failed'
-                        return
+                # Validate step if validation endpoint provided, then each device if asked to
+                validation_success = True
+                if step.get('validationEndpoint') or step.get('validateDevices'):
+                    validation_started = time.monotonic()
+                    if step.get('validationEndpoint'):
+                        validation_success = await self.validate_step(rollout_id, step['validationEndpoint'], rollout['device_timeout'])
+                    if validation_success and step.get('validateDevices'):
+                        validation_success = await self.validate_step_devices(rollout, step_index, step, devices_to_process, max_in_flight)
+                    self.server.metrics.observe_validation(time.monotonic() - validation_started)
+                    self.server.events.publish(rollout_id, 'validation', step=step_index + 1, success=validation_success)
                 
-                # Pause between steps
+                self.server.metrics.observe_step(time.monotonic() - step_started)
+                if not validation_success:
+                    logger.warning(f"⚠️ Step {step_index + 1} validation failed")
+                    rollout['phase'] = 'Failed'
+                    rollout['message'] = f"Step {step_index + 1} validation failed"
+                    return
+                
+                # Pause between steps; parked in the scheduler until expiry, promote or abort
                 if step.get('pauseDuration') and step['pauseDuration'] != '0s':
                     pause_seconds = self.parse_duration(step['pauseDuration'])
                     logger.info(f"⏸️ Pausing for {step['pauseDuration']}")
-                    time.sleep(pause_seconds)
+                    rollout['phase'] = 'Paused'
+                    rollout['paused_until'] = datetime.fromtimestamp(time.time() + pause_seconds).isoformat()
+                    self.server.events.publish(rollout_id, 'phase', phase='Paused', pausedUntil=rollout['paused_until'])
+                    outcome = await self.pauses.pause(rollout_id, pause_seconds)
+                    rollout.pop('paused_until', None)
+                    
+                    if outcome == 'aborted':
+                        logger.warning(f"🛑 Rollout {rollout_id} aborted during pause")
+                        rollout['phase'] = 'Failed'
+                        rollout['message'] = 'Aborted during pause'
+                        return
+                    
+                    if outcome == 'promoted':
+                        logger.info(f"⏩ Rollout {rollout_id} promoted past pause")
+                    rollout['phase'] = 'Progressing'
+                    self.server.events.publish(rollout_id, 'phase', phase='Progressing', outcome=outcome)
             
             # Mark rollout as completed
             rollout['phase'] = 'Completed'
             logger.info(f"🎉 Canary rollout {rollout_id} completed successfully")
             
+        except asyncio.CancelledError:
+            # stop_rollout(): pushes already sent finish on the I/O pool, nothing new starts
+            phase, message = self.stop_reasons.get(rollout_id, (HANDED_OFF, 'Handed off to another replica'))
+            logger.info(f"🛑 Rollout {rollout_id} stopped: {message}")
+            self.pauses.resolve(rollout_id, 'aborted')
+            rollout['phase'] = phase
+            rollout['message'] = message
+        
         except Exception as e:
             logger.error(f"Rollout execution error: {str(e)}")
             if rollout_id in self.server.active_rollouts:
-                self.server.active_rollouts[rollout_id]['phase'] = 'Failed'
-                self.server.active_rollouts[rollout_id]['message'] = str(e)
+                self.server.active_rollouts.get(rollout_id)['phase'] = 'Failed'
+                self.server.active_rollouts.get(rollout_id)['message'] = str(e)
+        
+        finally:
+            self.tasks.pop(rollout_id, None)
+            self.stop_reasons.pop(rollout_id, None)
+            # Terminal rollouts shrink to a summary; spilling to disk happens off the loop
+            record = await self.loop.run_in_executor(None, self.server.active_rollouts.finish, rollout_id)
+            if record is not None:
+                self.server.journal.record_phase(rollout_id, record['phase'], record.get('message'))
+                self.server.metrics.rollout_finished(record['phase'], record['device_table'].counts[DeviceState.PENDING])
+                self.server.events.publish(rollout_id, 'phase', phase=record['phase'], message=record.get('message'),
+                                           completed=len(record['completed_devices']), failed=len(record['failed_devices']))
+            self.server.events.close(rollout_id)
     
-    def deploy_config_to_device(self, device, config):
-        """Deploy configuration to a network device via HTTP API"""
-        try:
-            device_id = device['id']
-            api_endpoint = device['apiEndpoint']
+    async def deploy_step(self, rollout_id, rollout, devices, config, max_in_flight):
+        """Deploy config to a step's devices in parallel, bounded per step and globally"""
+        if not devices:
+            return
+        
+        step_slots = asyncio.Semaphore(max(1, max_in_flight))
+        
+        table = rollout['device_table']
+        # Serialize the config once for the whole step (off the loop; configs can be megabytes)
+        version = await self.loop.run_in_executor(None, config_version, config)
+        template = await self.loop.run_in_executor(None, PayloadTemplate, {'config': config, 'version': version})
+        # Delta bodies, computed once per base version the step's devices are on
+        deltas = {}
+        if rollout['delta_push']:
+            self.applied_configs.remember(version, config)
+        
+        async def push(row):
+            device_id = table.ids[row]
+            base = self.applied_configs.base(device_id) if rollout['delta_push'] else None
+            if base is not None and base[0] != version:
+                if base[0] not in deltas:
+                    deltas[base[0]] = self.loop.run_in_executor(
+                        None, self.delta_template, base[1], config, base[0], version, template.size())
+                delta = await deltas[base[0]]
+                if delta is not None:
+                    self.server.metrics.device_pushed('delta', delta.size())
+                    outcome = await self.deploy_config_to_device(table, row, delta, rollout['device_timeout'])
+                    # Only a device that rejected the delta gets the full config; a transport
+                    # failure goes back to the retry loop, which may try the delta again
+                    if outcome is not PushOutcome.FAILED:
+                        return outcome
+                    logger.warning(f"🔁 Delta push to {device_id} was rejected, falling back to a full push")
             
-            logger.info(f"📡 Deploying config to device {device_id} at {api_endpoint}")
+            self.server.metrics.device_pushed('full', template.size())
+            return await self.deploy_config_to_device(table, row, template, rollout['device_timeout'])
+        
+        host_limits = rollout['host_limits']
+        retry = rollout['retry']
+        
+        async def attempt(row):
+            # The host slot protects the device's gateway and the global slot caps pushes across
+            # all rollouts; the global slot is taken last so a congested host never holds slots
+            # other hosts could use
+            limiter = self.host_limiter(table.endpoints[row])
+            if not limiter.breaker.allow():
+                self.server.metrics.circuit_rejected()
+                logger.error(f"🔌 Circuit for {limiter.host} is open, failing {table.ids[row]} fast")
+                return PushOutcome.FAILED
+            try:
+                started = await limiter.acquire(host_limits.get('maxInFlight'), host_limits.get('ratePerSecond'))
+            except asyncio.CancelledError:
+                # Stopped before sending (acquire gives its slot back itself)
+                limiter.breaker.abandon()
+                raise
+            outcome = PushOutcome.FAILED
+            try:
+                async with self.device_slots:
+                    outcome = await push(row)
+            finally:
+                limiter.breaker.record(outcome)
+                await self.release_host(limiter, started, outcome)
+            return outcome
+        
+        async def deploy(row):
+            device_id = table.ids[row]
+            # Step slot bounds this step, including retry backoff (host and global slots are released)
+            async with step_slots:
+                with self.server.rollouts_lock:
+                    table.mark(row, DeviceState.IN_PROGRESS)
+                self.server.metrics.device_started()
+                push_started = time.monotonic()
+                for attempt_number in range(1, retry['max_attempts'] + 1):
+                    outcome = await attempt(row)
+                    if outcome not in (PushOutcome.RETRYABLE, PushOutcome.UNREACHABLE) or attempt_number == retry['max_attempts']:
+                        break
+                    # Full jitter: uniform over an exponentially growing, capped window
+                    delay = random.uniform(0, min(retry['max_backoff'], retry['backoff'] * 2 ** (attempt_number - 1)))
+                    logger.warning(f"🔁 Retrying {device_id} in {delay:.1f}s (attempt {attempt_number + 1}/{retry['max_attempts']})")
+                    self.server.metrics.push_retried()
+                    await asyncio.sleep(delay)
+                success = outcome is PushOutcome.OK
+                self.server.metrics.device_finished(success, time.monotonic() - push_started)
             
-            # Prepare HTTP request
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f"Bearer {device.get('authToken', 'dummy-token')}"
-            }
+            if success:
+                self.applied_configs.applied(device_id, version)
+            else:
+                self.applied_configs.forget(device_id)
             
-            payload = {
-                'config': config,
-                'timestamp': datetime.now().isoformat(),
-                'deviceId': device_id
-            }
+            with self.server.rollouts_lock:
+                if success:
+                    table.mark(row, DeviceState.COMPLETED)
+                    rollout['completed_devices'].append(device_id)
+                else:
+                    table.mark(row, DeviceState.FAILED)
+                    rollout['failed_devices'].append(device_id)
+            self.server.journal.record_device(rollout_id, device_id, success)
+            self.server.events.publish(rollout_id, 'device', deviceId=device_id,
+                                       state=(DeviceState.COMPLETED if success else DeviceState.FAILED).value)
             
-            # Simulate HTTP request to device
-            # In real implementation, this would be:
-            # response = requests.post(api_endpoint, json=payload, headers=headers, timeout=30)
-            # return response.status_code == 200
+            if success:
+                logger.info(f"✅ Config deployed to device {device_id}")
+            else:
+                logger.error(f"❌ Failed to deploy config to device {device_id}")
+        
+        # gather() surfaces device exceptions to execute_canary_rollout
+        await asyncio.gather(*(deploy(row) for row in devices))
+    
+    def host_limiter(self, endpoint):
+        """Shared adaptive limiter for an endpoint's host"""
+        host = urlparse(endpoint).netloc or endpoint
+        limiter = self.host_limiters.get(host)
+        if limiter is None:
+            limiter = self.host_limiters[host] = HostLimiter(host)
+        return limiter
+    
+    async def release_host(self, limiter, started, outcome):
+        """Release a host slot; limiters of idle, healthy hosts are dropped so the map stays small"""
+        await limiter.release(started, outcome)
+        if limiter.idle() and self.host_limiters.get(limiter.host) is limiter:
+            del self.host_limiters[limiter.host]
+    
+    def delta_template(self, base_config, config, base_version, version, full_size):
+        """Delta body from base_version to version, or None when it wouldn't be meaningfully smaller"""
+        ops = config_diff(base_config, config)
+        template = PayloadTemplate({'configPatch': ops, 'baseVersion': base_version, 'version': version})
+        if template.size() > full_size * DELTA_MAX_RATIO:
+            return None
+        return template
+    
+    async def deploy_config_to_device(self, devices, row, template, timeout):
+        """Deploy the step's pre-serialized configuration to the network device at a device table row;
+        returns a PushOutcome so transient failures can be retried"""
+        device_id = devices.ids[row]
+        try:
+            api_endpoint = devices.endpoints[row]
+            if not api_endpoint:
+                raise ValueError("device has no apiEndpoint")
+            
+            logger.info(f"📡 Deploying config to device {device_id} at {api_endpoint}")
             
-            # For demo purposes, simulate network delay and success/failure
-            time.sleep(random.uniform(1, 3))  # Simulate network delay
+            # Prepare HTTP request
+            headers = template.headers(devices.tokens[row])
+            body = template.body(device_id, datetime.now().isoformat())
             
-            # 95% success rate for demo
-            success = random.random() < 0.95
+            if DEVICE_TRANSPORT == 'http':
+                # Blocking call runs on the device pool so the event loop never blocks
+                response = await self.loop.run_in_executor(
+                    self.device_pool, self.transport.post_body, api_endpoint, body, headers, timeout)
+                if response.status_code == 200:
+                    outcome = PushOutcome.OK
+                elif response.status_code in RETRYABLE_STATUS:
+                    outcome = PushOutcome.RETRYABLE
+                else:
+                    outcome = PushOutcome.FAILED
+            else:
+                # For demo purposes, simulate network delay and success/failure
+                await asyncio.sleep(random.uniform(1, 3))  # Simulate network delay
+                
+                # 95% success rate for demo; simulated failures are transient
+                outcome = PushOutcome.OK if random.random() < 0.95 else PushOutcome.RETRYABLE
             
-            if success:
+            if outcome is PushOutcome.OK:
                 logger.info(f"✅ Successfully deployed config to {device_id}")
             else:
                 logger.error(f"❌ Failed to deploy config to {device_id}")
             
-            return success
+            return outcome
             
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            logger.error(f"Device deployment error for {device_id}: {str(e)}")
+            return PushOutcome.UNREACHABLE
         except Exception as e:
             logger.error(f"Device deployment error for {device_id}: {str(e)}")
+            return PushOutcome.FAILED
+    
+    async def validate_step(self, rollout_id, validation_endpoint, timeout):
+        """Validate entire step"""
+        try:
+            if DEVICE_TRANSPORT == 'http':
+                headers = {'Content-Type': 'application/json'}
+                async with self.validation_slots:
+                    response = await self.loop.run_in_executor(
+                        self.device_pool, self.transport.post, validation_endpoint, {'rolloutId': rollout_id}, headers, timeout)
+                return response.status_code == 200
+            
+            # Simulate step validation
+            await asyncio.sleep(2)  # Simulate processing time
+            
+            # 85% success rate for demo
+            return random.random() < 0.85
+            
+        except Exception as e:
+            logger.error(f"Step validation error: {str(e)}")
             return False
     
-    def validate_device_config(self, device_id, api_endpoint, validation_endpoint):
+    async def validate_device_config(self, device_id, api_endpoint, validation_endpoint, timeout):
         """Validate device configuration"""
         try:
+            if DEVICE_TRANSPORT == 'http':
+                payload = {'deviceId': device_id, 'apiEndpoint': api_endpoint}
+                headers = {'Content-Type': 'application/json'}
+                async with self.validation_slots:
+                    response = await self.loop.run_in_executor(
+                        self.device_pool, self.transport.post, validation_endpoint, payload, headers, timeout)
+                return response.status_code == 200
+            
             # Simulate validation request
-            time.sleep(1)  # Simulate processing time
+            await asyncio.sleep(1)  # Simulate processing time
             
             # 90% success rate for demo
             return random.random() < 0.9
@@ -291,18 +2555,75 @@ class CanaryController(BaseHTTPRequestHandler):
             logger.error(f"Validation error for {device_id}: {str(e)}")
             return False
     
-    def validate_step(self, rollout_id, validation_endpoint):
-        """Validate entire step"""
-        try:
-            # Simulate step validation
-            time.sleep(2)  # Simulate processing time
-            
-            # 85% success rate for demo
-            return random.random() < 0.85
-            
-        except Exception as e:
-            logger.error(f"Step validation error: {str(e)}")
-            return False
+    async def validate_devices(self, devices, max_in_flight, timeout):
+        """Validate {deviceId, apiEndpoint, validationEndpoint} entries concurrently, results in input order"""
+        slots = asyncio.Semaphore(max(1, max_in_flight))
+        
+        async def validate(device):
+            device_id = device.get('deviceId', 'unknown')
+            async with slots:
+                started = time.monotonic()
+                success = await self.validate_device_config(
+                    device_id, device.get('apiEndpoint', ''), device.get('validationEndpoint', ''), timeout)
+            return {
+                "deviceId": device_id,
+                "status": "success" if success else "failure",
+                "latencyMs": int((time.monotonic() - started) * 1000)
+            }
+        
+        return await asyncio.gather(*(validate(device) for device in devices))
+    
+    async def preflight(self, rollout_id, rollout, payload):
+        """Check the device config for conflicting routes, unreachable gateways and shadowed firewall rules;
+        False (and a Failed rollout) if it has any"""
+        if not isinstance(payload, dict):
+            return True
+        # Tens of thousands of rules take a while to index, so keep it off the loop
+        errors, warnings = await self.loop.run_in_executor(None, config_conflicts, payload)
+        rollout['preflight'] = {
+            'errors': errors[:PREFLIGHT_REPORT_MAX],
+            'warnings': warnings[:PREFLIGHT_REPORT_MAX],
+            'error_count': len(errors),
+            'warning_count': len(warnings)
+        }
+        self.server.events.publish(rollout_id, 'preflight', errors=len(errors), warnings=len(warnings))
+        for warning in warnings[:PREFLIGHT_REPORT_MAX]:
+            logger.warning(f"⚠️ Pre-flight {warning['path']}: {warning['message']}")
+        if not errors:
+            return True
+        
+        logger.error(f"❌ Pre-flight check failed for {rollout_id} with {len(errors)} conflicts")
+        rollout['phase'] = 'Failed'
+        rollout['message'] = f"Pre-flight check failed: {errors[0]['path']}: {errors[0]['message']}"
+        if len(errors) > 1:
+            rollout['message'] += f" (and {len(errors) - 1} more)"
+        return False
+    
+    async def validate_step_devices(self, rollout, step_index, step, devices, max_in_flight):
+        """Validate the step's successfully configured device rows in parallel; passes only if all pass"""
+        table = rollout['device_table']
+        completed = DeviceTable.CODES[DeviceState.COMPLETED]
+        with self.server.rollouts_lock:
+            configured = [row for row in devices if table.states[row] == completed]
+        
+        # Devices may carry their own validation endpoint; otherwise use the step's
+        batch = [
+            {'deviceId': table.ids[row], 'apiEndpoint': table.endpoints[row],
+             'validationEndpoint': table.validation_endpoints.get(row, step.get('validationEndpoint', ''))}
+            for row in configured if row in table.validation_endpoints or step.get('validationEndpoint')
+        ]
+        results = await self.validate_devices(batch, max_in_flight, rollout['device_timeout'])
+        failed = [r['deviceId'] for r in results if r['status'] != 'success']
+        
+        rollout['step_validation'] = {
+            'step': step_index + 1,
+            'passed': len(results) - len(failed),
+            'failed': len(failed),
+            'failed_devices': failed
+        }
+        if failed:
+            logger.warning(f"⚠️ Device validation failed on {len(failed)}/{len(results)} devices: {failed}")
+        return not failed
     
     def parse_duration(self, duration_str):
         """Parse duration string to seconds"""
@@ -314,27 +2635,996 @@ class CanaryController(BaseHTTPRequestHandler):
             return int(duration_str[:-1]) * 3600
         else:
             return 30  # Default 30 seconds
+
+class WatchExpired(Exception):
+    """The watch's resourceVersion is too old (410 Gone); the informer must relist"""
+
+class KubeClient:
+    """Minimal Kubernetes API client for the rollout.io custom resources"""
     
-    def log_message(self, format, *args):
-        """Suppress default logging"""
-        pass
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        if os.path.exists(KUBE_TOKEN_PATH):
+            with open(KUBE_TOKEN_PATH) as f:
+                self.session.headers['Authorization'] = f"Bearer {f.read().strip()}"
+        if self.base_url.startswith('https://') and os.path.exists(KUBE_CA_PATH):
+            self.session.verify = KUBE_CA_PATH
+    
+    def url(self, plural, namespace='', name='', subresource='', api=ROLLOUT_API):
+        """Resource URL, cluster-wide when namespace is empty"""
+        url = f"{self.base_url}/apis/{api}"
+        if namespace:
+            url += f"/namespaces/{namespace}"
+        url += f"/{plural}"
+        if name:
+            url += f"/{name}"
+        if subresource:
+            url += f"/{subresource}"
+        return url
+    
+    def list(self, plural, namespace=''):
+        """Every object (fetched in pages) and the list's resourceVersion to watch from"""
+        items = []
+        params = {'limit': KUBE_LIST_PAGE}
+        while True:
+            response = self.session.get(self.url(plural, namespace), params=params, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            items.extend(data.get('items', []))
+            if not data['metadata'].get('continue'):
+                return items, data['metadata']['resourceVersion']
+            params = {'limit': KUBE_LIST_PAGE, 'continue': data['metadata']['continue']}
+    
+    def watch(self, plural, namespace, resource_version):
+        """Yield watch events after resource_version until the server ends the watch"""
+        params = {
+            'watch': '1',
+            'resourceVersion': resource_version,
+            'allowWatchBookmarks': 'true',
+            'timeoutSeconds': KUBE_WATCH_TIMEOUT
+        }
+        with self.session.get(self.url(plural, namespace), params=params, stream=True,
+                              timeout=(10, KUBE_WATCH_TIMEOUT + 30)) as response:
+            if response.status_code == 410:
+                raise WatchExpired()
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+    
+    def get(self, plural, namespace, name):
+        """Current object, or None if it doesn't exist"""
+        response = self.session.get(self.url(plural, namespace, name), timeout=30)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+    
+    def patch_status(self, plural, namespace, name, status, resource_version=None):
+        """Merge-patch an object's status subresource; with resource_version the server answers 409 if it moved on"""
+        patch = {'status': status}
+        if resource_version:
+            patch['metadata'] = {'resourceVersion': resource_version}
+        response = self.session.patch(
+            self.url(plural, namespace, name, 'status'),
+            data=json.dumps(patch),
+            headers={'Content-Type': 'application/merge-patch+json'},
+            timeout=30
+        )
+        response.raise_for_status()
+        return response.json()
+
+class WorkQueue:
+    """Deduplicating work queue with per-key exponential backoff.
+    
+    A key waits in the queue at most once, and a key added while a worker is
+    processing it is queued again when that worker is done, so bursts of events
+    collapse into one reconcile and no key is reconciled by two workers at once.
+    """
+    
+    def __init__(self, base_delay, max_delay):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.queued = set()
+        self.processing = set()
+        self.dirty = set()
+        self.failures = {}
+        # Heap of (ready_at, seq, key) for rate-limited requeues
+        self.delayed = []
+        self.seq = itertools.count()
+    
+    def enqueue(self, key):
+        """Queue a key unless it is already waiting; caller holds the lock"""
+        if key in self.processing:
+            self.dirty.add(key)
+        elif key not in self.queued:
+            self.queued.add(key)
+            self.queue.append(key)
+            self.cond.notify()
+    
+    def add(self, key):
+        """Queue a key for reconciling"""
+        with self.cond:
+            self.enqueue(key)
+    
+    def add_rate_limited(self, key):
+        """Requeue a key after a failure, backing off exponentially per key"""
+        with self.cond:
+            failures = self.failures.get(key, 0)
+            self.failures[key] = failures + 1
+            delay = min(self.max_delay, self.base_delay * 2 ** failures)
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.seq), key))
+            self.cond.notify_all()
+    
+    def add_after(self, key, delay):
+        """Queue a key once delay seconds have passed"""
+        with self.cond:
+            heapq.heappush(self.delayed, (time.monotonic() + delay, next(self.seq), key))
+            self.cond.notify_all()
+    
+    def forget(self, key):
+        """Reset a key's backoff after a successful reconcile"""
+        with self.cond:
+            self.failures.pop(key, None)
+    
+    def get(self):
+        """Block until a key is ready and mark it as being processed"""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    self.enqueue(heapq.heappop(self.delayed)[2])
+                if self.queue:
+                    key = self.queue.popleft()
+                    self.queued.discard(key)
+                    self.processing.add(key)
+                    return key
+                self.cond.wait(self.delayed[0][0] - now if self.delayed else None)
+    
+    def done(self, key):
+        """Finish processing a key, requeueing it if it changed meanwhile"""
+        with self.cond:
+            self.processing.discard(key)
+            if key in self.dirty:
+                self.dirty.discard(key)
+                self.enqueue(key)
+
+class HashRing:
+    """Consistent-hash ring: each key belongs to the first member point at or after its hash.
+    
+    Adding or removing a member only moves the keys on that member's arcs, so a
+    membership change hands off about 1/N of the resources instead of reshuffling them.
+    """
+    
+    def __init__(self, members, vnodes=SHARD_VNODES):
+        points = sorted((self.hash(f"{member}#{i}"), member) for member in members for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.members = [member for _, member in points]
+    
+    @staticmethod
+    def hash(value):
+        """Stable 64-bit position on the ring"""
+        return int.from_bytes(hashlib.sha1(value.encode()).digest()[:8], 'big')
+    
+    def owner(self, key):
+        """Member owning key, or None for an empty ring"""
+        if not self.hashes:
+            return None
+        return self.members[bisect.bisect_left(self.hashes, self.hash(key)) % len(self.hashes)]
+
+class KubeLeases:
+    """Lease store on coordination.k8s.io Leases; updates are compare-and-swap on resourceVersion"""
+    
+    API = 'coordination.k8s.io/v1'
+    # The leader's shard map rides on its lease as an annotation
+    DATA_ANNOTATION = 'rollout.io/shard-map'
+    LABELS = {'app.kubernetes.io/name': 'canary-controller'}
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+    
+    def __init__(self, client, namespace):
+        self.client = client
+        self.namespace = namespace
+    
+    def record(self, lease):
+        """Lease object -> (record, resourceVersion)"""
+        spec = lease.get('spec', {})
+        renewed = spec.get('renewTime')
+        record = {
+            'holder': spec.get('holderIdentity', ''),
+            'renewed': datetime.strptime(renewed, self.TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp() if renewed else 0,
+            'duration': spec.get('leaseDurationSeconds', 0),
+            'data': lease['metadata'].get('annotations', {}).get(self.DATA_ANNOTATION)
+        }
+        return record, lease['metadata']['resourceVersion']
+    
+    def get(self, name):
+        """(record, version) of a lease, or (None, None) if it doesn't exist"""
+        response = self.client.session.get(self.client.url('leases', self.namespace, name, api=self.API), timeout=10)
+        if response.status_code == 404:
+            return None, None
+        response.raise_for_status()
+        return self.record(response.json())
+    
+    def update(self, name, record, version):
+        """Write a lease if it is still at version (None: create it); False if another replica got there first"""
+        lease = {
+            'apiVersion': self.API,
+            'kind': 'Lease',
+            'metadata': {'name': name, 'namespace': self.namespace, 'labels': self.LABELS},
+            'spec': {
+                'holderIdentity': record['holder'],
+                'leaseDurationSeconds': int(record['duration']),
+                'renewTime': datetime.fromtimestamp(record['renewed'], timezone.utc).strftime(self.TIME_FORMAT)
+            }
+        }
+        if record.get('data') is not None:
+            lease['metadata']['annotations'] = {self.DATA_ANNOTATION: record['data']}
+        if version is None:
+            response = self.client.session.post(self.client.url('leases', self.namespace, api=self.API),
+                                                json=lease, timeout=10)
+        else:
+            lease['metadata']['resourceVersion'] = version
+            response = self.client.session.put(self.client.url('leases', self.namespace, name, api=self.API),
+                                               json=lease, timeout=10)
+        if response.status_code == 409:
+            return False
+        response.raise_for_status()
+        return True
+    
+    def list(self, prefix):
+        """Records of every lease whose name starts with prefix"""
+        selector = ','.join(f"{k}={v}" for k, v in self.LABELS.items())
+        response = self.client.session.get(self.client.url('leases', self.namespace, api=self.API),
+                                           params={'labelSelector': selector}, timeout=10)
+        response.raise_for_status()
+        return {lease['metadata']['name']: self.record(lease)[0] for lease in response.json().get('items', [])
+                if lease['metadata']['name'].startswith(prefix)}
+    
+    def delete(self, name):
+        """Remove a lease"""
+        response = self.client.session.delete(self.client.url('leases', self.namespace, name, api=self.API), timeout=10)
+        if response.status_code != 404:
+            response.raise_for_status()
+
+class FileLeases:
+    """Lease store in a directory (one JSON file per lease) for single-node setups and tests.
+    
+    Replicas sharing the directory serialize updates with an flock, and a version
+    counter in each file gives the same compare-and-swap as Kubernetes Leases.
+    """
+    
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+    
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+    
+    def read(self, name):
+        """(record, version) of a lease, or (None, None)"""
+        try:
+            with open(self.path(name)) as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None, None
+        return record, record.pop('version')
+    
+    def get(self, name):
+        """(record, version) of a lease, or (None, None) if it doesn't exist"""
+        return self.read(name)
+    
+    def update(self, name, record, version):
+        """Write a lease if it is still at version (None: create it); False if another replica got there first"""
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.read(name)[1] != version:
+                return False
+            temp_path = self.path(name) + '.tmp'
+            with open(temp_path, 'w') as f:
+                json.dump(dict(record, version=(version or 0) + 1), f)
+            os.replace(temp_path, self.path(name))
+            return True
+    
+    def list(self, prefix):
+        """Records of every lease whose name starts with prefix"""
+        leases = {}
+        for filename in os.listdir(self.directory):
+            if filename.startswith(prefix) and filename.endswith('.json'):
+                record, _ = self.read(filename[:-5])
+                if record is not None:
+                    leases[filename[:-5]] = record
+        return leases
+    
+    def delete(self, name):
+        """Remove a lease"""
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+class Membership:
+    """Replica membership and leader election on leases, and the hash ring built from them.
+    
+    Every replica keeps a member lease renewed and competes for the leader lease.
+    The leader publishes the live members with an epoch on its lease, and every
+    replica builds its ring from that one list, so all replicas agree on owners
+    instead of each acting on its own view of which leases have expired. A replica
+    that can't renew its own lease owns nothing until it can again.
+    """
+    
+    def __init__(self, backend, identity, duration):
+        self.backend = backend
+        self.identity = identity
+        self.duration = duration
+        self.renew_interval = duration / 3
+        self.lock = threading.Lock()
+        self.leader = False
+        self.epoch = None
+        self.members = ()
+        self.ring = HashRing(())
+        # Monotonic deadline of our own member lease
+        self.valid_until = 0.0
+        self.listeners = []
+    
+    def subscribe(self, callback):
+        """Call callback(members) after every shard map change"""
+        self.listeners.append(callback)
+    
+    def start(self):
+        """Join and keep renewing in the background"""
+        threading.Thread(target=self.run, name='membership', daemon=True).start()
+    
+    def run(self):
+        """Renew loop"""
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"🗳️ Lease renewal failed: {str(e)}")
+            time.sleep(self.renew_interval)
+    
+    def expired(self, record, now):
+        return record['renewed'] + record['duration'] <= now
+    
+    def tick(self):
+        """Renew our member lease, hold or contest the leader lease and pick up the shard map"""
+        started = time.monotonic()
+        now = time.time()
+        name = MEMBER_LEASE_PREFIX + self.identity
+        record, version = self.backend.get(name)
+        if self.backend.update(name, {'holder': self.identity, 'renewed': now, 'duration': self.duration}, version):
+            self.valid_until = started + self.duration
+        
+        record, version = self.backend.get(LEADER_LEASE)
+        leader = False
+        if record is None or record['holder'] == self.identity or self.expired(record, now):
+            shard_map = json.loads(record['data']) if record and record.get('data') else {'epoch': 0, 'members': []}
+            members = self.live_members(now)
+            if shard_map['members'] != members:
+                shard_map = {'epoch': shard_map['epoch'] + 1, 'members': members}
+            record = {'holder': self.identity, 'renewed': now, 'duration': self.duration, 'data': json.dumps(shard_map)}
+            leader = self.backend.update(LEADER_LEASE, record, version)
+            if not leader:
+                record, _ = self.backend.get(LEADER_LEASE)
+        
+        if leader != self.leader:
+            logger.info(f"👑 {self.identity} {'is now' if leader else 'is no longer'} the leader")
+            self.leader = leader
+        if record and record.get('data'):
+            self.apply(json.loads(record['data']))
+    
+    def live_members(self, now):
+        """Holders of unexpired member leases; the leader also clears out the expired ones"""
+        members = []
+        for name, record in self.backend.list(MEMBER_LEASE_PREFIX).items():
+            if not self.expired(record, now):
+                members.append(record['holder'])
+            elif self.expired(record, now - self.duration):
+                self.backend.delete(name)
+        return sorted(members)
+    
+    def apply(self, shard_map):
+        """Switch to a newly published shard map"""
+        with self.lock:
+            if shard_map['epoch'] == self.epoch:
+                return
+            self.epoch = shard_map['epoch']
+            self.members = tuple(shard_map['members'])
+            self.ring = HashRing(self.members)
+        logger.info(f"🧩 Shard map epoch {self.epoch}: {', '.join(self.members) or 'no members'}")
+        for callback in self.listeners:
+            callback(self.members)
+    
+    def valid(self):
+        """Our member lease is current and the shard map includes us"""
+        return time.monotonic() < self.valid_until and self.identity in self.members
+    
+    def owns(self, key):
+        """This replica is the key's owner under the current shard map"""
+        with self.lock:
+            return self.valid() and self.ring.owner(key) == self.identity
+    
+    def alive(self, identity):
+        """identity is a member under the current shard map"""
+        with self.lock:
+            return identity in self.members
+
+class PeerRouter:
+    """Sends HTTP API requests for a rollout to the replica owning its id on the hash ring.
+    
+    Rollouts started over the API run on their id's owner, just as resources are
+    reconciled by theirs, so status, events and pause actions for an id can be
+    answered by whichever replica the Service picked.
+    """
+    
+    FORWARDED_HEADER = 'X-Canary-Forwarded-By'
+    REQUEST_HEADERS = ('Content-Type', 'Accept', 'If-None-Match', 'Last-Event-ID')
+    RESPONSE_HEADERS = ('Content-type', 'ETag', 'Retry-After', 'Cache-Control')
+    
+    def __init__(self, membership, url_template):
+        self.membership = membership
+        self.url_template = url_template
+        self.session = requests.Session()
+    
+    def owner(self, rollout_id):
+        """Member owning rollout_id under the current shard map, or None before there is one"""
+        with self.membership.lock:
+            return self.membership.ring.owner(rollout_shard_key(rollout_id))
+    
+    def peers(self, rollout_id):
+        """The other members, rollout_id's owner first"""
+        membership = self.membership
+        with membership.lock:
+            owner = membership.ring.owner(rollout_shard_key(rollout_id))
+            members = membership.members
+        return sorted((member for member in members if member != membership.identity), key=lambda member: member != owner)
+    
+    def forward(self, identity, method, path, headers, body=None):
+        """Send a request on to a peer and return its (streamed) response"""
+        forwarded = {name: headers[name] for name in self.REQUEST_HEADERS if headers.get(name) is not None}
+        forwarded[self.FORWARDED_HEADER] = self.membership.identity
+        url = self.url_template.format(identity=identity).rstrip('/') + path
+        # Long-polls and event streams stay quiet for up to LONG_POLL_MAX / EVENT_HEARTBEAT
+        timeout = (PEER_CONNECT_TIMEOUT, LONG_POLL_MAX + EVENT_HEARTBEAT)
+        return self.session.request(method, url, data=body, headers=forwarded, stream=True, timeout=timeout)
+
+class StatusWriter:
+    """Coalesces resource status updates into rate-limited merge-patch writes.
+    
+    A newer update for a resource replaces the one still waiting, so however many
+    devices a rollout touches, each resource is written at most once per flush.
+    Flushes run every interval and write at most batch resources, oldest first;
+    phase changes trigger a flush straight away.
+    """
+    
+    def __init__(self, client, current, interval, batch):
+        self.client = client
+        # key -> cached object (or None), used for the resourceVersion precondition
+        self.current = current
+        self.interval = interval
+        self.batch = batch
+        self.cond = threading.Condition()
+        # key -> status waiting to be written, least recently written first
+        self.pending = OrderedDict()
+        self.urgent = set()
+        # key -> status last known to be on the resource
+        self.written = {}
+        self.last_flush = 0
+    
+    def start(self):
+        """Start the flush thread"""
+        threading.Thread(target=self.run, name='status-writer', daemon=True).start()
+    
+    def update(self, key, status, observed, urgent=False):
+        """Queue status for a resource unless observed (the cached status) or the last write already matches"""
+        with self.cond:
+            if all(observed.get(k) == v for k, v in status.items()):
+                self.written[key] = status
+            if self.written.get(key) == status:
+                self.pending.pop(key, None)
+                self.urgent.discard(key)
+                return
+            if urgent or status.get('phase') != (self.written.get(key) or observed).get('phase'):
+                self.urgent.add(key)
+            self.pending[key] = status
+            self.cond.notify()
+    
+    def forget(self, key):
+        """Drop everything known about a deleted resource"""
+        with self.cond:
+            self.pending.pop(key, None)
+            self.urgent.discard(key)
+            self.written.pop(key, None)
+    
+    def run(self):
+        """Flush loop"""
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    due = self.last_flush + self.interval
+                    if self.urgent or (self.pending and now >= due):
+                        break
+                    self.cond.wait(due - now if self.pending else None)
+                
+                keys = [k for k in self.pending if k in self.urgent]
+                keys.extend(k for k in self.pending if k not in self.urgent)
+                batch = [(key, self.pending.pop(key)) for key in keys[:self.batch]]
+                self.urgent.difference_update(keys[:self.batch])
+                self.last_flush = now
+            
+            for key, status in batch:
+                try:
+                    self.write(key, status)
+                    with self.cond:
+                        self.written[key] = status
+                except Exception as e:
+                    logger.error(f"Failed to write status of {key[1]}/{key[2]}: {str(e)}")
+                    with self.cond:
+                        # Retried on the next flush unless a newer status replaced it
+                        if key not in self.pending:
+                            self.pending[key] = status
+    
+    def write(self, key, status):
+        """Patch one resource's status, refetching and retrying when its resourceVersion moved on"""
+        plural, namespace, name = key
+        obj = self.current(key)
+        for attempt in range(STATUS_CONFLICT_RETRIES + 1):
+            if attempt:
+                obj = self.client.get(plural, namespace, name)
+            if obj is None or obj['metadata'].get('generation', 1) != status['observedGeneration']:
+                # Deleted or respecified; the reconciler handles the new generation
+                return
+            try:
+                self.client.patch_status(plural, namespace, name, status, obj['metadata'].get('resourceVersion'))
+                return
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code != 409 or attempt == STATUS_CONFLICT_RETRIES:
+                    raise
+                logger.info(f"☸️ Status conflict on {namespace}/{name}, retrying")
+
+class Informer:
+    """List+watch cache of one rollout.io resource; every change queues the object's key.
+    
+    The cache is filled by one (paged) list and then kept current by a watch that
+    resumes from the last seen resourceVersion, so the namespace is only listed
+    again when the API server reports that version as expired.
+    """
+    
+    def __init__(self, client, plural, namespace, queue):
+        self.client = client
+        self.plural = plural
+        self.namespace = namespace
+        self.queue = queue
+        self.lock = threading.Lock()
+        self.cache = {}
+        self.resource_version = None
+        self.synced = threading.Event()
+    
+    def start(self):
+        """Start the list+watch thread"""
+        threading.Thread(target=self.run, name=f'informer-{self.plural}', daemon=True).start()
+    
+    def get(self, namespace, name):
+        """Cached object, or None if it doesn't exist"""
+        with self.lock:
+            return self.cache.get((namespace, name))
+    
+    def keys(self):
+        """(namespace, name) of every cached object"""
+        with self.lock:
+            return list(self.cache)
+    
+    def run(self):
+        """List once, then watch from the last resourceVersion, relisting only when it expires"""
+        backoff = 1
+        while True:
+            try:
+                if self.resource_version is None:
+                    self.relist()
+                for event in self.client.watch(self.plural, self.namespace, self.resource_version):
+                    self.handle(event)
+                backoff = 1
+            except WatchExpired:
+                logger.info(f"☸️ {self.plural} watch expired, relisting")
+                self.resource_version = None
+            except Exception as e:
+                logger.warning(f"☸️ {self.plural} watch error: {str(e)}; retrying in {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+    
+    def relist(self):
+        """Replace the cache from a full list, queueing only objects that changed or disappeared"""
+        items, resource_version = self.client.list(self.plural, self.namespace)
+        fresh = {(o['metadata'].get('namespace', ''), o['metadata']['name']): o for o in items}
+        with self.lock:
+            changed = [key for key, obj in fresh.items()
+                       if key not in self.cache
+                       or self.cache[key]['metadata'].get('resourceVersion') != obj['metadata'].get('resourceVersion')]
+            changed.extend(key for key in self.cache if key not in fresh)
+            self.cache = fresh
+            self.resource_version = resource_version
+        self.synced.set()
+        logger.info(f"☸️ Listed {len(fresh)} {self.plural} at resourceVersion {resource_version}")
+        for namespace, name in changed:
+            self.queue.add((self.plural, namespace, name))
+    
+    def handle(self, event):
+        """Apply one watch event to the cache"""
+        obj = event.get('object', {})
+        if event['type'] == 'ERROR':
+            if obj.get('code') == 410:
+                raise WatchExpired()
+            raise RuntimeError(obj.get('message', 'watch error'))
+        
+        metadata = obj.get('metadata', {})
+        if event['type'] == 'BOOKMARK':
+            self.resource_version = metadata.get('resourceVersion', self.resource_version)
+            return
+        
+        key = (metadata.get('namespace', ''), metadata['name'])
+        with self.lock:
+            if event['type'] == 'DELETED':
+                self.cache.pop(key, None)
+            else:
+                self.cache[key] = obj
+            self.resource_version = metadata.get('resourceVersion', self.resource_version)
+        self.queue.add((self.plural,) + key)
+
+class RolloutReconciler:
+    """Starts rollouts from NetworkRollout/ConfigRollout resources and writes their status back.
+    
+    Each resource generation runs as rollout '<namespace>/<name>@<generation>'.
+    Rollout progress events requeue the owning resource, so status follows the
+    rollout without polling; the queue collapses bursts of device events and the
+    status writer batches what's left into periodic writes.
+    
+    With a membership, a replica only runs the resources the shard map gives it.
+    A replica that loses a resource stops its rollout and clears status.owner. The
+    new owner waits for that, or for the old owner to drop out of the map, and then
+    resumes the interrupted step's window of targets, recomputed from the spec. Devices
+    of that window missing from the (capped) status lists are pushed again; devices
+    of earlier steps never are, and only their counts carry over.
+    """
+    
+    KINDS = {'networkrollouts': 'NetworkRollout', 'configrollouts': 'ConfigRollout'}
+    
+    def __init__(self, server, client, membership=None):
+        self.server = server
+        self.client = client
+        self.membership = membership
+        self.queue = WorkQueue(RECONCILE_BACKOFF, RECONCILE_MAX_BACKOFF)
+        self.informers = {plural: Informer(client, plural, WATCH_NAMESPACE, self.queue) for plural in self.KINDS}
+        self.status_writer = StatusWriter(client, lambda key: self.informers[key[0]].get(key[1], key[2]),
+                                          STATUS_WRITE_INTERVAL, STATUS_WRITE_BATCH)
+        self.lock = threading.Lock()
+        # Rollout id -> queue key of the resource that owns it
+        self.owners = {}
+        server.events.subscribe(self.rollout_changed)
+        if membership is not None:
+            membership.subscribe(self.members_changed)
+    
+    def start(self):
+        """Start the informers and reconcile workers"""
+        for informer in self.informers.values():
+            informer.start()
+        self.status_writer.start()
+        for i in range(RECONCILE_WORKERS):
+            threading.Thread(target=self.work, name=f'reconciler-{i}', daemon=True).start()
+        if self.server.executor.recovered:
+            threading.Thread(target=self.discard_orphans, name='reconciler-orphans', daemon=True).start()
+    
+    def discard_orphans(self):
+        """Once the caches are filled, close out held journal state of resources that no longer exist"""
+        for informer in self.informers.values():
+            informer.synced.wait()
+        for rollout_id, state in list(self.server.executor.recovered.items()):
+            plural, namespace, name = state['resource']
+            if plural not in self.informers or self.informers[plural].get(namespace, name) is None:
+                logger.info(f"🛑 Dropping recovered rollout {rollout_id}: its resource was deleted")
+                self.server.executor.discard_recovered(rollout_id, 'Failed', 'Resource deleted')
+    
+    def members_changed(self, members):
+        """Shard map listener: recheck ownership of every known resource"""
+        for plural, informer in self.informers.items():
+            for namespace, name in informer.keys():
+                self.queue.add((plural, namespace, name))
+    
+    def rollout_changed(self, rollout_id, event):
+        """Progress event listener: requeue the resource that owns the rollout"""
+        with self.lock:
+            key = self.owners.get(rollout_id)
+        if key is not None:
+            self.queue.add(key)
+    
+    def work(self):
+        """Reconcile worker loop"""
+        while True:
+            key = self.queue.get()
+            try:
+                self.reconcile(key)
+                self.queue.forget(key)
+            except Exception as e:
+                logger.error(f"Failed to reconcile {key[1]}/{key[2]}: {str(e)}")
+                self.queue.add_rate_limited(key)
+            finally:
+                self.queue.done(key)
+    
+    def reconcile(self, key):
+        """Start the resource's current generation if needed and sync its status"""
+        plural, namespace, name = key
+        obj = self.informers[plural].get(namespace, name)
+        generation = obj['metadata'].get('generation', 1) if obj is not None else None
+        rollout_id = f"{namespace}/{name}@{generation}"
+        
+        # A deleted resource stops pushing, and so does an older generation once the spec changes
+        for stale_id in self.rollouts_of(namespace, name):
+            if stale_id == rollout_id:
+                continue
+            message = 'Resource deleted' if obj is None else f"Superseded by generation {generation}"
+            logger.info(f"🛑 Stopping rollout {stale_id}: {message}")
+            if not self.server.executor.discard_recovered(stale_id, 'Failed', message):
+                self.server.executor.stop_rollout(stale_id, 'Failed', message)
+            with self.lock:
+                self.owners.pop(stale_id, None)
+        if obj is None:
+            self.status_writer.forget(key)
+            return
+        
+        status = obj.get('status') or {}
+        
+        if self.membership is not None and not self.membership.owns(f"{namespace}/{name}"):
+            if rollout_id in self.server.executor.recovered and not self.membership.valid():
+                # Just restarted and not in a shard map yet: keep the journaled progress until we know the owner
+                self.queue.add_after(key, self.membership.renew_interval)
+                return
+            self.release(key, rollout_id, generation, status)
+            return
+        
+        rollout = self.server.active_rollouts.get(rollout_id)
+        if rollout is None or rollout.get('phase') == HANDED_OFF:
+            if status.get('observedGeneration') == generation and status.get('phase') in TERMINAL_PHASES:
+                self.server.executor.discard_recovered(rollout_id, status['phase'], status.get('message'))
+                return
+            handoff = self.membership is not None and status.get('rolloutId') == rollout_id
+            if handoff and status.get('owner') not in (None, '', self.membership.identity) and self.membership.alive(status['owner']):
+                # The previous owner is still up and hasn't stopped the rollout yet
+                self.queue.add_after(key, self.membership.renew_interval)
+                return
+            if handoff and status.get('owner') != self.membership.identity:
+                # Another replica ran it after our journal was written; its status is newer
+                self.server.executor.discard_recovered(rollout_id, HANDED_OFF)
+            recovered = self.server.executor.recovered.pop(rollout_id, None)
+            with self.lock:
+                self.owners[rollout_id] = key
+            action = 'Resuming' if recovered else 'Taking over' if handoff else 'Starting'
+            logger.info(f"☸️ {action} rollout {rollout_id} for {self.KINDS[plural]} {namespace}/{name}")
+            try:
+                if recovered:
+                    self.server.executor.start_rollout(rollout_id, recovered['spec'], recovered, key)
+                else:
+                    spec = self.rollout_spec(plural, obj.get('spec', {}))
+                    self.server.executor.start_rollout(rollout_id, spec, self.handoff_state(status, spec) if handoff else None, key)
+            except RolloutConflict:
+                # Our handed-off run of this id is still winding down; take it back once it has finished
+                if recovered:
+                    self.server.executor.recovered[rollout_id] = recovered
+                self.queue.add_after(key, RECONCILE_BACKOFF)
+                return
+            except ValueError as e:
+                # An invalid spec won't get better by retrying; report it on the resource
+                self.status_writer.update(key, {
+                    'phase': 'Failed', 'message': f"Invalid spec: {str(e)}",
+                    'observedGeneration': generation, 'rolloutId': rollout_id
+                }, status)
+                return
+            rollout = self.server.active_rollouts.get(rollout_id)
+        else:
+            with self.lock:
+                self.owners[rollout_id] = key
+        
+        desired = self.rollout_status(rollout_id, rollout, generation)
+        self.status_writer.update(key, desired, status)
+        if desired['phase'] in TERMINAL_PHASES:
+            with self.lock:
+                self.owners.pop(rollout_id, None)
+    
+    def release(self, key, rollout_id, generation, status):
+        """Let go of a resource another replica owns now, stopping our rollout of it"""
+        if self.server.executor.discard_recovered(rollout_id, HANDED_OFF):
+            logger.info(f"🤝 Leaving recovered rollout {rollout_id} to its owner")
+        rollout = self.server.active_rollouts.get(rollout_id)
+        if rollout_id in self.server.active_rollouts:
+            logger.info(f"🤝 Handing off rollout {rollout_id}")
+            self.server.executor.stop_rollout(rollout_id)
+        elif rollout is None or status.get('owner') != self.membership.identity or status.get('phase') in TERMINAL_PHASES:
+            return
+        
+        # Last progress we know of, so the new owner resumes where we stopped
+        desired = self.rollout_status(rollout_id, rollout, generation)
+        if desired['phase'] == HANDED_OFF:
+            desired['phase'] = 'Progressing'
+            desired['message'] = ''
+        desired['owner'] = None
+        self.status_writer.update(key, desired, status, urgent=True)
+        with self.lock:
+            self.owners.pop(rollout_id, None)
+    
+    def rollouts_of(self, namespace, name):
+        """Live (or recovered and held) rollout ids of any generation of a resource"""
+        prefix = f"{namespace}/{name}@"
+        rollout_ids = self.server.active_rollouts.ids() + list(self.server.executor.recovered)
+        return [rollout_id for rollout_id in rollout_ids if rollout_id.startswith(prefix)]
+    
+    def handoff_state(self, status, spec):
+        """Resume state for a rollout taken over from another replica, from its resource status"""
+        devices = {device_id: True for device_id in status.get('completedDevices') or []}
+        devices.update((device_id, False) for device_id in status.get('failedDevices') or [])
+        resume = {
+            'handoff': True,
+            'start_time': datetime.now().isoformat(),
+            'step': max(0, status.get('currentStep', 0) - 1),
+            'window': None,
+            'devices': devices,
+            'carried': None
+        }
+        
+        table = spec['targetDevices']
+        windows = step_windows(len(table), spec.get('canarySteps', []))
+        if not status.get('currentStep') or resume['step'] >= len(windows):
+            return resume
+        
+        # Steps are contiguous target-order windows: resume inside the interrupted step's window and
+        # skip everything before it, whether or not the capped status lists named those devices
+        resume['window'] = windows[resume['step']]
+        known = {True: 0, False: 0}
+        for device_id, success in devices.items():
+            row = table.row(device_id)
+            if row is not None and row < resume['window'][0]:
+                known[success] += 1
+        before = status.get('stepStartCounts') or {}
+        resume['carried'] = {
+            'completed': max(0, before.get('completed', 0) - known[True]),
+            'failed': max(0, before.get('failed', 0) - known[False])
+        }
+        return resume
+    
+    def rollout_spec(self, plural, spec):
+        """Canary rollout spec for a resource spec"""
+        if plural == 'networkrollouts':
+            return dict(spec, targetDevices=DeviceTable(spec.get('targetDevices', [])))
+        # ConfigRollout: config.data is the payload and targets are bare device ids
+        config = {k: v for k, v in spec.get('config', {}).items() if k != 'data'}
+        config['payload'] = spec.get('config', {}).get('data', {})
+        devices = [{'id': device_id} for device_id in spec.get('targetDevices', [])]
+        if DEVICE_ENDPOINT_TEMPLATE:
+            for device in devices:
+                device['apiEndpoint'] = DEVICE_ENDPOINT_TEMPLATE.format(id=device['id'])
+        return {'config': config, 'targetDevices': DeviceTable(devices), 'canarySteps': spec.get('rolloutSteps', [])}
+    
+    def rollout_status(self, rollout_id, rollout, generation):
+        """Resource status for a rollout record (or finished summary); long device lists become counts"""
+        with self.server.rollouts_lock:
+            completed = rollout.get('completed_devices', [])
+            failed = rollout.get('failed_devices', [])
+            carried = rollout.get('carried_counts') or {'completed': 0, 'failed': 0}
+            table = rollout.get('device_table')
+            return {
+                'phase': rollout.get('phase'),
+                'message': rollout.get('message') or '',
+                'currentStep': rollout.get('current_step', 0),
+                # None removes the list from the resource once it outgrows the cap
+                'completedDevices': list(completed) if len(completed) <= STATUS_DEVICE_LIST_MAX else None,
+                'failedDevices': failed[:STATUS_DEVICE_LIST_MAX],
+                'deviceCounts': {
+                    'total': len(table) if table is not None else rollout.get('total_devices', 0),
+                    'completed': len(completed) + carried['completed'],
+                    'failed': len(failed) + carried['failed']
+                },
+                'stepStartCounts': rollout.get('step_start_counts'),
+                'observedGeneration': generation,
+                'rolloutId': rollout_id,
+                'owner': self.membership.identity if self.membership is not None else None
+            }
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles requests on a bounded worker pool and sheds excess load with 503"""
+    
+    def __init__(self, server_address, handler_class, workers=0, max_pending=0):
+        super().__init__(server_address, handler_class)
+        # workers=0 keeps plain HTTPServer behaviour (one request at a time)
+        self.request_pool = None
+        self.request_slots = None
+        if workers > 0:
+            self.request_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http-worker')
+            self.request_slots = threading.BoundedSemaphore(workers + max_pending)
+    
+    def process_request(self, request, client_address):
+        """Hand the connection to a worker, or reject it if the pool and queue are full"""
+        if self.request_pool is None:
+            return super().process_request(request, client_address)
+        
+        if not self.request_slots.acquire(blocking=False):
+            self.reject_request(request)
+            self.shutdown_request(request)
+            return
+        
+        self.request_pool.submit(self.process_request_worker, request, client_address)
+    
+    def process_request_worker(self, request, client_address):
+        """Run one request on a pool thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.request_slots.release()
+    
+    def reject_request(self, request):
+        """Write a 503 with Retry-After straight to the socket"""
+        body = json.dumps({"status": "error", "message": "Server busy, retry later"}).encode()
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            f"Retry-After: {HTTP_RETRY_AFTER}\r\n"
+            "Content-type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        try:
+            request.sendall(head.encode() + body)
+        except OSError:
+            pass
 
-class CanaryServer(HTTPServer):
+class CanaryServer(PooledHTTPServer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.active_rollouts = {}
+        self.active_rollouts = RolloutRegistry(FINISHED_ROLLOUTS_MAX, FINISHED_ROLLOUTS_TTL, HISTORY_DIR)
+        self.rollouts_lock = self.active_rollouts.lock
+        self.metrics = ControllerMetrics()
+        self.journal = RolloutJournal(JOURNAL_PATH, JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPACT_EVERY)
+        self.events = RolloutEvents(EVENT_BUFFER, FINISHED_ROLLOUTS_MAX)
+        self.event_streams = threading.BoundedSemaphore(EVENT_STREAMS_MAX)
+        self.executor = RolloutExecutor(self)
+        # Set when rollouts are sharded across replicas
+        self.router = None
         self.start_time = time.time()
 
 def run_server():
     """Start the canary controller server"""
-    server = CanaryServer(('0.0.0.0', 8080), CanaryController)
-    logger.info("🚀 Canary Controller running on port 8080")
+    workers = HTTP_WORKERS if SERVER_MODE == 'threaded' else 0
+    server = CanaryServer(('0.0.0.0', 8080), CanaryController, workers=workers, max_pending=HTTP_MAX_PENDING)
+    # Resource rollouts wait for the reconciler, which knows which ones this replica owns
+    server.executor.recover_rollouts(defer_resources=KUBE_WATCH)
+    client = KubeClient(KUBE_API) if KUBE_WATCH or LEASE_BACKEND == 'kube' else None
+    membership = None
+    if LEASE_BACKEND:
+        backend = KubeLeases(client, LEASE_NAMESPACE) if LEASE_BACKEND == 'kube' else FileLeases(LEASE_DIR)
+        membership = Membership(backend, IDENTITY, LEASE_DURATION)
+        membership.start()
+        logger.info(f"🗳️ Sharding rollouts across replicas as {IDENTITY} ({LEASE_BACKEND} leases)")
+        if PEER_URL_TEMPLATE:
+            server.router = PeerRouter(membership, PEER_URL_TEMPLATE)
+            logger.info(f"🔀 Forwarding HTTP API requests to their rollout's owner at {PEER_URL_TEMPLATE}")
+    if KUBE_WATCH:
+        server.reconciler = RolloutReconciler(server, client, membership)
+        server.reconciler.start()
+        logger.info(f"☸️ Watching NetworkRollout/ConfigRollout resources in {WATCH_NAMESPACE or 'all namespaces'}")
+    logger.info(f"🚀 Canary Controller running on port 8080 ({SERVER_MODE} mode)")
     logger.info("📡 Available endpoints:")
     logger.info("   GET  /health - Health check")
     logger.info("   GET  /metrics - System metrics")
+    logger.info("   GET  /rollouts/{id}/events - Rollout progress (SSE, or long-poll with ?since=&wait=)")
     logger.info("   POST /start-rollout - Start canary rollout")
     logger.info("   POST /rollout-status - Get rollout status")
     logger.info("   POST /validate-device - Validate device config")
+    logger.info("   POST /validate-devices - Validate a batch of devices in parallel")
+    logger.info("   POST /promote-rollout - Skip the current pause")
+    logger.info("   POST /abort-rollout - Abort a paused rollout")
+    logger.info("   POST /extend-pause - Extend the current pause")
     server.serve_forever()
 
 if __name__ == '__main__':
@@ -4,6 +4,8 @@ Dummy Controller for Config Rollout
 Receives webhook calls and simulates sending configurations to devices
 """
 
+import hashlib
+import ipaddress
 import json
 import time
 import random
@@ -11,11 +13,363 @@ from http.server import HTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
 import threading
 import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# HTTP serving: "threaded" (bounded worker pool) or "single" (one request at a time)
+SERVER_MODE = os.environ.get('SERVER_MODE', 'threaded')
+HTTP_WORKERS = int(os.environ.get('HTTP_WORKERS', '16'))
+# Connections allowed to wait for a worker before we answer 503
+HTTP_MAX_PENDING = int(os.environ.get('HTTP_MAX_PENDING', '64'))
+HTTP_RETRY_AFTER = int(os.environ.get('HTTP_RETRY_AFTER', '1'))
+# Validation results kept per config hash (LRU)
+VALIDATION_CACHE_SIZE = int(os.environ.get('VALIDATION_CACHE_SIZE', '256'))
+
+# Device config shape (see example-config.json), in the JSON Schema subset compile_schema() understands
+CONFIG_SCHEMA = {
+    'type': 'object',
+    'required': ['name', 'version', 'interfaces'],
+    'properties': {
+        'name': {'type': 'string', 'minLength': 1},
+        'version': {'type': 'string', 'minLength': 3},
+        'timestamp': {'type': 'string'},
+        'interfaces': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['name', 'ip'],
+                'properties': {
+                    'name': {'type': 'string', 'minLength': 1},
+                    'ip': {'type': 'string', 'format': 'ipv4-interface'},
+                    'status': {'type': 'string', 'enum': ['up', 'down']},
+                    'description': {'type': 'string'}
+                }
+            }
+        },
+        'routing': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['destination', 'gateway', 'interface'],
+                'properties': {
+                    'destination': {'type': 'string', 'format': 'ipv4-network'},
+                    'gateway': {'type': 'string', 'format': 'ipv4'},
+                    'interface': {'type': 'string'},
+                    'metric': {'type': 'integer', 'minimum': 0}
+                }
+            }
+        },
+        'services': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['name', 'port', 'protocol'],
+                'properties': {
+                    'name': {'type': 'string', 'minLength': 1},
+                    'port': {'type': 'integer', 'minimum': 1, 'maximum': 65535},
+                    'enabled': {'type': 'boolean'},
+                    'protocol': {'type': 'string', 'enum': ['tcp', 'udp']}
+                }
+            }
+        },
+        'firewall': {
+            'type': 'object',
+            'properties': {
+                'rules': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'required': ['name', 'action', 'source'],
+                        'properties': {
+                            'name': {'type': 'string', 'minLength': 1},
+                            'action': {'type': 'string', 'enum': ['allow', 'deny']},
+                            'protocol': {'type': 'string', 'enum': ['tcp', 'udp', 'icmp', 'any']},
+                            'port': {'type': 'integer', 'minimum': 1, 'maximum': 65535},
+                            'source': {'type': 'string', 'format': 'ipv4-network'}
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+def parse_interface(value):
+    """Interface address with its prefix length, e.g. 10.0.0.1/24"""
+    if '/' not in value:
+        raise ValueError(f"{value} has no prefix length")
+    return ipaddress.IPv4Interface(value)
+
+SCHEMA_TYPES = {'object': dict, 'array': list, 'string': str, 'integer': int, 'boolean': bool}
+# String formats: each parser raises ValueError on bad input
+SCHEMA_FORMATS = {
+    'ipv4': ipaddress.IPv4Address,
+    'ipv4-network': ipaddress.IPv4Network,
+    'ipv4-interface': parse_interface
+}
+
+def compile_schema(schema):
+    """Compile a schema into a check(value, path, errors) function, resolving every keyword once"""
+    python_type = SCHEMA_TYPES.get(schema.get('type'))
+    required = schema.get('required', ())
+    properties = {name: compile_schema(sub) for name, sub in schema.get('properties', {}).items()}
+    items = compile_schema(schema['items']) if 'items' in schema else None
+    enum = schema.get('enum')
+    minimum = schema.get('minimum')
+    maximum = schema.get('maximum')
+    min_length = schema.get('minLength')
+    parse = SCHEMA_FORMATS.get(schema.get('format'))
+    
+    def check(value, path, errors):
+        if python_type is not None and (not isinstance(value, python_type)
+                                        or (python_type is int and isinstance(value, bool))):
+            errors.append({'path': path, 'message': f"expected {schema['type']}"})
+            return
+        if enum is not None and value not in enum:
+            errors.append({'path': path, 'message': f"must be one of {', '.join(enum)}"})
+        if minimum is not None and value < minimum:
+            errors.append({'path': path, 'message': f"must be at least {minimum}"})
+        if maximum is not None and value > maximum:
+            errors.append({'path': path, 'message': f"must be at most {maximum}"})
+        if min_length is not None and len(value) < min_length:
+            errors.append({'path': path, 'message': f"must be at least {min_length} characters"})
+        if parse is not None:
+            try:
+                parse(value)
+            except ValueError as e:
+                errors.append({'path': path, 'message': str(e)})
+        for name in required:
+            if name not in value:
+                errors.append({'path': f"{path}.{name}", 'message': 'is required'})
+        for name, check_property in properties.items():
+            if name in value:
+                check_property(value[name], f"{path}.{name}", errors)
+        if items is not None:
+            for i, item in enumerate(value):
+                items(item, f"{path}[{i}]", errors)
+    
+    return check
+
+class PrefixTrie:
+    """Binary trie over IPv4 prefixes; every lookup walks at most 32 levels however many prefixes it holds"""
+    
+    def __init__(self):
+        # Node: [zero child, one child, {key: value} stored at exactly this prefix]
+        self.root = [None, None, None]
+    
+    def insert(self, network, key, value):
+        """Store value under key at network unless the key is already there; returns the stored value"""
+        node = self.root
+        bits = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (bits >> (31 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            node[2] = {}
+        return node[2].setdefault(key, value)
+    
+    def path(self, network):
+        """Nodes from the root towards network's node, stopping where the trie ends"""
+        node = self.root
+        bits = int(network.network_address)
+        yield node
+        for i in range(network.prefixlen):
+            node = node[(bits >> (31 - i)) & 1]
+            if node is None:
+                return
+            yield node
+    
+    def covering(self, network):
+        """Entry dicts of network and every broader prefix containing it, broadest first"""
+        for node in self.path(network):
+            if node[2]:
+                yield node[2]
+    
+    def longest_match(self, address):
+        """Entries of the most specific prefix containing address, or None"""
+        match = None
+        for entries in self.covering(ipaddress.IPv4Network(address)):
+            match = entries
+        return match
+    
+    def first_within(self, network):
+        """Some (key, value) stored at network or a more specific prefix inside it, or None"""
+        node = None
+        for depth, node in enumerate(self.path(network)):
+            pass
+        if node is None or depth != network.prefixlen:
+            return None
+        # Every node was created on the way to a stored prefix, so this descent ends at one
+        while not node[2]:
+            node = node[0] or node[1]
+        return next(iter(node[2].items()))
+
+def config_conflicts(config):
+    """Overlapping subnets, ambiguous routes, unreachable gateways and shadowed firewall rules in a device config.
+    
+    Interfaces, routes and rule sources go into prefix tries, so each entry is checked
+    against the others in at most 32 steps instead of by pairwise comparison. Entries
+    that don't parse are skipped; returns (errors, warnings) as lists of {path, message}.
+    """
+    errors = []
+    warnings = []
+    
+    connected = PrefixTrie()
+    names = set()
+    for i, interface in enumerate(config.get('interfaces') or []):
+        names.add(interface.get('name') if isinstance(interface, dict) else None)
+        try:
+            network = ipaddress.IPv4Interface(interface['ip']).network
+        except (KeyError, TypeError, ValueError):
+            continue
+        overlap = next(iter(next(connected.covering(network), {}).items()), None) or connected.first_within(network)
+        if overlap is not None:
+            errors.append({'path': f"$.interfaces[{i}].ip",
+                           'message': f"subnet {network} overlaps interface {overlap[0]} ({overlap[1]})"})
+        connected.insert(network, interface.get('name'), network)
+    
+    routes = PrefixTrie()
+    for i, route in enumerate(config.get('routing') or []):
+        path = f"$.routing[{i}]"
+        try:
+            destination = ipaddress.IPv4Network(route['destination'])
+            gateway = ipaddress.IPv4Address(route['gateway'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        
+        metric = route.get('metric', 0)
+        first = routes.insert(destination, metric, i)
+        if first != i:
+            errors.append({'path': f"{path}.destination",
+                           'message': f"{destination} with metric {metric} is also routed by routing[{first}]"})
+        
+        match = connected.longest_match(gateway)
+        if 'interface' in route and route['interface'] not in names:
+            errors.append({'path': f"{path}.interface", 'message': f"unknown interface {route['interface']}"})
+        elif match is None:
+            errors.append({'path': f"{path}.gateway", 'message': f"gateway {gateway} is not on any connected subnet"})
+        elif 'interface' in route and route['interface'] not in match:
+            name, network = next(iter(match.items()))
+            errors.append({'path': f"{path}.gateway",
+                           'message': f"gateway {gateway} is on {name} ({network}), not {route['interface']}"})
+        
+        for entries in connected.covering(destination):
+            for name, network in entries.items():
+                if name != route.get('interface') and network.prefixlen < destination.prefixlen:
+                    warnings.append({'path': f"{path}.destination",
+                                     'message': f"{destination} overrides part of {name}'s connected subnet {network}"})
+    
+    rules = PrefixTrie()
+    for i, rule in enumerate((config.get('firewall') or {}).get('rules') or []):
+        try:
+            source = ipaddress.IPv4Network(rule['source'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        protocol = rule.get('protocol', 'any')
+        port = rule.get('port')
+        # Earlier rules matching everything this one does: same protocol and port, the whole protocol, or anything
+        keys = {(protocol, port), (protocol, None), ('any', None)}
+        # The first of those in rule order decides the traffic, whichever prefix it sits on
+        shadow = min((entries[key] for entries in rules.covering(source) for key in keys if key in entries), default=None)
+        if shadow is not None:
+            j, name, action = shadow
+            if action != rule.get('action'):
+                errors.append({'path': f"$.firewall.rules[{i}]",
+                               'message': f"never matches: rule {name} (rules[{j}], {action}) matches all its traffic first"})
+            else:
+                warnings.append({'path': f"$.firewall.rules[{i}]",
+                                 'message': f"redundant: rule {name} (rules[{j}]) already {action}s all its traffic"})
+        rules.insert(source, (protocol, port), (i, rule.get('name'), rule.get('action')))
+    
+    return errors, warnings
+
+class ConfigValidator:
+    """Schema plus cross-field checks for device configs, with results cached by config hash"""
+    
+    def __init__(self, schema, cache_size):
+        self.check_schema = compile_schema(schema)
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        # config hash -> result, least recently used first
+        self.cache = OrderedDict()
+    
+    def validate(self, config):
+        """Result dict (valid, errors, warnings, configHash, cached) for a config"""
+        config_hash = hashlib.sha256(json.dumps(config, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+        with self.lock:
+            result = self.cache.get(config_hash)
+            if result is not None:
+                self.cache.move_to_end(config_hash)
+                return dict(result, cached=True)
+        
+        errors = []
+        warnings = []
+        self.check_schema(config, '$', errors)
+        # Cross-field checks assume the shapes the schema guarantees
+        if not errors:
+            self.check_config(config, errors, warnings)
+        result = {'valid': not errors, 'errors': errors, 'warnings': warnings, 'configHash': config_hash}
+        
+        with self.lock:
+            self.cache[config_hash] = result
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return dict(result, cached=False)
+    
+    def check_config(self, config, errors, warnings):
+        """Checks spanning several fields: unique names, address conflicts (config_conflicts), service and rule consistency"""
+        interfaces = {}
+        for i, interface in enumerate(config['interfaces']):
+            path = f"$.interfaces[{i}]"
+            if interface['name'] in interfaces:
+                errors.append({'path': f"{path}.name", 'message': f"duplicate interface {interface['name']}"})
+                continue
+            address = parse_interface(interface['ip'])
+            if address.network.prefixlen < 31 and address.ip in (address.network.network_address,
+                                                                 address.network.broadcast_address):
+                errors.append({'path': f"{path}.ip", 'message': f"{interface['ip']} is not a host address in {address.network}"})
+            interfaces[interface['name']] = address
+        
+        for i, route in enumerate(config.get('routing', [])):
+            address = interfaces.get(route['interface'])
+            if address is not None and ipaddress.IPv4Address(route['gateway']) == address.ip:
+                errors.append({'path': f"$.routing[{i}].gateway",
+                               'message': f"gateway {route['gateway']} is the interface's own address"})
+        
+        ports = {}
+        for i, service in enumerate(config.get('services', [])):
+            key = (service['port'], service['protocol'])
+            if key in ports:
+                errors.append({'path': f"$.services[{i}].port",
+                               'message': f"{service['protocol']}/{service['port']} already used by service {ports[key]}"})
+            else:
+                ports[key] = service['name']
+        enabled = {(s['port'], s['protocol']) for s in config.get('services', []) if s.get('enabled', True)}
+        
+        names = set()
+        for i, rule in enumerate(config.get('firewall', {}).get('rules', [])):
+            path = f"$.firewall.rules[{i}]"
+            if rule['name'] in names:
+                errors.append({'path': f"{path}.name", 'message': f"duplicate rule {rule['name']}"})
+            names.add(rule['name'])
+            protocol = rule.get('protocol', 'any')
+            if 'port' in rule and protocol in ('icmp', 'any'):
+                errors.append({'path': f"{path}.port", 'message': f"a port needs protocol tcp or udp, not {protocol}"})
+            elif rule['action'] == 'allow' and 'port' in rule and (rule['port'], protocol) not in enabled:
+                warnings.append({'path': path, 'message': f"allows {protocol}/{rule['port']} but no enabled service listens there"})
+        
+        # Overlapping subnets, duplicate routes, unreachable gateways and shadowed rules, via prefix tries
+        conflict_errors, conflict_warnings = config_conflicts(config)
+        errors.extend(conflict_errors)
+        warnings.extend(conflict_warnings)
+
 class ConfigController(BaseHTTPRequestHandler):
     def do_GET(self):
         """Handle GET requests"""
@@ -65,24 +419,51 @@ class ConfigController(BaseHTTPRequestHandler):
             post_data = self.rfile.read(content_length)
             data = json.loads(post_data.decode('utf-8'))
             
-            logger.info(f"Validating config: {data.get('configVersion', 'unknown')}")
+            # Either {"config": {...}, "configVersion": ...} or the config document itself
+            if not isinstance(data, dict):
+                data = {'config': data}
+            config_version = data.get('configVersion')
+            if 'config' not in data and not any(key in CONFIG_SCHEMA['properties'] for key in data):
+                # The old contract sent only a version; passing that would approve a config nobody checked
+                logger.warning(f"Rejected validation of {config_version or 'unknown'}: no config document")
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                response = {
+                    "status": "failure",
+                    "message": "Config required: send {\"config\": {...}} or the config document itself",
+                    "configVersion": config_version or 'unknown',
+                    "errors": [{"path": "$.config", "message": "is required"}]
+                }
+                self.wfile.write(json.dumps(response).encode())
+                return
+            
+            config = data.get('config', data)
+            config_version = config_version or (config.get('version') if isinstance(config, dict) else None)
+            logger.info(f"Validating config: {config_version or 'unknown'}")
             
-            # Simulate validation logic
-            success = self.validate_config(data)
+            result = self.validate_config(config)
             
-            if success:
+            if result['valid']:
                 self.send_response(200)
                 response = {
                     "status": "success", 
                     "message": "Configuration validation passed",
-                    "configVersion": data.get('configVersion', 'unknown')
+                    "configVersion": config_version or 'unknown',
+                    "configHash": result['configHash'],
+                    "cached": result['cached'],
+                    "warnings": result['warnings']
                 }
             else:
                 self.send_response(400)
                 response = {
                     "status": "failure", 
                     "message": "Configuration validation failed",
-                    "configVersion": data.get('configVersion', 'unknown')
+                    "configVersion": config_version or 'unknown',
+                    "configHash": result['configHash'],
+                    "cached": result['cached'],
+                    "errors": result['errors'],
+                    "warnings": result['warnings']
                 }
             
             self.send_header('Content-type', 'application/json')
@@ -165,17 +546,9 @@ class ConfigController(BaseHTTPRequestHandler):
             response = {"status": "error", "message": str(e)}
             self.wfile.write(json.dumps(response).encode())
     
-    def validate_config(self, data):
-        """Simulate configuration validation"""
-        time.sleep(1)  # Simulate processing time
-        
-        # Simple validation logic
-        config_version = data.get('configVersion', '')
-        if not config_version or len(config_version) < 3:
-            return False
-            
-        # Randomly pass/fail for demo purposes (90% success rate)
-        return random.random() < 0.9
+    def validate_config(self, config):
+        """Validate a device config against the schema and cross-field rules (cached by config hash)"""
+        return self.server.validator.validate(config)
     
     def send_config_to_device(self, device_id, config_data):
         """Simulate sending configuration to a device"""
@@ -207,10 +580,62 @@ class ConfigController(BaseHTTPRequestHandler):
         """Suppress default logging"""
         pass
 
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles requests on a bounded worker pool and sheds excess load with 503"""
+    
+    def __init__(self, server_address, handler_class, workers=0, max_pending=0):
+        super().__init__(server_address, handler_class)
+        # workers=0 keeps plain HTTPServer behaviour (one request at a time)
+        self.request_pool = None
+        self.request_slots = None
+        if workers > 0:
+            self.request_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http-worker')
+            self.request_slots = threading.BoundedSemaphore(workers + max_pending)
+    
+    def process_request(self, request, client_address):
+        """Hand the connection to a worker, or reject it if the pool and queue are full"""
+        if self.request_pool is None:
+            return super().process_request(request, client_address)
+        
+        if not self.request_slots.acquire(blocking=False):
+            self.reject_request(request)
+            self.shutdown_request(request)
+            return
+        
+        self.request_pool.submit(self.process_request_worker, request, client_address)
+    
+    def process_request_worker(self, request, client_address):
+        """Run one request on a pool thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.request_slots.release()
+    
+    def reject_request(self, request):
+        """Write a 503 with Retry-After straight to the socket"""
+        body = json.dumps({"status": "error", "message": "Server busy, retry later"}).encode()
+        head = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            f"Retry-After: {HTTP_RETRY_AFTER}\r\n"
+            "Content-type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        try:
+            request.sendall(head.encode() + body)
+        except OSError:
+            pass
+
 def run_server():
     """Start the webhook server"""
-    server = HTTPServer(('0.0.0.0', 8080), ConfigController)
-    logger.info("🚀 Config Controller running on port 8080")
+    workers = HTTP_WORKERS if SERVER_MODE == 'threaded' else 0
+    server = PooledHTTPServer(('0.0.0.0', 8080), ConfigController, workers=workers, max_pending=HTTP_MAX_PENDING)
+    # Compiled once here; every /validate request reuses it
+    server.validator = ConfigValidator(CONFIG_SCHEMA, VALIDATION_CACHE_SIZE)
+    logger.info(f"🚀 Config Controller running on port 8080 ({SERVER_MODE} mode)")
     logger.info("📡 Available endpoints:")
     logger.info("   GET  /health - Health check")
     logger.info("   GET  /metrics - System metrics")
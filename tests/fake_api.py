@@ -0,0 +1,209 @@
+"""In-process fakes of the Kubernetes API (rollout.io resources) and of network devices"""
+import copy
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = '/apis/rollout.io/v1alpha1/'
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+class FakeKube:
+    """List, watch, get and status merge-patch for rollout.io resources, with expirable watch history.
+    
+    Watches end after watch_timeout seconds so clients reconnect, and expire() makes every
+    resourceVersion seen so far too old, as etcd compaction does: the next watch gets a 410.
+    """
+    
+    def __init__(self, watch_timeout=0.5):
+        self.watch_timeout = watch_timeout
+        self.cond = threading.Condition()
+        # (plural, namespace, name) -> object
+        self.objects = {}
+        # (resourceVersion, plural, type, object) in order
+        self.events = []
+        self.version = 100
+        self.expired_before = 0
+        self.lists = 0
+        self.conflicts = 0
+        self.patches = []
+        self.server = FakeServer(('127.0.0.1', 0), self.handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        """Shut the server down"""
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def bump(self, plural, event_type, obj):
+        """Give an object the next resourceVersion and record the watch event; caller holds the lock"""
+        self.version += 1
+        obj['metadata']['resourceVersion'] = str(self.version)
+        self.events.append((self.version, plural, event_type, copy.deepcopy(obj)))
+        self.cond.notify_all()
+    
+    def put(self, plural, obj):
+        """Create or replace an object (its status survives unless obj brings one)"""
+        obj = copy.deepcopy(obj)
+        metadata = obj['metadata']
+        key = (plural, metadata['namespace'], metadata['name'])
+        with self.cond:
+            old = self.objects.get(key)
+            metadata.setdefault('generation', 1)
+            if old is not None and 'status' not in obj:
+                obj['status'] = copy.deepcopy(old.get('status', {}))
+            self.objects[key] = obj
+            self.bump(plural, 'MODIFIED' if old else 'ADDED', obj)
+        return obj
+    
+    def delete(self, plural, namespace, name):
+        """Delete an object, telling watchers"""
+        with self.cond:
+            obj = self.objects.pop((plural, namespace, name))
+            self.bump(plural, 'DELETED', obj)
+    
+    def get(self, plural, namespace, name):
+        """Copy of an object, or None"""
+        with self.cond:
+            return copy.deepcopy(self.objects.get((plural, namespace, name)))
+    
+    def expire(self):
+        """Compact the watch history: clients resuming from any version seen so far get a 410"""
+        with self.cond:
+            self.expired_before = self.version + 1
+            self.events = []
+            self.cond.notify_all()
+    
+    def handler(self):
+        """Request handler class bound to this fake"""
+        kube = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def log_message(self, *args):
+                pass
+            
+            def send(self, code, body):
+                """JSON response"""
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def route(self):
+                """(plural, namespace, name, subresource, query) of the request"""
+                url = urlparse(self.path)
+                parts = url.path[len(API_PREFIX):].split('/')
+                namespace = ''
+                if parts[0] == 'namespaces':
+                    namespace, parts = parts[1], parts[2:]
+                parts += [''] * (3 - len(parts))
+                return parts[0], namespace, parts[1], parts[2], parse_qs(url.query)
+            
+            def do_GET(self):
+                plural, namespace, name, _, query = self.route()
+                if name:
+                    obj = kube.get(plural, namespace, name)
+                    self.send(200 if obj else 404, obj or {'kind': 'Status', 'code': 404})
+                elif 'watch' in query:
+                    self.watch(plural, namespace, int(query['resourceVersion'][0]))
+                else:
+                    with kube.cond:
+                        kube.lists += 1
+                        items = [copy.deepcopy(obj) for (p, ns, _), obj in kube.objects.items()
+                                 if p == plural and namespace in ('', ns)]
+                        self.send(200, {'items': items, 'metadata': {'resourceVersion': str(kube.version)}})
+            
+            def watch(self, plural, namespace, since):
+                """Stream events after since as chunked JSON lines until the watch times out"""
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                deadline = time.monotonic() + kube.watch_timeout
+                while True:
+                    with kube.cond:
+                        if since < kube.expired_before:
+                            batch = [{'type': 'ERROR', 'object': {'kind': 'Status', 'code': 410, 'message': 'too old resource version'}}]
+                        else:
+                            batch = [{'type': event_type, 'object': obj} for version, p, event_type, obj in kube.events
+                                     if version > since and p == plural and namespace in ('', obj['metadata']['namespace'])]
+                            since = kube.version
+                        if not batch and time.monotonic() < deadline:
+                            kube.cond.wait(max(0, deadline - time.monotonic()))
+                            continue
+                    for event in batch:
+                        line = json.dumps(event).encode() + b'\n'
+                        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+                    self.wfile.flush()
+                    if time.monotonic() >= deadline or (batch and batch[0]['type'] == 'ERROR'):
+                        break
+                self.wfile.write(b'0\r\n\r\n')
+            
+            def do_PATCH(self):
+                plural, namespace, name, subresource, _ = self.route()
+                patch = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with kube.cond:
+                    obj = kube.objects.get((plural, namespace, name))
+                    if obj is None or subresource != 'status':
+                        self.send(404, {'kind': 'Status', 'code': 404})
+                        return
+                    expected = patch.get('metadata', {}).get('resourceVersion')
+                    if expected and expected != obj['metadata']['resourceVersion']:
+                        kube.conflicts += 1
+                        self.send(409, {'kind': 'Status', 'code': 409})
+                        return
+                    status = obj.setdefault('status', {})
+                    for field, value in patch['status'].items():
+                        if value is None:
+                            status.pop(field, None)
+                        else:
+                            status[field] = value
+                    kube.patches.append(((plural, namespace, name), dict(patch['status'])))
+                    kube.bump(plural, 'MODIFIED', obj)
+                    self.send(200, obj)
+        
+        return Handler
+
+class FakeDevices:
+    """Device config endpoints that count pushes per device id and accept them, unless a
+    device has status codes queued in responses (device id -> codes, answered in order)"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pushes = {}
+        self.responses = {}
+        devices = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                device_id = body.get('deviceId')
+                with devices.lock:
+                    devices.pushes[device_id] = devices.pushes.get(device_id, 0) + 1
+                    queued = devices.responses.get(device_id)
+                    code = queued.pop(0) if queued else 200
+                self.send_response(code)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+        
+        self.server = FakeServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/config"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    
+    def stop(self):
+        """Shut the server down"""
+        self.server.shutdown()
+        self.server.server_close()
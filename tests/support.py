@@ -0,0 +1,12 @@
+"""Shared helpers for the controller tests"""
+import importlib.util
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load(filename, name):
+    """Import one of the single-file controllers (their file names aren't module names)"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
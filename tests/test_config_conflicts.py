@@ -0,0 +1,57 @@
+"""config_conflicts() in both controllers: the canary pre-flight and the dummy /validate"""
+import unittest
+
+from support import load
+
+CONTROLLERS = [load('canary-controller.py', 'canary_controller'), load('dummy-controller.py', 'dummy_controller')]
+
+def rule(name, source, action, protocol='any', port=None):
+    entry = {'name': name, 'source': source, 'action': action, 'protocol': protocol}
+    if port is not None:
+        entry['port'] = port
+    return entry
+
+class FirewallShadowingTest(unittest.TestCase):
+    
+    def check(self, rules):
+        return [controller.config_conflicts({'firewall': {'rules': rules}}) for controller in CONTROLLERS]
+    
+    def test_earliest_rule_decides_across_prefixes(self):
+        # The /24 deny comes first, so the /8 allow in between must not be reported instead
+        rules = [rule('deny-lan', '10.0.0.0/24', 'deny'),
+                 rule('allow-all', '10.0.0.0/8', 'allow'),
+                 rule('allow-ssh', '10.0.0.0/24', 'allow', 'tcp', 22)]
+        for errors, warnings in self.check(rules):
+            self.assertEqual([e['path'] for e in errors], ['$.firewall.rules[2]'])
+            self.assertIn('rules[0]', errors[0]['message'])
+            self.assertEqual(warnings, [])
+    
+    def test_same_action_is_redundant(self):
+        rules = [rule('allow-all', '10.0.0.0/8', 'allow'),
+                 rule('allow-ssh', '10.1.0.0/16', 'allow', 'tcp', 22)]
+        for errors, warnings in self.check(rules):
+            self.assertEqual(errors, [])
+            self.assertEqual([w['path'] for w in warnings], ['$.firewall.rules[1]'])
+    
+    def test_narrower_earlier_rule_shadows_nothing(self):
+        rules = [rule('deny-ssh', '10.0.0.0/24', 'deny', 'tcp', 22),
+                 rule('allow-tcp', '10.0.0.0/8', 'allow', 'tcp'),
+                 rule('allow-dns', '10.0.0.0/24', 'allow', 'udp', 53)]
+        for errors, warnings in self.check(rules):
+            self.assertEqual((errors, warnings), ([], []))
+
+class AddressConflictTest(unittest.TestCase):
+    
+    def test_overlapping_interfaces_and_unreachable_gateway(self):
+        config = {
+            'interfaces': [{'name': 'eth0', 'ip': '10.0.0.1/16'}, {'name': 'eth1', 'ip': '10.0.5.1/24'}],
+            'routing': [{'destination': '0.0.0.0/0', 'gateway': '192.168.1.1', 'interface': 'eth0'}]
+        }
+        for controller in CONTROLLERS:
+            errors, _ = controller.config_conflicts(config)
+            paths = [e['path'] for e in errors]
+            self.assertIn('$.interfaces[1].ip', paths)
+            self.assertIn('$.routing[0].gateway', paths)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Dummy controller /validate: request shapes, schema and cross-field errors, result cache"""
+import copy
+import json
+import logging
+import os
+import threading
+import unittest
+
+import requests
+
+from support import ROOT, load
+
+dc = load('dummy-controller.py', 'dummy_controller_validate')
+logging.disable(logging.CRITICAL)
+
+with open(os.path.join(ROOT, 'example-config.json')) as f:
+    EXAMPLE = json.load(f)
+
+class ValidateTest(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.server = dc.PooledHTTPServer(('127.0.0.1', 0), dc.ConfigController, workers=4, max_pending=8)
+        cls.server.validator = dc.ConfigValidator(dc.CONFIG_SCHEMA, 16)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_address[1]}/validate"
+    
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+    
+    def validate(self, body):
+        return requests.post(self.url, json=body, timeout=5)
+    
+    def config(self, **changes):
+        config = copy.deepcopy(EXAMPLE)
+        config.update(changes)
+        return config
+    
+    def test_wrapped_and_bare_documents_are_both_checked(self):
+        config = self.config(name='wrapped-or-bare')
+        wrapped = self.validate({'config': config, 'configVersion': 'v9'})
+        self.assertEqual(wrapped.status_code, 200, wrapped.json())
+        self.assertEqual(wrapped.json()['configVersion'], 'v9')
+        self.assertFalse(wrapped.json()['cached'])
+        
+        bare = self.validate(config)
+        self.assertEqual(bare.status_code, 200)
+        self.assertEqual(bare.json()['configVersion'], config['version'])
+        self.assertEqual(bare.json()['configHash'], wrapped.json()['configHash'])
+        self.assertTrue(bare.json()['cached'])
+    
+    def test_a_version_alone_is_not_a_config(self):
+        for body in ({'configVersion': 'v2.1.0'}, {}):
+            with self.subTest(body=body):
+                response = self.validate(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['errors'], [{'path': '$.config', 'message': 'is required'}])
+    
+    def test_schema_errors_name_their_path(self):
+        interfaces = copy.deepcopy(EXAMPLE['interfaces'])
+        interfaces[1]['ip'] = '10.0.0.300/24'
+        response = self.validate({'config': self.config(interfaces=interfaces)})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('$.interfaces[1].ip', [error['path'] for error in response.json()['errors']])
+    
+    def test_cross_field_conflicts_are_errors(self):
+        services = copy.deepcopy(EXAMPLE['services'])
+        services.append(dict(services[0], name='ssh-again'))
+        response = self.validate({'config': self.config(services=services)})
+        self.assertEqual(response.status_code, 400)
+        paths = [error['path'] for error in response.json()['errors']]
+        self.assertIn(f"$.services[{len(services) - 1}].port", paths)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Per-host adaptive concurrency limit and circuit breaker"""
+import asyncio
+import logging
+import unittest
+
+from support import load
+
+cc = load('canary-controller.py', 'canary_controller_limiter')
+logging.disable(logging.CRITICAL)
+
+class HostLimiterTest(unittest.TestCase):
+    
+    def run_on_loop(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 5))
+    
+    def test_cancelled_while_rate_limited_gives_the_slot_back(self):
+        async def scenario():
+            limiter = cc.HostLimiter('gw')
+            started = await limiter.acquire(rate=1)
+            waiting = asyncio.ensure_future(limiter.acquire(rate=1))
+            await asyncio.sleep(0.05)
+            self.assertEqual(limiter.in_flight, 2)
+            
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            self.assertEqual(limiter.in_flight, 1)
+            await limiter.release(started, cc.PushOutcome.OK)
+            self.assertTrue(limiter.idle())
+        
+        self.run_on_loop(scenario())
+    
+    def test_only_congestion_lowers_the_limit(self):
+        async def outcome_limit(outcome):
+            limiter = cc.HostLimiter('gw')
+            await limiter.release(await limiter.acquire(), outcome)
+            return limiter.limit
+        
+        initial = cc.HOST_CONCURRENCY_INITIAL
+        for outcome, expected in ((cc.PushOutcome.FAILED, initial),
+                                  (cc.PushOutcome.RETRYABLE, initial / 2),
+                                  (cc.PushOutcome.UNREACHABLE, initial / 2)):
+            with self.subTest(outcome=outcome):
+                self.assertEqual(self.run_on_loop(outcome_limit(outcome)), expected)
+    
+    def test_full_window_of_fast_successes_raises_the_limit(self):
+        async def scenario():
+            limiter = cc.HostLimiter('gw')
+            for _ in range(cc.HOST_CONCURRENCY_INITIAL):
+                await limiter.release(await limiter.acquire(), cc.PushOutcome.OK)
+            return limiter.limit
+        
+        self.assertEqual(self.run_on_loop(scenario()), cc.HOST_CONCURRENCY_INITIAL + 1)
+
+class CircuitBreakerTest(unittest.TestCase):
+    
+    def open_breaker(self):
+        breaker = cc.CircuitBreaker('gw')
+        for _ in range(cc.BREAKER_FAILURES):
+            breaker.record(cc.PushOutcome.UNREACHABLE)
+        breaker.opened_at -= cc.BREAKER_COOLDOWN
+        return breaker
+    
+    def test_one_probe_after_the_cooldown(self):
+        breaker = self.open_breaker()
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(cc.PushOutcome.OK)
+        self.assertTrue(breaker.clean())
+    
+    def test_abandoned_probe_lets_the_next_push_probe(self):
+        breaker = self.open_breaker()
+        self.assertTrue(breaker.allow())
+        breaker.abandon()
+        self.assertTrue(breaker.allow())
+
+if __name__ == '__main__':
+    unittest.main()
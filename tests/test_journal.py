@@ -0,0 +1,184 @@
+"""RolloutJournal: replay, compaction (at startup and while rollouts run) and resuming rollouts from it"""
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from fake_api import FakeDevices
+from support import load
+
+cc = load('canary-controller.py', 'canary_controller_journal')
+logging.disable(logging.CRITICAL)
+cc.DEVICE_TRANSPORT = 'http'
+cc.PREFLIGHT = False
+
+SPEC = {'config': {'payload': {'hostname': 'edge'}}, 'targetDevices': [{'id': 'd0'}], 'canarySteps': []}
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+class JournalTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'journal.log')
+    
+    def journal(self, compact_every=0):
+        return cc.RolloutJournal(self.path, 0.05, compact_every)
+    
+    def write(self, events, tail=b''):
+        with open(self.path, 'wb') as f:
+            f.writelines(json.dumps(event).encode() + b'\n' for event in events)
+            f.write(tail)
+    
+    def test_replay_folds_events_per_rollout(self):
+        self.write([
+            {'type': 'start', 'rolloutId': 'a', 'spec': SPEC, 'startTime': 't0', 'resource': ['networkrollouts', 'net', 'a']},
+            {'type': 'step', 'rolloutId': 'a', 'step': 0, 'window': [0, 5]},
+            {'type': 'device', 'rolloutId': 'a', 'deviceId': 'd0', 'ok': True},
+            {'type': 'start', 'rolloutId': 'b', 'spec': SPEC, 'startTime': 't1'},
+            {'type': 'step', 'rolloutId': 'a', 'step': 1, 'window': [5, 10]},
+            {'type': 'device', 'rolloutId': 'a', 'deviceId': 'd6', 'ok': False},
+            {'type': 'phase', 'rolloutId': 'b', 'phase': 'Failed', 'message': 'Aborted during pause'},
+            # Events of a rollout whose start was compacted away are ignored
+            {'type': 'device', 'rolloutId': 'gone', 'deviceId': 'd0', 'ok': True}
+        ], tail=b'{"type": "device", "rolloutId": "a", "devi')
+        
+        states = self.journal().replay()
+        self.assertEqual(set(states), {'a', 'b'})
+        a = states['a']
+        self.assertEqual((a['step'], a['window'], a['phase']), (1, [5, 10], 'Progressing'))
+        self.assertEqual(a['devices'], {'d0': True, 'd6': False})
+        self.assertEqual(a['resource'], ['networkrollouts', 'net', 'a'])
+        self.assertEqual((states['b']['phase'], states['b']['message']), ('Failed', 'Aborted during pause'))
+    
+    def test_startup_compaction_keeps_only_unfinished_rollouts(self):
+        self.write([
+            {'type': 'start', 'rolloutId': 'done', 'spec': SPEC, 'startTime': 't0'},
+            {'type': 'device', 'rolloutId': 'done', 'deviceId': 'd0', 'ok': True},
+            {'type': 'phase', 'rolloutId': 'done', 'phase': 'Completed'},
+            {'type': 'start', 'rolloutId': 'running', 'spec': SPEC, 'startTime': 't1', 'carried': {'completed': 3, 'failed': 1}},
+            {'type': 'step', 'rolloutId': 'running', 'step': 2, 'window': [4, 8]},
+            {'type': 'device', 'rolloutId': 'running', 'deviceId': 'd4', 'ok': True}
+        ])
+        journal = self.journal()
+        before = journal.replay()
+        journal.compact(before)
+        
+        after = journal.replay()
+        self.assertEqual(set(after), {'running'})
+        self.assertEqual(after['running'], before['running'])
+        with open(self.path) as f:
+            self.assertEqual(len(f.readlines()), 3)
+    
+    def test_live_compaction_loses_nothing_appended_meanwhile(self):
+        journal = self.journal()
+        journal.open()
+        expected = {}
+        stop = threading.Event()
+        
+        def rollout(worker):
+            # Each worker runs rollouts back to back and finishes most of them
+            rng = random.Random(worker)
+            for n in range(60):
+                rollout_id = f"w{worker}-{n}"
+                journal.record_start(rollout_id, SPEC, 't')
+                journal.record_step(rollout_id, 0, [0, 10])
+                devices = {f"d{i}": rng.random() < 0.9 for i in range(rng.randrange(1, 10))}
+                for device_id, ok in devices.items():
+                    journal.record_device(rollout_id, device_id, ok)
+                phase = 'Completed' if rng.random() < 0.7 else None
+                if phase:
+                    journal.record_phase(rollout_id, phase)
+                expected[rollout_id] = (phase or 'Progressing', devices)
+            stop.set()
+        
+        workers = [threading.Thread(target=rollout, args=(worker,)) for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        compactions = 0
+        while not stop.is_set() or compactions < 3:
+            journal.compacting = True
+            journal.compact_live()
+            compactions += 1
+        for worker in workers:
+            worker.join()
+        journal.sync()
+        
+        states = journal.replay()
+        running = {rollout_id for rollout_id, (phase, _) in expected.items() if phase == 'Progressing'}
+        self.assertTrue(running <= set(states))
+        for rollout_id, state in states.items():
+            phase, devices = expected[rollout_id]
+            self.assertEqual((state['phase'], state['devices']), (phase, devices))
+            self.assertEqual((state['step'], state['window']), (0, [0, 10]))
+    
+    def test_finished_rollouts_trigger_compaction(self):
+        journal = self.journal(compact_every=5)
+        journal.open()
+        for n in range(5):
+            journal.record_start(f"r{n}", SPEC, 't')
+            journal.record_phase(f"r{n}", 'Completed')
+        journal.record_start('running', SPEC, 't')
+        self.assertTrue(wait_for(lambda: not journal.compacting))
+        journal.sync()
+        self.assertEqual(set(journal.replay()), {'running'})
+
+class RecoveryTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.devices = FakeDevices()
+        self.server = cc.CanaryServer(('127.0.0.1', 0), cc.CanaryController)
+        self.server.journal = cc.RolloutJournal(os.path.join(self.directory, 'journal.log'), 0.05)
+    
+    def tearDown(self):
+        self.server.server_close()
+        self.devices.stop()
+        shutil.rmtree(self.directory)
+    
+    def test_restart_resumes_inside_the_interrupted_step(self):
+        spec = {
+            'config': {'payload': {'hostname': 'edge'}},
+            'targetDevices': [{'id': f"d{i}", 'apiEndpoint': self.devices.url} for i in range(10)],
+            'canarySteps': [{'percentage': 40, 'pauseDuration': '0s'}, {'percentage': 30, 'pauseDuration': '0s'},
+                            {'percentage': 30, 'pauseDuration': '0s'}]
+        }
+        events = [{'type': 'start', 'rolloutId': 'r1', 'spec': spec, 'startTime': '2026-01-01T00:00:00'},
+                  {'type': 'step', 'rolloutId': 'r1', 'step': 0, 'window': [0, 4]}]
+        events += [{'type': 'device', 'rolloutId': 'r1', 'deviceId': f"d{i}", 'ok': i != 2} for i in range(4)]
+        events += [{'type': 'step', 'rolloutId': 'r1', 'step': 1, 'window': [4, 7]},
+                   {'type': 'device', 'rolloutId': 'r1', 'deviceId': 'd5', 'ok': True},
+                   {'type': 'start', 'rolloutId': 'old', 'spec': spec, 'startTime': '2026-01-01T00:00:00'},
+                   {'type': 'phase', 'rolloutId': 'old', 'phase': 'Completed'}]
+        with open(self.server.journal.path, 'w') as f:
+            f.writelines(json.dumps(event) + '\n' for event in events)
+        
+        self.server.executor.recover_rollouts()
+        self.assertEqual(self.server.active_rollouts.ids(), ['r1'])
+        self.assertTrue(wait_for(lambda: 'r1' not in self.server.active_rollouts))
+        
+        summary = self.server.active_rollouts.get('r1')
+        self.assertEqual(summary['phase'], 'Completed')
+        self.assertEqual(summary['start_time'], '2026-01-01T00:00:00')
+        self.assertEqual(sorted(summary['failed_devices']), ['d2'])
+        self.assertEqual(len(summary['completed_devices']), 9)
+        # Only the devices without a journaled outcome, each once
+        self.assertEqual(self.devices.pushes, {'d4': 1, 'd6': 1, 'd7': 1, 'd8': 1, 'd9': 1})
+        
+        self.server.journal.sync()
+        self.assertEqual(self.server.journal.replay()['r1']['phase'], 'Completed')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+"""Kubernetes reconciler: informer, work queue, status writer, leases, generations and handoff"""
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from fake_api import FakeDevices, FakeKube
+from support import load
+
+cc = load('canary-controller.py', 'canary_controller_reconciler')
+logging.disable(logging.CRITICAL)
+# Real pushes to the fake devices (the default simulator sleeps seconds per device)
+cc.DEVICE_TRANSPORT = 'http'
+cc.STATUS_WRITE_INTERVAL = 0.1
+cc.JOURNAL_COMPACT_EVERY = 0
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+def network_rollout(name, generation, devices, steps, namespace='net'):
+    return {
+        'kind': 'NetworkRollout',
+        'metadata': {'namespace': namespace, 'name': name, 'generation': generation},
+        'spec': {'config': {'payload': {'hostname': name}}, 'targetDevices': devices, 'canarySteps': steps}
+    }
+
+class WorkQueueTest(unittest.TestCase):
+    
+    def test_key_waits_once_and_requeues_after_processing(self):
+        queue = cc.WorkQueue(1, 10)
+        queue.add('a')
+        queue.add('a')
+        self.assertEqual(list(queue.queue), ['a'])
+        
+        self.assertEqual(queue.get(), 'a')
+        queue.add('a')
+        queue.add('a')
+        # Changed while a worker has it: no second worker, one more pass afterwards
+        self.assertEqual(list(queue.queue), [])
+        queue.done('a')
+        self.assertEqual(list(queue.queue), ['a'])
+    
+    def test_rate_limited_requeues_back_off_until_forgotten(self):
+        queue = cc.WorkQueue(0.05, 0.15)
+        for _ in range(4):
+            queue.add_rate_limited('a')
+        now = time.monotonic()
+        delays = sorted(round(ready_at - now, 2) for ready_at, _, _ in queue.delayed)
+        self.assertEqual(len(delays), 4)
+        for delay, expected in zip(delays, (0.05, 0.1, 0.15, 0.15)):
+            self.assertAlmostEqual(delay, expected, delta=0.02)
+        
+        queue.forget('a')
+        queue.delayed.clear()
+        queue.add_rate_limited('a')
+        self.assertAlmostEqual(queue.delayed[0][0] - time.monotonic(), 0.05, delta=0.02)
+        # Due keys are moved to the queue by get()
+        self.assertEqual(queue.get(), 'a')
+
+class InformerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.kube = FakeKube()
+        self.queue = cc.WorkQueue(1, 10)
+        self.informer = cc.Informer(cc.KubeClient(self.kube.url), 'networkrollouts', '', self.queue)
+    
+    def tearDown(self):
+        self.kube.stop()
+    
+    def test_list_then_watch(self):
+        self.kube.put('networkrollouts', network_rollout('a', 1, [], []))
+        self.informer.start()
+        self.assertTrue(self.informer.synced.wait(5))
+        self.assertIn(('networkrollouts', 'net', 'a'), self.queue.queued)
+        
+        self.kube.put('networkrollouts', network_rollout('b', 1, [], []))
+        self.assertTrue(wait_for(lambda: self.informer.get('net', 'b') is not None))
+        self.assertIn(('networkrollouts', 'net', 'b'), self.queue.queued)
+        self.assertEqual(self.kube.lists, 1)
+    
+    def test_expired_watch_relists_and_queues_the_difference(self):
+        self.kube.put('networkrollouts', network_rollout('a', 1, [], []))
+        self.kube.put('networkrollouts', network_rollout('b', 1, [], []))
+        self.informer.start()
+        self.assertTrue(self.informer.synced.wait(5))
+        while self.queue.queue:
+            self.queue.done(self.queue.get())
+        
+        # Changes the watch history no longer has: only a relist can find them
+        self.kube.expire()
+        self.kube.put('networkrollouts', network_rollout('a', 2, [], []))
+        self.kube.delete('networkrollouts', 'net', 'b')
+        
+        self.assertTrue(wait_for(lambda: self.informer.get('net', 'b') is None))
+        self.assertEqual(self.informer.get('net', 'a')['metadata']['generation'], 2)
+        self.assertEqual(self.kube.lists, 2)
+        self.assertEqual(self.queue.queued, {('networkrollouts', 'net', 'a'), ('networkrollouts', 'net', 'b')})
+
+class StatusWriterTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.kube = FakeKube()
+        self.client = cc.KubeClient(self.kube.url)
+        self.key = ('networkrollouts', 'net', 'a')
+    
+    def tearDown(self):
+        self.kube.stop()
+    
+    def test_conflict_refetches_and_retries(self):
+        stale = self.kube.put('networkrollouts', network_rollout('a', 1, [], []))
+        self.kube.put('networkrollouts', network_rollout('a', 1, [], []))
+        writer = cc.StatusWriter(self.client, lambda key: stale, 0.1, 10)
+        
+        writer.write(self.key, {'phase': 'Progressing', 'observedGeneration': 1})
+        self.assertEqual(self.kube.conflicts, 1)
+        self.assertEqual(self.kube.get(*self.key)['status']['phase'], 'Progressing')
+    
+    def test_write_for_an_older_generation_is_dropped(self):
+        current = self.kube.put('networkrollouts', network_rollout('a', 2, [], []))
+        writer = cc.StatusWriter(self.client, lambda key: current, 0.1, 10)
+        
+        writer.write(self.key, {'phase': 'Completed', 'observedGeneration': 1})
+        self.assertEqual(self.kube.patches, [])
+
+class FileLeasesTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.keys = [f"net/rollout-{i}" for i in range(100)]
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    def test_update_is_compare_and_swap(self):
+        leases = cc.FileLeases(self.directory)
+        self.assertTrue(leases.update('lease', {'holder': 'a'}, None))
+        _, version = leases.get('lease')
+        self.assertTrue(leases.update('lease', {'holder': 'b'}, version))
+        self.assertFalse(leases.update('lease', {'holder': 'a'}, version))
+        self.assertEqual(leases.get('lease')[0]['holder'], 'b')
+    
+    def test_survivor_takes_over_when_a_member_stops_renewing(self):
+        a = cc.Membership(cc.FileLeases(self.directory), 'a', 0.6)
+        b = cc.Membership(cc.FileLeases(self.directory), 'b', 0.6)
+        for membership in (a, b, a, b):
+            membership.tick()
+        self.assertEqual(a.members, ('a', 'b'))
+        self.assertEqual(b.members, ('a', 'b'))
+        owned_by_a = {key for key in self.keys if a.owns(key)}
+        owned_by_b = {key for key in self.keys if b.owns(key)}
+        self.assertFalse(owned_by_a & owned_by_b)
+        self.assertEqual(owned_by_a | owned_by_b, set(self.keys))
+        self.assertTrue(owned_by_b)
+        
+        # b stops renewing: its lease runs out, and so does its claim on its keys
+        time.sleep(0.7)
+        a.tick()
+        self.assertEqual(a.members, ('a',))
+        self.assertTrue(all(a.owns(key) for key in self.keys))
+        self.assertFalse(any(b.owns(key) for key in self.keys))
+
+class ReconcilerTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.kube = FakeKube()
+        self.devices = FakeDevices()
+        self.server = cc.CanaryServer(('127.0.0.1', 0), cc.CanaryController, workers=2, max_pending=8)
+        self.reconciler = cc.RolloutReconciler(self.server, cc.KubeClient(self.kube.url))
+    
+    def tearDown(self):
+        self.server.server_close()
+        self.devices.stop()
+        self.kube.stop()
+    
+    def targets(self, count):
+        return [{'id': f"d{i}", 'apiEndpoint': self.devices.url} for i in range(count)]
+    
+    def phase(self, rollout_id):
+        rollout = self.server.active_rollouts.get(rollout_id)
+        return rollout and (rollout['phase'], rollout.get('message'))
+    
+    def test_new_generation_stops_the_old_one_and_deletion_stops_both(self):
+        steps = [{'percentage': 50, 'pauseDuration': '60s'}, {'percentage': 100, 'pauseDuration': '0s'}]
+        self.kube.put('networkrollouts', network_rollout('edge', 1, self.targets(4), steps))
+        self.reconciler.start()
+        self.assertTrue(wait_for(lambda: self.phase('net/edge@1') == ('Paused', None)))
+        
+        self.kube.put('networkrollouts', network_rollout('edge', 2, self.targets(4), steps))
+        self.assertTrue(wait_for(lambda: self.phase('net/edge@1') == ('Failed', 'Superseded by generation 2')))
+        self.assertTrue(wait_for(lambda: self.phase('net/edge@2') == ('Paused', None)))
+        self.assertTrue(wait_for(lambda: self.kube.get('networkrollouts', 'net', 'edge')['status'].get('rolloutId') == 'net/edge@2'))
+        
+        self.kube.delete('networkrollouts', 'net', 'edge')
+        self.assertTrue(wait_for(lambda: self.phase('net/edge@2') == ('Failed', 'Resource deleted')))
+        self.assertTrue(wait_for(lambda: self.server.active_rollouts.ids() == []))
+    
+    def test_handoff_resumes_inside_the_interrupted_step(self):
+        # 200 targets in steps of 10/40/50%: windows [0, 20), [20, 100), [100, 200)
+        spec = self.reconciler.rollout_spec('networkrollouts', {
+            'config': {'payload': {'hostname': 'core'}},
+            'targetDevices': self.targets(200),
+            'canarySteps': [{'percentage': 10, 'pauseDuration': '0s'}, {'percentage': 40, 'pauseDuration': '0s'},
+                            {'percentage': 50, 'pauseDuration': '0s'}]
+        })
+        # The previous owner was 30 devices into step 3; its completed list outgrew the cap
+        completed = 99 + 30
+        status = {
+            'phase': 'Progressing', 'currentStep': 3, 'rolloutId': 'net/core@1', 'owner': None,
+            'failedDevices': ['d7'] + [f"d{i}" for i in range(100, 105)],
+            'deviceCounts': {'total': 200, 'completed': completed, 'failed': 6},
+            'stepStartCounts': {'completed': 99, 'failed': 1}
+        }
+        resume = self.reconciler.handoff_state(status, spec)
+        self.assertEqual((resume['step'], resume['window']), (2, [100, 200]))
+        self.assertEqual(resume['carried'], {'completed': 99, 'failed': 0})
+        
+        self.server.executor.start_rollout('net/core@1', spec, resume)
+        self.assertTrue(wait_for(lambda: self.phase('net/core@1') == ('Completed', None)))
+        
+        # Nothing before the window again, everything in it without a known outcome, nothing twice
+        pushed = self.devices.pushes
+        self.assertEqual(set(pushed), {f"d{i}" for i in range(105, 200)})
+        self.assertEqual(set(pushed.values()), {1})
+        counts = self.reconciler.rollout_status('net/core@1', self.server.active_rollouts.get('net/core@1'), 1)['deviceCounts']
+        self.assertEqual(counts, {'total': 200, 'completed': 99 + 95, 'failed': 6})
+    
+    def test_journaled_resource_rollouts_wait_for_the_reconciler(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        steps = [{'percentage': 50, 'pauseDuration': '0s'}, {'percentage': 100, 'pauseDuration': '0s'}]
+        spec = network_rollout('kept', 1, self.targets(10), steps)['spec']
+        events = [
+            {'type': 'start', 'rolloutId': 'net/kept@1', 'spec': spec, 'startTime': '2026-01-01T00:00:00',
+             'resource': ['networkrollouts', 'net', 'kept']},
+            {'type': 'step', 'rolloutId': 'net/kept@1', 'step': 1, 'window': [5, 10]},
+            {'type': 'start', 'rolloutId': 'net/gone@1', 'spec': spec, 'startTime': '2026-01-01T00:00:00',
+             'resource': ['networkrollouts', 'net', 'gone']}
+        ]
+        events += [{'type': 'device', 'rolloutId': 'net/kept@1', 'deviceId': f"d{i}", 'ok': True} for i in range(7)]
+        with open(os.path.join(directory, 'journal.log'), 'w') as f:
+            f.writelines(json.dumps(event) + '\n' for event in events)
+        self.server.journal = cc.RolloutJournal(os.path.join(directory, 'journal.log'), 0.05)
+        self.kube.put('networkrollouts', network_rollout('kept', 1, self.targets(10), steps))
+        
+        self.server.executor.recover_rollouts(defer_resources=True)
+        self.assertEqual(set(self.server.executor.recovered), {'net/kept@1', 'net/gone@1'})
+        self.assertEqual(self.server.active_rollouts.ids(), [])
+        
+        self.reconciler.start()
+        self.assertTrue(wait_for(lambda: self.phase('net/kept@1') == ('Completed', None)))
+        self.assertTrue(wait_for(lambda: not self.server.executor.recovered))
+        self.assertEqual(set(self.devices.pushes), {'d7', 'd8', 'd9'})
+        self.server.journal.sync()
+        states = self.server.journal.replay()
+        self.assertEqual((states['net/gone@1']['phase'], states['net/gone@1']['message']), ('Failed', 'Resource deleted'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""RolloutRegistry (live records, finished summaries, history) and RolloutEvents"""
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from support import load
+
+cc = load('canary-controller.py', 'canary_controller_registry')
+
+def record(phase='Progressing', completed=(), failed=()):
+    return {'phase': phase, 'message': None, 'current_step': 1, 'start_time': 't',
+            'completed_devices': list(completed), 'failed_devices': list(failed),
+            'carried_counts': {'completed': 0, 'failed': 0}, 'max_concurrency': 16,
+            'device_table': cc.DeviceTable([{'id': 'd0'}, {'id': 'd1'}])}
+
+class RolloutRegistryTest(unittest.TestCase):
+    
+    def test_finish_compacts_a_terminal_rollout_to_its_summary(self):
+        registry = cc.RolloutRegistry(10, 3600)
+        registry.add('r1', record())
+        self.assertIsNone(registry.finish('r1'))
+        self.assertIn('r1', registry)
+        
+        registry.get('r1')['phase'] = 'Completed'
+        self.assertIsNotNone(registry.finish('r1'))
+        self.assertNotIn('r1', registry)
+        summary = registry.get('r1')
+        self.assertEqual(summary['phase'], 'Completed')
+        self.assertEqual(summary['total_devices'], 2)
+        self.assertIn('end_time', summary)
+        self.assertNotIn('device_table', summary)
+        self.assertNotIn('max_concurrency', summary)
+    
+    def test_summaries_are_capped_least_recently_used_first(self):
+        registry = cc.RolloutRegistry(2, 3600)
+        for rollout_id in ('a', 'b'):
+            registry.add(rollout_id, record('Completed'))
+            registry.finish(rollout_id)
+        registry.get('a')
+        registry.add('c', record('Completed'))
+        registry.finish('c')
+        self.assertIsNone(registry.get('b'))
+        self.assertIsNotNone(registry.get('a'))
+        self.assertIsNotNone(registry.get('c'))
+    
+    def test_summaries_idle_past_the_ttl_are_not_served(self):
+        registry = cc.RolloutRegistry(10, 0.2)
+        for rollout_id in ('polled', 'idle'):
+            registry.add(rollout_id, record('Failed'))
+            registry.finish(rollout_id)
+        deadline = time.monotonic() + 0.4
+        while time.monotonic() < deadline:
+            self.assertIsNotNone(registry.get('polled'))
+            time.sleep(0.05)
+        # Nothing else touched the registry, so only get() itself can notice the expiry
+        self.assertIsNone(registry.get('idle'))
+        self.assertIsNotNone(registry.get('polled'))
+    
+    def test_evicted_summaries_are_read_back_from_history(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        registry = cc.RolloutRegistry(1, 3600, directory)
+        for rollout_id in ('team/a', 'b'):
+            registry.add(rollout_id, record('Completed', completed=['d0', 'd1']))
+            registry.finish(rollout_id)
+        self.assertNotIn('team/a', registry.finished)
+        self.assertEqual(registry.get('team/a')['completed_devices'], ['d0', 'd1'])
+    
+    def test_restarting_an_id_replaces_its_summary(self):
+        registry = cc.RolloutRegistry(10, 3600)
+        registry.add('r1', record('Failed'))
+        registry.finish('r1')
+        registry.add('r1', record())
+        self.assertEqual(registry.get('r1')['phase'], 'Progressing')
+        self.assertEqual(registry.ids(), ['r1'])
+
+class RolloutEventsTest(unittest.TestCase):
+    
+    def test_waiters_wake_on_publish_and_see_the_close(self):
+        events = cc.RolloutEvents(100, 10)
+        events.publish('r1', 'phase', phase='Progressing')
+        self.assertEqual(events.wait('r1', 1, 0), ([], False, False))
+        
+        threading.Timer(0.1, events.publish, ('r1', 'step',), {'step': 1}).start()
+        started = time.monotonic()
+        batch, missed, closed = events.wait('r1', 1, 5)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual([(e['id'], e['type'], e['step']) for e in batch], [(2, 'step', 1)])
+        
+        events.close('r1')
+        self.assertEqual(events.wait('r1', 2, 5), ([], False, True))
+        self.assertIsNone(events.wait('unknown', 0, 0))
+    
+    def test_slow_subscribers_learn_what_they_missed(self):
+        events = cc.RolloutEvents(3, 10)
+        for n in range(5):
+            events.publish('r1', 'device', deviceId=f"d{n}")
+        batch, missed, _ = events.wait('r1', 0, 0)
+        self.assertTrue(missed)
+        self.assertEqual([e['id'] for e in batch], [3, 4, 5])
+        self.assertFalse(events.wait('r1', 2, 0)[1])
+    
+    def test_only_recent_finished_logs_are_kept(self):
+        events = cc.RolloutEvents(10, 2)
+        for rollout_id in ('a', 'b', 'c'):
+            events.publish(rollout_id, 'phase', phase='Completed')
+            events.close(rollout_id)
+        self.assertIsNone(events.wait('a', 0, 0))
+        self.assertEqual(len(events.wait('c', 0, 0)[0]), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+"""Canary controller HTTP API: starting rollouts and reading them back"""
+import logging
+import threading
+import time
+import unittest
+
+import requests
+
+from fake_api import FakeDevices
+from support import load
+
+cc = load('canary-controller.py', 'canary_controller_api')
+logging.disable(logging.CRITICAL)
+# Real pushes to the fake devices (the default simulator sleeps seconds per device)
+cc.DEVICE_TRANSPORT = 'http'
+cc.JOURNAL_COMPACT_EVERY = 0
+
+PAUSED = [{'percentage': 50, 'pauseDuration': '60s'}, {'percentage': 100, 'pauseDuration': '0s'}]
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+class RolloutApiTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.devices = FakeDevices()
+        self.server = cc.CanaryServer(('127.0.0.1', 0), cc.CanaryController, workers=4, max_pending=8)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+    
+    def tearDown(self):
+        for rollout_id in self.server.active_rollouts.ids():
+            self.server.executor.stop_rollout(rollout_id, 'Failed', 'Test finished')
+        wait_for(lambda: not self.server.active_rollouts.ids())
+        self.server.shutdown()
+        self.server.server_close()
+        self.devices.stop()
+    
+    def targets(self, count):
+        return [{'id': f"d{i}", 'apiEndpoint': self.devices.url} for i in range(count)]
+    
+    def start(self, steps=PAUSED, count=4, **fields):
+        body = {'config': {'payload': {'hostname': 'edge'}}, 'targetDevices': self.targets(count), 'canarySteps': steps}
+        return requests.post(f"{self.url}/start-rollout", json={**body, **fields}, timeout=5)
+    
+    def phase(self, rollout_id):
+        rollout = self.server.active_rollouts.get(rollout_id)
+        return rollout and rollout['phase']
+    
+    def test_live_rollout_id_cannot_be_started_again(self):
+        self.assertEqual(self.start(rolloutId='r1').status_code, 200)
+        self.assertTrue(wait_for(lambda: self.phase('r1') == 'Paused'))
+        
+        second = self.start(rolloutId='r1')
+        self.assertEqual(second.status_code, 409)
+        self.assertEqual(self.phase('r1'), 'Paused')
+        self.assertEqual(len(self.devices.pushes), 2)
+        
+        # Once finished the id is free again
+        self.server.executor.stop_rollout('r1', 'Failed', 'Stopped')
+        self.assertTrue(wait_for(lambda: 'r1' not in self.server.active_rollouts))
+        self.assertEqual(self.start(rolloutId='r1').status_code, 200)
+    
+    def test_pause_actions(self):
+        self.start(rolloutId='r1')
+        self.assertTrue(wait_for(lambda: self.phase('r1') == 'Paused'))
+        extended = requests.post(f"{self.url}/extend-pause", json={'rolloutId': 'r1', 'duration': '30s'}, timeout=5)
+        self.assertEqual(extended.status_code, 200)
+        self.assertGreater(extended.json()['remainingSeconds'], 60)
+        
+        promoted = requests.post(f"{self.url}/promote-rollout", json={'rolloutId': 'r1'}, timeout=5)
+        self.assertEqual(promoted.status_code, 200)
+        self.assertTrue(wait_for(lambda: 'r1' not in self.server.active_rollouts))
+        self.assertEqual(self.server.active_rollouts.get('r1')['phase'], 'Completed')
+        for action in ('promote-rollout', 'abort-rollout', 'extend-pause'):
+            self.assertEqual(requests.post(f"{self.url}/{action}", json={'rolloutId': 'r1'}, timeout=5).status_code, 409)
+    
+    def test_extending_a_pause_whose_rollout_is_gone(self):
+        # The rollout finished (and its summary was evicted) between extend() and reading the record
+        executor = self.server.executor
+        executor.call_on_loop(executor.pauses.pause, 'gone', 60)
+        response = requests.post(f"{self.url}/extend-pause", json={'rolloutId': 'gone'}, timeout=5)
+        self.assertEqual(response.status_code, 409)
+        executor.call_on_loop(executor.pauses.abort, 'gone')
+    
+    def status(self, rollout_id, headers=None, **options):
+        return requests.post(f"{self.url}/rollout-status", json={'rolloutId': rollout_id, **options},
+                             headers=headers, timeout=5)
+    
+    def test_full_status_shows_only_public_fields(self):
+        self.start(rolloutId='r1', maxConcurrency=4, retry={'maxAttempts': 2}, hostLimits={'maxInFlight': 2})
+        self.assertTrue(wait_for(lambda: self.phase('r1') == 'Paused'))
+        
+        view = self.status('r1').json()
+        self.assertEqual(set(view) - set(cc.STATUS_FIELDS), set())
+        self.assertEqual(view['phase'], 'Paused')
+        self.assertEqual([d['id'] for d in view['target_devices']], ['d0', 'd1', 'd2', 'd3'])
+        for internal in ('max_concurrency', 'host_limits', 'retry', 'device_timeout', 'carried_counts', 'step_start_counts'):
+            self.assertNotIn(internal, view)
+        # Asking for an internal field by name doesn't reveal it either
+        self.assertEqual(self.status('r1', fields='phase,retry').json(), {'phase': 'Paused'})
+    
+    def test_device_lists_are_paged(self):
+        self.start(rolloutId='r1', count=10)
+        self.assertTrue(wait_for(lambda: self.phase('r1') == 'Paused'))
+        
+        page = self.status('r1', fields=['target_devices', 'completed_devices'], offset=2, limit=3).json()
+        self.assertEqual([d['id'] for d in page['target_devices']], ['d2', 'd3', 'd4'])
+        self.assertEqual(len(page['completed_devices']), 3)
+        self.assertEqual(page['page'], {'offset': 2, 'limit': 3, 'totals': {'target_devices': 10, 'completed_devices': 5}})
+        
+        query = requests.post(f"{self.url}/rollout-status?rolloutId=r1&fields=target_devices&offset=8&limit=5", timeout=5)
+        self.assertEqual([d['id'] for d in query.json()['target_devices']], ['d8', 'd9'])
+    
+    def test_malformed_paging_options_are_rejected(self):
+        self.start(rolloutId='r1')
+        for options in ({'offset': -1}, {'limit': -5}, {'limit': 'ten'}, {'offset': 1.5}, {'sinceVersion': '-3'},
+                        {'limit': True}):
+            with self.subTest(options=options):
+                response = self.status('r1', **options)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('non-negative integer', response.json()['message'])
+    
+    def test_summary_delta_and_etag(self):
+        self.start(rolloutId='r1', count=6)
+        self.assertTrue(wait_for(lambda: self.phase('r1') == 'Paused'))
+        
+        summary = self.status('r1', fields='summary')
+        self.assertEqual(summary.json()['device_counts'], {'Pending': 3, 'InProgress': 0, 'Completed': 3, 'Failed': 0})
+        self.assertEqual(self.status('r1', headers={'If-None-Match': summary.headers['ETag']}, fields='summary').status_code, 304)
+        
+        delta = self.status('r1', sinceVersion=0).json()
+        self.assertEqual(sorted(d['id'] for d in delta['devices']), ['d0', 'd1', 'd2'])
+        self.assertTrue(delta['complete'])
+        self.assertEqual(self.status('r1', sinceVersion=delta['nextVersion']).json()['devices'], [])
+    
+    def test_retryable_answers_are_retried_and_rejections_are_not(self):
+        self.devices.responses = {'d0': [503, 503], 'd1': [400], 'd2': [429, 429, 429]}
+        retry = {'maxAttempts': 3, 'backoff': '0s'}
+        self.start(rolloutId='r1', steps=[{'percentage': 100, 'pauseDuration': '0s'}], retry=retry)
+        self.assertTrue(wait_for(lambda: 'r1' not in self.server.active_rollouts))
+        
+        summary = self.server.active_rollouts.get('r1')
+        self.assertEqual(sorted(summary['failed_devices']), ['d1', 'd2'])
+        self.assertEqual(self.devices.pushes, {'d0': 3, 'd1': 1, 'd2': 3, 'd3': 1})
+    
+    def events(self, rollout_id, **query):
+        return requests.get(f"{self.url}/rollouts/{rollout_id}/events", params=query, timeout=10)
+    
+    def test_long_poll_returns_new_events_and_the_close(self):
+        self.start(rolloutId='r1')
+        self.assertTrue(wait_for(lambda: self.phase('r1') == 'Paused'))
+        
+        first = self.events('r1', since=0, wait=0).json()
+        types = [event['type'] for event in first['events']]
+        self.assertEqual(types[:3], ['phase', 'preflight', 'step'])
+        self.assertEqual(types.count('device'), 2)
+        self.assertEqual(first['nextSince'], first['events'][-1]['id'])
+        self.assertFalse(first['closed'])
+        
+        threading.Timer(0.2, self.server.executor.stop_rollout, ('r1', 'Failed', 'Stopped')).start()
+        rest = self.events('r1', since=first['nextSince'], wait=5).json()
+        self.assertTrue(rest['events'])
+        self.assertTrue(wait_for(lambda: self.events('r1', since=first['nextSince'], wait=0).json()['closed']))
+        self.assertEqual(self.events('unknown', wait=0).status_code, 404)
+    
+    def test_event_stream_ends_after_the_rollout_finishes(self):
+        self.start(rolloutId='r1', steps=[{'percentage': 100, 'pauseDuration': '0s'}])
+        response = requests.get(f"{self.url}/rollouts/r1/events", headers={'Accept': 'text/event-stream'},
+                                stream=True, timeout=10)
+        self.assertEqual(response.headers['Content-type'], 'text/event-stream')
+        text = response.content.decode()
+        ids = [int(line[4:]) for line in text.splitlines() if line.startswith('id: ')]
+        self.assertEqual(ids, list(range(1, len(ids) + 1)))
+        self.assertIn('event: device', text)
+        self.assertTrue(text.rstrip().endswith('}'))
+        self.assertIn('"phase": "Completed"', text.split('event: phase')[-1])
+        
+        # Reconnecting with Last-Event-ID replays only what came after it
+        replay = requests.get(f"{self.url}/rollouts/r1/events?stream=1", headers={'Last-Event-ID': str(ids[-2])}, timeout=10)
+        self.assertEqual([line for line in replay.text.splitlines() if line.startswith('id: ')], [f"id: {ids[-1]}"])
+    
+    def test_generated_ids_are_unique(self):
+        ids = {self.start().json()['rolloutId'] for _ in range(5)}
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(set(self.server.active_rollouts.ids()), ids)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""StreamingRolloutParser: /start-rollout bodies arriving in arbitrary chunks"""
+import json
+import unittest
+
+from support import load
+
+cc = load('canary-controller.py', 'canary_controller_parser')
+
+def split_at(body, *offsets):
+    """The body as chunks cut at the given byte offsets"""
+    bounds = [0, *offsets, len(body)]
+    return [body[start:end] for start, end in zip(bounds, bounds[1:])]
+
+class StreamingRolloutParserTest(unittest.TestCase):
+    
+    def parse(self, chunks):
+        spec = cc.StreamingRolloutParser(chunks).parse()
+        if 'targetDevices' in spec:
+            spec['targetDevices'] = spec['targetDevices'].to_list()
+        return spec
+    
+    def assert_every_split_parses(self, document):
+        body = json.dumps(document).encode()
+        for offset in range(1, len(body)):
+            with self.subTest(offset=offset, at=body[offset - 1:offset + 1]):
+                self.assertEqual(self.parse(split_at(body, offset)), document)
+    
+    def test_numbers_split_inside_their_digits_exponent_or_sign(self):
+        self.assert_every_split_parses({'n': 12345678901234, 'f': 1.5e-07, 'g': -0.25, 'h': 2E+10, 'z': 0})
+    
+    def test_every_split_of_a_rollout(self):
+        self.assert_every_split_parses({
+            'rolloutId': 'r-1',
+            'config': {'payload': {'hostname': 'ré', 'mtu': 1500, 'ratio': 0.5, 'budget': 1e3}, 'flags': [True, False, None]},
+            'targetDevices': [{'id': 'd1', 'apiEndpoint': 'http://a/config'}, {'id': 'd2'}],
+            'canarySteps': [{'percentage': 50, 'duration': '1s'}, {'percentage': 100, 'duration': '0s'}],
+            'maxConcurrency': 8
+        })
+    
+    def test_one_byte_chunks(self):
+        document = {'targetDevices': [{'id': 'd1'}], 'canarySteps': [], 'n': 1.25e-3}
+        body = json.dumps(document).encode()
+        self.assertEqual(self.parse([body[i:i + 1] for i in range(len(body))]), document)
+    
+    def test_multibyte_characters_split_across_chunks(self):
+        body = json.dumps({'config': {'name': 'ünïcødé'}}, ensure_ascii=False).encode()
+        for offset in range(1, len(body)):
+            self.assertEqual(self.parse(split_at(body, offset)), {'config': {'name': 'ünïcødé'}})
+    
+    def test_malformed_bodies_are_rejected(self):
+        for body in (b'{"n": 1.5ex}', b'{"n": 1 2}', b'{"a": 1', b'[1]', b'{"a": 1} {}', b'{1: 2}'):
+            with self.subTest(body=body):
+                with self.assertRaises(ValueError):
+                    self.parse(split_at(body, len(body) // 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""HTTP API across sharded replicas: requests for a rollout reach the replica that runs it"""
+import logging
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from fake_api import FakeDevices
+from support import load
+
+cc = load('canary-controller.py', 'canary_controller_sharded')
+logging.disable(logging.CRITICAL)
+cc.DEVICE_TRANSPORT = 'http'
+cc.JOURNAL_COMPACT_EVERY = 0
+
+PAUSED = [{'percentage': 50, 'pauseDuration': '60s'}, {'percentage': 100, 'pauseDuration': '0s'}]
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+class ShardedApiTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.devices = FakeDevices()
+        self.directory = tempfile.mkdtemp()
+        self.servers = []
+        for _ in range(2):
+            server = cc.CanaryServer(('127.0.0.1', 0), cc.CanaryController, workers=4, max_pending=8)
+            identity = f"127.0.0.1:{server.server_address[1]}"
+            server.router = cc.PeerRouter(cc.Membership(cc.FileLeases(self.directory), identity, 30), 'http://{identity}')
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        # The first replica leads; its second tick publishes both members
+        for server in self.servers + self.servers:
+            server.router.membership.tick()
+        self.a, self.b = self.servers
+    
+    def tearDown(self):
+        for server in self.servers:
+            for rollout_id in server.active_rollouts.ids():
+                server.executor.stop_rollout(rollout_id, 'Failed', 'Test finished')
+            wait_for(lambda: not server.active_rollouts.ids())
+            server.shutdown()
+            server.server_close()
+        self.devices.stop()
+        shutil.rmtree(self.directory)
+    
+    def url(self, server, path):
+        return f"http://{server.router.membership.identity}{path}"
+    
+    def owned_by(self, server, prefix='r'):
+        """A rollout id whose owner is server"""
+        identity = server.router.membership.identity
+        return next(f"{prefix}{n}" for n in range(1000) if server.router.owner(f"{prefix}{n}") == identity)
+    
+    def start(self, via, **fields):
+        body = {'config': {'payload': {'hostname': 'edge'}}, 'canarySteps': PAUSED,
+                'targetDevices': [{'id': f"d{i}", 'apiEndpoint': self.devices.url} for i in range(4)]}
+        return requests.post(self.url(via, '/start-rollout'), json={**body, **fields}, timeout=5)
+    
+    def phase(self, server, rollout_id):
+        rollout = server.active_rollouts.get(rollout_id)
+        return rollout and rollout['phase']
+    
+    def test_both_replicas_agree_on_owners(self):
+        self.assertEqual(self.a.router.membership.members, self.b.router.membership.members)
+        self.assertEqual(len(self.a.router.membership.members), 2)
+        rollout_id = self.owned_by(self.a)
+        self.assertEqual(self.b.router.peers(rollout_id), [self.a.router.membership.identity])
+    
+    def test_rollouts_run_on_their_owner_whichever_replica_is_asked(self):
+        rollout_id = self.owned_by(self.b)
+        response = self.start(self.a, rolloutId=rollout_id)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.json()['rolloutId'], rollout_id)
+        self.assertTrue(wait_for(lambda: self.phase(self.b, rollout_id) == 'Paused'))
+        self.assertIsNone(self.a.active_rollouts.get(rollout_id))
+        self.assertEqual(self.start(self.a, rolloutId=rollout_id).status_code, 409)
+        
+        # Generated ids are routed the same way
+        generated = self.start(self.a).json()['rolloutId']
+        owner = self.a if self.a.router.owner(generated) == self.a.router.membership.identity else self.b
+        self.assertIn(generated, owner.active_rollouts)
+    
+    def test_status_events_and_pause_actions_reach_the_owner(self):
+        rollout_id = self.owned_by(self.b)
+        self.start(self.b, rolloutId=rollout_id)
+        self.assertTrue(wait_for(lambda: self.phase(self.b, rollout_id) == 'Paused'))
+        
+        status = requests.post(self.url(self.a, '/rollout-status'), json={'rolloutId': rollout_id, 'fields': 'summary'}, timeout=5)
+        self.assertEqual(status.status_code, 200)
+        self.assertEqual(status.json()['phase'], 'Paused')
+        cached = requests.post(self.url(self.a, '/rollout-status'), json={'rolloutId': rollout_id, 'fields': 'summary'},
+                               headers={'If-None-Match': status.headers['ETag']}, timeout=5)
+        self.assertEqual(cached.status_code, 304)
+        
+        polled = requests.get(self.url(self.a, f"/rollouts/{rollout_id}/events"), params={'wait': 0}, timeout=5)
+        self.assertEqual(polled.status_code, 200)
+        self.assertEqual(polled.json()['events'][0]['type'], 'phase')
+        
+        promoted = requests.post(self.url(self.a, '/promote-rollout'), json={'rolloutId': rollout_id}, timeout=5)
+        self.assertEqual(promoted.status_code, 200)
+        stream = requests.get(self.url(self.a, f"/rollouts/{rollout_id}/events"),
+                              headers={'Accept': 'text/event-stream'}, timeout=10)
+        self.assertEqual(stream.headers['Content-type'], 'text/event-stream')
+        self.assertIn('"phase": "Completed"', stream.text.split('event: phase')[-1])
+    
+    def test_rollouts_are_found_off_their_owner(self):
+        # Recovered from a journal, or started before the shard map changed
+        rollout_id = self.owned_by(self.a)
+        self.b.executor.start_rollout(rollout_id, {
+            'config': {'payload': {'hostname': 'edge'}}, 'canarySteps': PAUSED,
+            'targetDevices': [{'id': 'd0', 'apiEndpoint': self.devices.url}]})
+        self.assertTrue(wait_for(lambda: self.phase(self.b, rollout_id) == 'Paused'))
+        
+        for server in self.servers:
+            with self.subTest(via=server.router.membership.identity):
+                status = requests.post(self.url(server, '/rollout-status'), json={'rolloutId': rollout_id}, timeout=5)
+                self.assertEqual(status.json()['phase'], 'Paused')
+        aborted = requests.post(self.url(self.a, '/abort-rollout'), json={'rolloutId': rollout_id}, timeout=5)
+        self.assertEqual(aborted.status_code, 200)
+        self.assertTrue(wait_for(lambda: self.phase(self.b, rollout_id) == 'Failed'))
+    
+    def test_unknown_ids_get_the_usual_answers(self):
+        for server in self.servers:
+            with self.subTest(via=server.router.membership.identity):
+                status = requests.post(self.url(server, '/rollout-status'), json={'rolloutId': 'missing'}, timeout=5)
+                self.assertEqual(status.status_code, 404)
+                events = requests.get(self.url(server, '/rollouts/missing/events'), params={'wait': 0}, timeout=5)
+                self.assertEqual(events.status_code, 404)
+                promoted = requests.post(self.url(server, '/promote-rollout'), json={'rolloutId': 'missing'}, timeout=5)
+                self.assertEqual(promoted.status_code, 409)
+    
+    def test_unreachable_owner_is_a_503(self):
+        rollout_id = self.owned_by(self.b)
+        self.b.shutdown()
+        self.b.server_close()
+        response = self.start(self.a, rolloutId=rollout_id)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('unreachable', response.json()['message'])
+        self.assertIsNone(self.a.active_rollouts.get(rollout_id))
+        self.servers.remove(self.b)
+
+if __name__ == '__main__':
+    unittest.main()